@@ -0,0 +1,254 @@
+# app/archive.py
+"""
+Cold tier for old detections.
+
+Detections stored more than ARCHIVE_AFTER_DAYS ago are moved out of
+`syndrome_detections` into `detection_archive_segments`. Archival is opt-in:
+with ARCHIVE_AFTER_DAYS=0, the default, nothing is archived. Each segment holds
+the detections of one case or normal user from one archival batch, stored
+column by column (one JSON array per column) and zlib-compressed. The hot table
+and its indexes, including the full-text index, keep only recent rows.
+
+Archival runs as the `detections.archive` background job in batches of
+ARCHIVE_BATCH_SIZE rows, one transaction each. A scheduler thread enqueues the
+job every ARCHIVE_INTERVAL_SECONDS unless one is already queued or running, and
+admins can enqueue it with POST /admin/archive. Archived rows are read only
+when a list endpoint is called with `include_archived=true`. They are not in
+the sync change stream and are read-only; deleting their owner deletes them.
+Their image and thumbnail files stay in media storage; the URLs are listed in
+`archived_media` so the media garbage collector keeps them.
+"""
+
+import json
+import logging
+import os
+import threading
+import zlib
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Iterable, List, Optional
+
+from sqlalchemy import DateTime, bindparam, text
+from sqlalchemy.orm import Session
+
+from . import jobs, models, search
+from .database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", 0))  # 0 (the default) turns archival off
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", 1000))
+ARCHIVE_BATCH_PAUSE = float(os.getenv("ARCHIVE_BATCH_PAUSE", 0.05))
+ARCHIVE_INTERVAL_SECONDS = float(os.getenv("ARCHIVE_INTERVAL_SECONDS", 3600))
+
+JOB_KIND = "detections.archive"
+COLUMNS = [column.name for column in models.SyndromeDetection.__table__.columns]
+
+
+def backfill_created_at(engine, chunk_size: int = 1000) -> None:
+    """
+    Give detections that predate `created_at` the time of the upgrade, so they age
+    from then on. date_of_detection is the client's word, not when the row was stored.
+    """
+    now = datetime.utcnow()
+    filled = 0
+    update = text(
+        "UPDATE syndrome_detections SET created_at = :created_at WHERE id IN "
+        "(SELECT id FROM syndrome_detections WHERE created_at IS NULL LIMIT :limit)"
+    ).bindparams(bindparam("created_at", type_=DateTime))
+    while True:
+        with engine.begin() as conn:
+            count = conn.execute(update, {"created_at": now, "limit": chunk_size}).rowcount
+        filled += count
+        if count < chunk_size:
+            break
+    if filled:
+        logger.info(f"Set created_at on {filled} detections.")
+
+
+def backfill_archived_media(engine) -> None:
+    """List the media of segments archived before `archived_media` existed (every segment holds at least one URL)."""
+    db = SessionLocal(bind=engine)
+    try:
+        segments = db.query(models.DetectionArchiveSegment).filter(
+            ~db.query(models.ArchivedMedia.id).filter(
+                models.ArchivedMedia.segment_id == models.DetectionArchiveSegment.id
+            ).exists()
+        ).all()
+        for segment in segments:
+            _add_media(db, segment.id, decode_segment(segment.data))
+        db.commit()
+        if segments:
+            logger.info(f"Listed the media of {len(segments)} archive segments.")
+    finally:
+        db.close()
+
+
+# --------------------------------------
+# Segment encoding
+# --------------------------------------
+
+def _plain(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def encode_segment(rows: List[models.SyndromeDetection]) -> bytes:
+    columns = {name: [_plain(getattr(row, name)) for row in rows] for name in COLUMNS}
+    return zlib.compress(json.dumps(columns, separators=(",", ":")).encode(), 6)
+
+
+def decode_segment(data: bytes) -> List[dict]:
+    columns = json.loads(zlib.decompress(data))
+    names = list(columns)
+    return [dict(zip(names, values)) for values in zip(*columns.values())]
+
+
+def _media_urls(rows) -> List[str]:
+    return [url for row in rows for url in (_get(row, "image_url"), _get(row, "thumbnail_url")) if url]
+
+
+def _get(row, name):
+    return row.get(name) if isinstance(row, dict) else getattr(row, name)
+
+
+def _add_media(db: Session, segment_id: int, rows) -> None:
+    db.add_all(models.ArchivedMedia(segment_id=segment_id, url=url) for url in _media_urls(rows))
+
+
+# --------------------------------------
+# Archiving
+# --------------------------------------
+
+def archive_batch(db: Session, batch_size: int = ARCHIVE_BATCH_SIZE) -> int:
+    """Move up to `batch_size` of the oldest eligible detections into segments; returns how many moved."""
+    if ARCHIVE_AFTER_DAYS <= 0:
+        return 0
+    cutoff = datetime.utcnow() - timedelta(days=ARCHIVE_AFTER_DAYS)
+    rows = (
+        db.query(models.SyndromeDetection)
+        .filter(models.SyndromeDetection.created_at < cutoff)
+        .order_by(models.SyndromeDetection.created_at, models.SyndromeDetection.id)
+        .limit(batch_size)
+        .all()
+    )
+    if not rows:
+        return 0
+
+    owners = defaultdict(list)
+    for row in rows:
+        owner = ("case", row.case_id) if row.case_id is not None else ("normal_user", row.normal_user_id)
+        owners[owner].append(row)
+    for (owner_type, owner_id), group in owners.items():
+        segment = models.DetectionArchiveSegment(
+            owner_type=owner_type,
+            owner_id=owner_id,
+            row_count=len(group),
+            first_id=min(row.id for row in group),
+            last_id=max(row.id for row in group),
+            oldest_at=min(row.created_at for row in group),
+            newest_at=max(row.created_at for row in group),
+            data=encode_segment(group),
+        )
+        db.add(segment)
+        db.flush()
+        _add_media(db, segment.id, group)
+
+    ids = [row.id for row in rows]
+    search.remove_detections(db, ids)
+    deleted = db.query(models.SyndromeDetection).filter(models.SyndromeDetection.id.in_(ids)).delete(synchronize_session=False)
+    if deleted != len(ids):
+        # Another worker archived, or a deletion removed, some of these first; the next run picks up the rest
+        db.rollback()
+        return 0
+    db.commit()
+    return len(ids)
+
+
+def schedule(db: Session) -> Optional[models.Job]:
+    """Enqueue an archival run unless one is already queued or running. The caller commits."""
+    pending = db.query(models.Job.id).filter(
+        models.Job.kind == JOB_KIND, models.Job.status.in_(("queued", "running"))
+    ).first()
+    if pending:
+        return None
+    return jobs.enqueue(db, JOB_KIND, {})
+
+
+_stopping = threading.Event()
+_thread: Optional[threading.Thread] = None
+
+
+def _run_scheduler() -> None:
+    while not _stopping.wait(ARCHIVE_INTERVAL_SECONDS):
+        db = SessionLocal()
+        try:
+            schedule(db)
+            db.commit()
+        except Exception:
+            logger.exception("Scheduling detection archival failed")
+        finally:
+            db.close()
+
+
+def start() -> None:
+    global _thread
+    if ARCHIVE_AFTER_DAYS <= 0 or _thread is not None:
+        return
+    _stopping.clear()
+    _thread = threading.Thread(target=_run_scheduler, name="archive-scheduler", daemon=True)
+    _thread.start()
+
+
+def stop() -> None:
+    global _thread
+    _stopping.set()
+    if _thread is not None:
+        _thread.join(5)
+        _thread = None
+
+
+# --------------------------------------
+# Reading and deleting
+# --------------------------------------
+
+def _segments(db: Session, owner_type: Optional[str], owner_ids: Optional[Iterable[int]]):
+    query = db.query(models.DetectionArchiveSegment)
+    if owner_type is None:
+        return query.order_by(models.DetectionArchiveSegment.id)
+    # Owner by owner, oldest batch first: the order the owner index already returns them in
+    return query.filter(
+        models.DetectionArchiveSegment.owner_type == owner_type,
+        models.DetectionArchiveSegment.owner_id.in_(list(owner_ids)),
+    ).order_by(models.DetectionArchiveSegment.owner_id, models.DetectionArchiveSegment.id)
+
+
+def archived_detections(
+    db: Session,
+    names: Optional[List[str]] = None,
+    case_ids: Optional[Iterable[int]] = None,
+    normal_user_ids: Optional[Iterable[int]] = None,
+) -> List[dict]:
+    """Archived detections of the given cases or users (all of them when neither is given), oldest batches first per owner."""
+    if case_ids is not None:
+        segments = _segments(db, "case", case_ids)
+    elif normal_user_ids is not None:
+        segments = _segments(db, "normal_user", normal_user_ids)
+    else:
+        segments = _segments(db, None, None)
+    rows = [row for segment in segments for row in decode_segment(segment.data)]
+    if names is not None:
+        rows = [{name: row.get(name) for name in names} for row in rows]
+    return rows
+
+
+def delete_archived(db: Session, owner_type: str, owner_ids: List[int]) -> dict:
+    """Delete the archive of some cases or users; the caller commits, then removes the returned media."""
+    segments = _segments(db, owner_type, owner_ids).all()
+    rows = [row for segment in segments for row in decode_segment(segment.data)]
+    if segments:
+        segment_ids = [segment.id for segment in segments]
+        db.query(models.ArchivedMedia).filter(models.ArchivedMedia.segment_id.in_(segment_ids)).delete(synchronize_session=False)
+        db.query(models.DetectionArchiveSegment).filter(
+            models.DetectionArchiveSegment.id.in_(segment_ids)
+        ).delete(synchronize_session=False)
+    return {"detections": len(rows), "media": _media_urls(rows)}
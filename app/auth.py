@@ -1,43 +1,186 @@
 # app/auth.py
 
+import hashlib
 import os
+import secrets
 from datetime import datetime, timedelta
-from typing import Optional, Union
+from functools import lru_cache
+from typing import Optional, Tuple, Union
 
-from jose import JWTError, jwt
-from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 
-from . import schemas, models, crud
-from .database import SessionLocal
+from . import schemas, models, crud, revocation
+from .database import get_db
 from sqlalchemy.orm import Session
 
 # Load environment variables
 SECRET_KEY = os.getenv("SECRET_KEY", "your_secret_key")
 ALGORITHM = os.getenv("ALGORITHM", "HS256")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", 30))
+# A refresh token lapses after REFRESH_TOKEN_EXPIRE_DAYS unused; each refresh slides that window,
+# up to REFRESH_SESSION_MAX_DAYS after the password login that started the session.
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", 14))
+REFRESH_SESSION_MAX_DAYS = int(os.getenv("REFRESH_SESSION_MAX_DAYS", 90))
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login")
+optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login", auto_error=False)
+
+
+# passlib and jose (with its crypto backend) are imported on first use, not at startup
+@lru_cache(maxsize=None)
+def get_pwd_context():
+    from passlib.context import CryptContext
+    return CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 
 def get_password_hash(password: str) -> str:
-    return pwd_context.hash(password)
+    return get_pwd_context().hash(password)
 
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+    return get_pwd_context().verify(plain_password, hashed_password)
 
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
+    from jose import jwt
+
     to_encode = data.copy()
-    expire = datetime.utcnow() + (expires_delta or timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
-    to_encode.update({"exp": expire})
+    now = datetime.utcnow()
+    expire = now + (expires_delta or timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
+    # jti and iat let a single token, or all of an account's earlier tokens, be revoked
+    to_encode.update({"exp": expire, "iat": now, "jti": secrets.token_hex(16)})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
 
+def create_signed_token(claims: dict, expires_in_seconds: int) -> str:
+    """
+    Sign short-lived grant claims (e.g. uploads) with the app secret. The claims
+    carry a `purpose`, which get_current_user refuses, so a grant is never a login.
+    """
+    from jose import jwt
+
+    to_encode = dict(claims, exp=datetime.utcnow() + timedelta(seconds=expires_in_seconds))
+    return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+
+
+def decode_signed_token(token: str) -> Optional[dict]:
+    from jose import JWTError, jwt
+
+    try:
+        return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        return None
+
+
+# Refresh tokens: opaque random strings, stored only as a sha256 digest. A fast hash
+# suffices because the tokens carry 256 bits of entropy, unlike passwords.
+def hash_refresh_token(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def issue_refresh_token(db: Session, user_type: str, user_id: int, email: str,
+                        family_id: Optional[str] = None, session_expires_at: Optional[datetime] = None) -> str:
+    """Add a refresh token to the session (the caller commits) and return its plaintext."""
+    now = datetime.utcnow()
+    session_expires_at = session_expires_at or now + timedelta(days=REFRESH_SESSION_MAX_DAYS)
+    token = secrets.token_urlsafe(32)
+    db.add(models.RefreshToken(
+        token_hash=hash_refresh_token(token),
+        family_id=family_id or secrets.token_hex(16),
+        user_type=user_type,
+        user_id=user_id,
+        email=email,
+        created_at=now,
+        expires_at=min(now + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS), session_expires_at),
+        session_expires_at=session_expires_at,
+    ))
+    return token
+
+
+def create_session_tokens(db: Session, user_type: str, user_id: int, email: str) -> dict:
+    """Access and refresh token for a fresh password login."""
+    # Drop the account's lapsed tokens; live and recently spent ones stay for reuse detection
+    db.query(models.RefreshToken).filter(
+        models.RefreshToken.user_type == user_type,
+        models.RefreshToken.user_id == user_id,
+        models.RefreshToken.expires_at < datetime.utcnow(),
+    ).delete(synchronize_session=False)
+    refresh_token = issue_refresh_token(db, user_type, user_id, email)
+    db.commit()
+    return {
+        "access_token": create_access_token(data={"sub": email, "user_type": user_type, "user_id": user_id}),
+        "refresh_token": refresh_token,
+        "expires_in": ACCESS_TOKEN_EXPIRE_MINUTES * 60,
+    }
+
+
+def rotate_refresh_token(db: Session, token: str) -> Tuple[models.RefreshToken, str]:
+    """
+    Spend a refresh token and issue its successor in the same family. Presenting
+    an already spent token means it was copied, so its whole family is revoked.
+    """
+    invalid = HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid or expired refresh token.")
+    row = db.query(models.RefreshToken).filter(models.RefreshToken.token_hash == hash_refresh_token(token)).first()
+    if row is None:
+        raise invalid
+    now = datetime.utcnow()
+    # Only one request can spend a token: the UPDATE matches while it is still unrevoked
+    spent = (
+        db.query(models.RefreshToken)
+        .filter(models.RefreshToken.id == row.id, models.RefreshToken.revoked_at.is_(None))
+        .update({"revoked_at": now}, synchronize_session=False)
+    )
+    if not spent:
+        revoke_refresh_family(db, row.family_id)
+        db.commit()
+        raise invalid
+    if row.expires_at <= now:
+        db.commit()
+        raise invalid
+    new_token = issue_refresh_token(db, row.user_type, row.user_id, row.email,
+                                    family_id=row.family_id, session_expires_at=row.session_expires_at)
+    db.commit()
+    return row, new_token
+
+
+def revoke_refresh_family(db: Session, family_id: str) -> int:
+    return (
+        db.query(models.RefreshToken)
+        .filter(models.RefreshToken.family_id == family_id, models.RefreshToken.revoked_at.is_(None))
+        .update({"revoked_at": datetime.utcnow()}, synchronize_session=False)
+    )
+
+
+def revoke_refresh_token(db: Session, token: str) -> bool:
+    """Log out: revoke the session the token belongs to. The caller commits."""
+    row = db.query(models.RefreshToken.family_id).filter(
+        models.RefreshToken.token_hash == hash_refresh_token(token)
+    ).first()
+    if row is None:
+        return False
+    revoke_refresh_family(db, row.family_id)
+    return True
+
+
+def revoke_user_sessions(db: Session, user_type: str, user_id: int) -> int:
+    """
+    End every session of an account: its refresh tokens, and the access tokens
+    already issued to it. The caller commits.
+    """
+    revocation.revocations.revoke_principal(db, user_type, user_id, timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
+    return (
+        db.query(models.RefreshToken)
+        .filter(
+            models.RefreshToken.user_type == user_type,
+            models.RefreshToken.user_id == user_id,
+            models.RefreshToken.revoked_at.is_(None),
+        )
+        .update({"revoked_at": datetime.utcnow()}, synchronize_session=False)
+    )
+
+
 # def authenticate_user(db: Session, email: str, password: str) -> Optional[Union[models.Admin, models.Doctor, models.NormalUser]]:
 #     user = crud.get_admin_by_email(db, email)
 #     if user and verify_password(password, user.hashed_password):
@@ -57,7 +200,9 @@ def authenticate_user(db: Session, email: str, password: str) -> Optional[Union[
             return user
     return None
 
-def get_current_user(db: Session = Depends(SessionLocal), token: str = Depends(oauth2_scheme)) -> Union[models.Admin, models.Doctor, models.NormalUser]:
+def get_current_user(db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)) -> Union[models.Admin, models.Doctor, models.NormalUser]:
+    from jose import JWTError, jwt
+
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials.",
@@ -65,6 +210,9 @@ def get_current_user(db: Session = Depends(SessionLocal), token: str = Depends(o
     )
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        # Grants from create_signed_token share the secret but are not access tokens
+        if "purpose" in payload:
+            raise credentials_exception
         email: str = payload.get("sub")
         user_type: str = payload.get("user_type")
         user_id: int = payload.get("user_id")
@@ -73,6 +221,8 @@ def get_current_user(db: Session = Depends(SessionLocal), token: str = Depends(o
         token_data = schemas.TokenData(email=email, user_type=user_type, user_id=user_id)
     except JWTError:
         raise credentials_exception
+    if revocation.revocations.is_revoked(db, payload):
+        raise credentials_exception
 
     if user_type == "admin":
         user = crud.get_admin_by_email(db, email)
@@ -0,0 +1,141 @@
+# app/changes.py
+"""
+Change stream for incremental detection sync.
+
+Every insert or update of a detection stamps it with the next value of the
+`detections` change counter, and every deletion leaves a tombstone stamped the
+same way. A client that remembers the highest sequence it has seen can ask
+for exactly what changed after it.
+
+Sequence numbers come from a single counter row that is updated inside the
+writer's transaction. That row stays locked until the writer commits, so
+sequences become visible in the order they were handed out, and a client never
+skips a lower number that commits late. Tombstones older than
+TOMBSTONE_RETENTION_DAYS are purged. A sync token older than the newest purged
+tombstone is refused, and the client must download everything again.
+"""
+
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Iterable, Optional
+
+from sqlalchemy import func, insert, text
+from sqlalchemy.orm import Session
+
+from . import models
+
+logger = logging.getLogger(__name__)
+
+TOMBSTONE_RETENTION_DAYS = int(os.getenv("TOMBSTONE_RETENTION_DAYS", 90))
+PURGE_INTERVAL_SECONDS = 3600
+
+COUNTER = "detections"
+HORIZON = "detections_tombstone_horizon"
+
+_last_purge = 0.0
+
+
+def init_change_tracking(engine) -> None:
+    """Create the counters and number detections that predate change tracking."""
+    with engine.begin() as conn:
+        unnumbered = conn.execute(text("SELECT COUNT(*) FROM syndrome_detections WHERE change_seq IS NULL")).scalar()
+        if unnumbered:
+            # Older rows keep their relative order: their ids become their sequence numbers
+            conn.execute(text("UPDATE syndrome_detections SET change_seq = id WHERE change_seq IS NULL"))
+            logger.info(f"Assigned change sequence numbers to {unnumbered} detections.")
+        latest = conn.execute(text("SELECT COALESCE(MAX(change_seq), 0) FROM syndrome_detections")).scalar()
+        for name, value in ((COUNTER, latest), (HORIZON, 0)):
+            if conn.execute(text("SELECT 1 FROM change_counters WHERE name = :name"), {"name": name}).first() is None:
+                conn.execute(text("INSERT INTO change_counters (name, value) VALUES (:name, :value)"), {"name": name, "value": value})
+            elif name == COUNTER:
+                conn.execute(text("UPDATE change_counters SET value = :value WHERE name = :name AND value < :value"),
+                             {"name": name, "value": latest})
+
+
+def next_seq(db: Session, count: int = 1) -> int:
+    """Reserve `count` consecutive sequence numbers and return the first."""
+    db.query(models.ChangeCounter).filter(models.ChangeCounter.name == COUNTER).update(
+        {"value": models.ChangeCounter.value + count}, synchronize_session=False
+    )
+    value = db.query(models.ChangeCounter.value).filter(models.ChangeCounter.name == COUNTER).scalar()
+    return value - count + 1
+
+
+def current_seq(db: Session) -> int:
+    return db.query(models.ChangeCounter.value).filter(models.ChangeCounter.name == COUNTER).scalar() or 0
+
+
+def touch(db: Session, detection: models.SyndromeDetection) -> None:
+    """Mark a new or modified detection as changed; call before the commit that saves it."""
+    detection.change_seq = next_seq(db)
+
+
+def record_deletions(db: Session, rows: Iterable) -> None:
+    """Leave tombstones for detections about to be deleted (rows with id, case_id and normal_user_id)."""
+    rows = list(rows)
+    if not rows:
+        return
+    first = next_seq(db, len(rows))
+    # One executemany; ORM objects would be flushed one INSERT ... RETURNING at a time
+    db.execute(insert(models.DetectionTombstone), [
+        {"detection_id": row.id, "case_id": row.case_id, "normal_user_id": row.normal_user_id, "change_seq": first + offset}
+        for offset, row in enumerate(rows)
+    ])
+    purge_tombstones(db)
+
+
+def purge_tombstones(db: Session, force: bool = False) -> None:
+    global _last_purge
+    if not force and time.monotonic() - _last_purge < PURGE_INTERVAL_SECONDS:
+        return
+    _last_purge = time.monotonic()
+    cutoff = datetime.utcnow() - timedelta(days=TOMBSTONE_RETENTION_DAYS)
+    expired = db.query(func.max(models.DetectionTombstone.change_seq)).filter(
+        models.DetectionTombstone.deleted_at < cutoff
+    ).scalar()
+    if expired is None:
+        return
+    db.query(models.DetectionTombstone).filter(models.DetectionTombstone.change_seq <= expired).delete(synchronize_session=False)
+    db.query(models.ChangeCounter).filter(
+        models.ChangeCounter.name == HORIZON, models.ChangeCounter.value < expired
+    ).update({"value": expired}, synchronize_session=False)
+
+
+def tombstone_horizon(db: Session) -> int:
+    return db.query(models.ChangeCounter.value).filter(models.ChangeCounter.name == HORIZON).scalar() or 0
+
+
+def changes_since(db: Session, owner, tombstone_owner, since: int, limit: int) -> dict:
+    """
+    Up to `limit` changes after `since`, in sequence order: changed detections and
+    the ids of deleted ones. `owner` / `tombstone_owner` scope both to one user or case.
+    """
+    changed = (
+        db.query(models.SyndromeDetection)
+        .filter(owner, models.SyndromeDetection.change_seq > since)
+        .order_by(models.SyndromeDetection.change_seq)
+        .limit(limit + 1)
+        .all()
+    )
+    deleted = (
+        db.query(models.DetectionTombstone.detection_id, models.DetectionTombstone.change_seq)
+        .filter(tombstone_owner, models.DetectionTombstone.change_seq > since)
+        .order_by(models.DetectionTombstone.change_seq)
+        .limit(limit + 1)
+        .all()
+    )
+    # Merge both streams by sequence and cut the page at `limit` changes
+    stream = sorted(
+        [(detection.change_seq, detection) for detection in changed] + [(row.change_seq, row) for row in deleted],
+        key=lambda entry: entry[0],
+    )
+    page = stream[:limit]
+    last_seq: Optional[int] = page[-1][0] if page else since
+    return {
+        "items": [entry for _, entry in page if isinstance(entry, models.SyndromeDetection)],
+        "deleted": [entry.detection_id for _, entry in page if not isinstance(entry, models.SyndromeDetection)],
+        "last_seq": last_seq,
+        "has_more": len(stream) > limit,
+    }
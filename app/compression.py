@@ -0,0 +1,295 @@
+# app/compression.py
+"""
+Response compression.
+
+The encoding is negotiated from Accept-Encoding. zstd and brotli are used when
+the `zstandard` / `brotli` packages are installed, otherwise gzip. Only textual
+bodies of at least COMPRESSION_MIN_SIZE bytes are compressed; images are
+already compressed, and event streams must reach the client unbuffered.
+
+A complete body is compressed in one go. Its compressed form is kept in an LRU
+cache keyed by encoding and a hash of the body, so a hot, unchanged list such
+as /admin/detections is not recompressed on every request. Responses marked
+`Cache-Control: no-store` are not cached. A streamed body is compressed chunk
+by chunk and flushed after each chunk, so the client still receives it
+progressively.
+"""
+
+import hashlib
+import importlib.util
+import os
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Optional
+
+import anyio
+from starlette.datastructures import Headers, MutableHeaders
+
+from . import metrics
+
+COMPRESSION_ENABLED = os.getenv("COMPRESSION_ENABLED", "true").lower() == "true"
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", 1024))
+COMPRESSION_CACHE_BYTES = int(os.getenv("COMPRESSION_CACHE_BYTES", 32 * 1024 * 1024))
+COMPRESSION_GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", 6))
+COMPRESSION_BROTLI_QUALITY = int(os.getenv("COMPRESSION_BROTLI_QUALITY", 5))
+COMPRESSION_ZSTD_LEVEL = int(os.getenv("COMPRESSION_ZSTD_LEVEL", 3))
+# Larger bodies are compressed in a worker thread instead of on the event loop
+OFFLOAD_BYTES = 256 * 1024
+# A single body larger than this is never cached
+CACHE_MAX_BODY = COMPRESSION_CACHE_BYTES // 8
+
+COMPRESSIBLE_TYPES = ("text/", "application/json", "application/javascript", "application/xml", "image/svg+xml")
+
+
+# --------------------------------------
+# Encoders
+# --------------------------------------
+
+class GzipEncoder:
+    def __init__(self):
+        self.compressor = zlib.compressobj(COMPRESSION_GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes) -> bytes:
+        return self.compressor.compress(data)
+
+    def flush(self) -> bytes:
+        return self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self.compressor.flush(zlib.Z_FINISH)
+
+
+class BrotliEncoder:
+    def __init__(self):
+        import brotli
+
+        self.compressor = brotli.Compressor(quality=COMPRESSION_BROTLI_QUALITY)
+
+    def compress(self, data: bytes) -> bytes:
+        return self.compressor.process(data)
+
+    def flush(self) -> bytes:
+        return self.compressor.flush()
+
+    def finish(self) -> bytes:
+        return self.compressor.finish()
+
+
+class ZstdEncoder:
+    def __init__(self):
+        import zstandard
+
+        self.flush_mode = zstandard.COMPRESSOBJ_FLUSH_BLOCK
+        self.compressor = zstandard.ZstdCompressor(level=COMPRESSION_ZSTD_LEVEL).compressobj()
+
+    def compress(self, data: bytes) -> bytes:
+        return self.compressor.compress(data)
+
+    def flush(self) -> bytes:
+        return self.compressor.flush(self.flush_mode)
+
+    def finish(self) -> bytes:
+        return self.compressor.flush()
+
+
+# Server preference when the client rates several encodings equally
+ENCODERS = OrderedDict()
+if importlib.util.find_spec("zstandard") is not None:
+    ENCODERS["zstd"] = ZstdEncoder
+if importlib.util.find_spec("brotli") is not None:
+    ENCODERS["br"] = BrotliEncoder
+ENCODERS["gzip"] = GzipEncoder
+
+
+def negotiate(accept_encoding: str) -> Optional[str]:
+    """The best available encoding the client accepts, or None."""
+    weights = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                continue
+        weights[name.strip().lower()] = quality
+    best, best_quality = None, 0.0
+    for name in ENCODERS:
+        quality = weights.get(name, weights.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = name, quality
+    return best
+
+
+def compressible(headers: Headers) -> bool:
+    if "content-encoding" in headers:
+        return False
+    content_type = headers.get("content-type", "").split(";")[0].strip().lower()
+    if content_type == "text/event-stream":
+        return False
+    return content_type.startswith(COMPRESSIBLE_TYPES) or content_type.endswith(("+json", "+xml"))
+
+
+# --------------------------------------
+# Cache and statistics
+# --------------------------------------
+
+stats = {
+    "encodings": {name: {"responses": 0, "streamed": 0, "bytes_in": 0, "bytes_out": 0, "cpu_seconds": 0.0} for name in ENCODERS},
+    "cache": {"hits": 0, "misses": 0},
+    "skipped": 0,
+}
+
+
+class CompressedCache:
+    """LRU of compressed bodies, bounded by their total size."""
+
+    def __init__(self, max_bytes: int = COMPRESSION_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries: "OrderedDict[tuple, bytes]" = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key: tuple) -> Optional[bytes]:
+        with self.lock:
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+            return value
+
+    def put(self, key: tuple, value: bytes) -> None:
+        with self.lock:
+            if key in self.entries:
+                return
+            self.entries[key] = value
+            self.size += len(value)
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+
+
+cache = CompressedCache()
+
+
+def compress_body(encoding: str, body: bytes) -> bytes:
+    started = time.thread_time()
+    encoder = ENCODERS[encoding]()
+    compressed = encoder.compress(body) + encoder.finish()
+    stats["encodings"][encoding]["cpu_seconds"] += time.thread_time() - started
+    return compressed
+
+
+def _record(encoding: str, bytes_in: int, bytes_out: int) -> None:
+    counters = stats["encodings"][encoding]
+    counters["bytes_in"] += bytes_in
+    counters["bytes_out"] += bytes_out
+
+
+# --------------------------------------
+# Middleware
+# --------------------------------------
+
+class CompressionMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if not COMPRESSION_ENABLED or scope["type"] != "http" or scope["method"] == "HEAD":
+            return await self.app(scope, receive, send)
+        encoding = negotiate(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            return await self.app(scope, receive, send)
+
+        start = None
+        mode = None  # "identity" or "stream" once the first body chunk has been seen
+        encoder = None
+
+        async def send_compressed(message):
+            nonlocal start, mode, encoder
+            if message["type"] == "http.response.start":
+                start = message
+                return
+            if message["type"] != "http.response.body":
+                return await send(message)
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if mode is None:
+                headers = MutableHeaders(raw=start["headers"])
+                if not compressible(headers) or (not more_body and len(body) < COMPRESSION_MIN_SIZE):
+                    if not more_body:
+                        stats["skipped"] += 1
+                    mode = "identity"
+                    await send(start)
+                    return await send(message)
+
+                headers["Content-Encoding"] = encoding
+                headers.add_vary_header("Accept-Encoding")
+                if not more_body:
+                    compressed = await self._compress_complete(encoding, body, headers)
+                    headers["Content-Length"] = str(len(compressed))
+                    await send(start)
+                    return await send({"type": "http.response.body", "body": compressed})
+
+                mode = "stream"
+                del headers["Content-Length"]
+                encoder = ENCODERS[encoding]()
+                stats["encodings"][encoding]["responses"] += 1
+                stats["encodings"][encoding]["streamed"] += 1
+                await send(start)
+
+            if mode == "identity":
+                return await send(message)
+            started = time.thread_time()
+            data = encoder.compress(body) + (encoder.flush() if more_body else encoder.finish())
+            stats["encodings"][encoding]["cpu_seconds"] += time.thread_time() - started
+            _record(encoding, len(body), len(data))
+            await send({"type": "http.response.body", "body": data, "more_body": more_body})
+
+        await self.app(scope, receive, send_compressed)
+
+    @staticmethod
+    async def _compress_complete(encoding: str, body: bytes, headers: MutableHeaders) -> bytes:
+        stats["encodings"][encoding]["responses"] += 1
+        cacheable = "no-store" not in headers.get("cache-control", "") and len(body) <= CACHE_MAX_BODY
+        key = None
+        if cacheable:
+            key = (encoding, hashlib.blake2b(body, digest_size=16).digest())
+            compressed = cache.get(key)
+            if compressed is not None:
+                stats["cache"]["hits"] += 1
+                _record(encoding, len(body), len(compressed))
+                return compressed
+            stats["cache"]["misses"] += 1
+
+        if len(body) >= OFFLOAD_BYTES:
+            compressed = await anyio.to_thread.run_sync(compress_body, encoding, body)
+        else:
+            compressed = compress_body(encoding, body)
+        _record(encoding, len(body), len(compressed))
+        if key is not None:
+            cache.put(key, compressed)
+        return compressed
+
+
+def snapshot() -> dict:
+    return {
+        "enabled": COMPRESSION_ENABLED,
+        "min_size": COMPRESSION_MIN_SIZE,
+        "skipped": stats["skipped"],
+        "encodings": {
+            name: dict(
+                counters,
+                cpu_seconds=round(counters["cpu_seconds"], 4),
+                ratio=round(counters["bytes_out"] / counters["bytes_in"], 3) if counters["bytes_in"] else None,
+            )
+            for name, counters in stats["encodings"].items()
+        },
+        "cache": dict(stats["cache"], entries=len(cache.entries), bytes=cache.size, max_bytes=cache.max_bytes),
+    }
+
+
+metrics.register("compression", snapshot)
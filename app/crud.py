@@ -1,21 +1,118 @@
 # app/crud.py
 
-from typing import List, Optional
+from typing import List, Optional, Type
+from sqlalchemy import and_, func, or_
 from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import set_committed_value
 from sqlalchemy.exc import IntegrityError
 from fastapi import HTTPException, status
 
-from . import models, schemas
-from .auth import get_password_hash
+from . import archive, auth, changes, events, groupcommit, imaging, jobs, models, phash, schemas, search, storage, uploads, utils
 
+import io
 import os
+import time
 from fastapi import UploadFile
+from pydantic import BaseModel
 from uuid import uuid4
 
 
+ALLOWED_IMAGE_EXTENSIONS = [".jpg", ".jpeg", ".png"]
+# Most ids a batch-get resolves in one call (and one IN query)
+BATCH_MAX_IDS = int(os.getenv("BATCH_MAX_IDS", 100))
+
+
+def _read_upload(upload: UploadFile):
+    """Validate an uploaded image and return its (ImageInfo, bytes)."""
+    if not upload:
+        raise HTTPException(status_code=400, detail="Image file is required.")
+
+    file_extension = os.path.splitext(upload.filename or "")[1]
+    if file_extension.lower() not in ALLOWED_IMAGE_EXTENSIONS:
+        raise HTTPException(status_code=400, detail="Invalid image format. Supported formats: .jpg, .jpeg, .png")
+
+    try:
+        # The magic bytes and header decide the type; the body is only read once they pass
+        info, head = imaging.read_header(upload.file)
+    except imaging.InvalidImage as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    data = head + upload.file.read(uploads.MAX_UPLOAD_BYTES + 1 - len(head))
+    if len(data) > uploads.MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail="Image file is too large.")
+    return info, data
+
+
+def _save_upload(upload: UploadFile, category: str) -> str:
+    """Validate an uploaded image, store it without its metadata and return its URL."""
+    info, data = _read_upload(upload)
+    try:
+        data = imaging.strip_metadata(data, info.content_type)
+    except imaging.InvalidImage as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # Generate a unique filename and store the file
+    key = f"{category}/{uuid4().hex}{imaging.EXTENSIONS[info.content_type]}"
+    storage.get_storage().save(key, io.BytesIO(data), info.content_type)
+    return utils.media_key_to_url(key)
+
+
+
+# Sparse fieldsets and batch reads
+def parse_fields(fields: Optional[str], schema: Type[BaseModel], model) -> Optional[List[str]]:
+    """
+    Column names for a `?fields=a,b` selector, in response order and always with `id`,
+    or None when every field was asked for. Only fields of the response schema can be selected.
+    """
+    if not fields:
+        return None
+    available = [name for name in schema.model_fields if name in model.__table__.columns]
+    requested = {name.strip() for name in fields.split(",") if name.strip()}
+    unknown = sorted(requested - set(available))
+    if unknown:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown fields: {', '.join(unknown)}. Available: {', '.join(available)}.",
+        )
+    return [name for name in available if name == "id" or name in requested]
+
+
+def select_rows(db: Session, model, names: Optional[List[str]], *criteria) -> list:
+    """
+    Rows of `model` matching `criteria`: ORM objects, or with `names` plain dicts
+    holding just those columns, which are all the SELECT loads.
+    """
+    if names is None:
+        return db.query(model).filter(*criteria).all()
+    rows = db.query(*(getattr(model, name) for name in names)).filter(*criteria).all()
+    return [dict(row._mapping) for row in rows]
+
+
+def parse_ids(ids: str) -> List[int]:
+    """'3,1,3' -> [3, 1]: distinct ids in request order, at most BATCH_MAX_IDS of them."""
+    try:
+        parsed = list(dict.fromkeys(int(value) for value in ids.split(",") if value.strip()))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="ids must be a comma-separated list of integers.")
+    if not parsed:
+        raise HTTPException(status_code=400, detail="At least one id is required.")
+    if len(parsed) > BATCH_MAX_IDS:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_IDS} ids can be fetched at once.")
+    return parsed
+
+
+def get_batch(db: Session, model, ids: List[int], names: Optional[List[str]] = None) -> dict:
+    """Resolve `ids` with a single IN query; items come back in the order asked for."""
+    rows = select_rows(db, model, names, model.id.in_(ids))
+    by_id = {(row["id"] if names is not None else row.id): row for row in rows}
+    return {
+        "items": [by_id[id] for id in ids if id in by_id],
+        "missing": [id for id in ids if id not in by_id],
+    }
+
+
 # Admin CRUD
 def create_admin(db: Session, admin: schemas.AdminCreate) -> models.Admin:
-    hashed_password = get_password_hash(admin.password)
+    hashed_password = auth.get_password_hash(admin.password)
     db_admin = models.Admin(
         name=admin.name,
         email=admin.email,
@@ -41,29 +138,16 @@ def get_all_admins(db: Session) -> List[models.Admin]:
 
 # Doctor CRUD
 def create_doctor(db: Session, doctor: schemas.DoctorCreate, profile_image: UploadFile) -> models.Doctor:
-    hashed_password = get_password_hash(doctor.password)
+    hashed_password = auth.get_password_hash(doctor.password)
 
     # Save the uploaded file
-    if not profile_image:
-        raise HTTPException(status_code=400, detail="Image file is required.")
-
-    file_extension = os.path.splitext(profile_image.filename)[1]
-    if file_extension.lower() not in [".jpg", ".jpeg", ".png"]:
-        raise HTTPException(status_code=400, detail="Invalid image format. Supported formats: .jpg, .jpeg, .png")
-    
-    # Generate a unique filename and save the file
-    unique_filename = f"{uuid4().hex}{file_extension}"
-    file_path = os.path.join("media/users", unique_filename)
-    os.makedirs(os.path.dirname(file_path), exist_ok=True)
-
-    with open(file_path, "wb") as buffer:
-        buffer.write(profile_image.file.read())
+    profile_image_url = _save_upload(profile_image, "users")
 
     db_doctor = models.Doctor(
         name=doctor.name,
         phone=doctor.phone,
         email=doctor.email,
-        profile_image=f"/media/users/{unique_filename}",  # Save the URL to the
+        profile_image=profile_image_url,
         hashed_password=hashed_password
     )
     try:
@@ -73,6 +157,7 @@ def create_doctor(db: Session, doctor: schemas.DoctorCreate, profile_image: Uplo
         return db_doctor
     except IntegrityError:
         db.rollback()
+        utils.remove_media_files([profile_image_url])
         raise HTTPException(status_code=400, detail="Email already registered.")
 
 
@@ -86,28 +171,15 @@ def get_all_doctors(db: Session) -> List[models.Doctor]:
 
 # Normal User CRUD
 def create_normal_user(db: Session, user: schemas.NormalUserCreate, profile_image: UploadFile) -> models.NormalUser:
-    hashed_password = get_password_hash(user.password)
+    hashed_password = auth.get_password_hash(user.password)
     # Save the uploaded file
-    if not profile_image:
-        raise HTTPException(status_code=400, detail="Image file is required.")
-
-    file_extension = os.path.splitext(profile_image.filename)[1]
-    if file_extension.lower() not in [".jpg", ".jpeg", ".png"]:
-        raise HTTPException(status_code=400, detail="Invalid image format. Supported formats: .jpg, .jpeg, .png")
-    
-    # Generate a unique filename and save the file
-    unique_filename = f"{uuid4().hex}{file_extension}"
-    file_path = os.path.join("media/users", unique_filename)
-    os.makedirs(os.path.dirname(file_path), exist_ok=True)
-
-    with open(file_path, "wb") as buffer:
-        buffer.write(profile_image.file.read())
+    profile_image_url = _save_upload(profile_image, "users")
 
     db_user = models.NormalUser(
         name=user.name,
         phone=user.phone,
         email=user.email,
-        profile_image=f"/media/users/{unique_filename}",  # Save the URL to the
+        profile_image=profile_image_url,
         hashed_password=hashed_password
     )
     try:
@@ -117,6 +189,7 @@ def create_normal_user(db: Session, user: schemas.NormalUserCreate, profile_imag
         return db_user
     except IntegrityError:
         db.rollback()
+        utils.remove_media_files([profile_image_url])
         raise HTTPException(status_code=400, detail="Email already registered.")
 
 
@@ -130,30 +203,155 @@ def get_all_normal_users(db: Session) -> List[models.NormalUser]:
 
 # Case CRUD
 def create_case(db: Session, case: schemas.CaseCreate) -> models.Case:
-    db_case = models.Case(
-        description=case.description,
-        doctor_id=case.doctor_id,
-        name=case.name,
-        age=case.age,
-        gender=case.gender,
-        nationality=case.nationality
-    )
-    db.add(db_case)
-    db.commit()
-    db.refresh(db_case)
-    return db_case
+    def insert(session: Session) -> models.Case:
+        db_case = models.Case(
+            description=case.description,
+            doctor_id=case.doctor_id,
+            name=case.name,
+            age=case.age,
+            gender=case.gender,
+            nationality=case.nationality
+        )
+        session.add(db_case)
+        session.flush()
+        return db_case
+
+    return groupcommit.run(db, insert)
 
 
 def get_cases_by_doctor(db: Session, doctor_id: int) -> List[models.Case]:
     return db.query(models.Case).filter(models.Case.doctor_id == doctor_id).all()
 
 
+# Sort key -> (column, descending). Every sort ends on Case.id so the keyset is unique.
+CASE_SORTS = {
+    "id": (models.Case.id, False),
+    "-id": (models.Case.id, True),
+    "name": (models.Case.name, False),
+    "-name": (models.Case.name, True),
+    "age": (models.Case.age, False),
+    "-age": (models.Case.age, True),
+}
+
+
+def search_cases(
+    db: Session,
+    doctor_id: int,
+    name_prefix: Optional[str] = None,
+    min_age: Optional[int] = None,
+    max_age: Optional[int] = None,
+    gender: Optional[str] = None,
+    nationality: Optional[str] = None,
+    result: Optional[str] = None,
+    sort: str = "id",
+    limit: int = 50,
+    cursor: Optional[str] = None,
+) -> dict:
+    """
+    Filtered, keyset-paginated case listing for one doctor.
+    Returns a page of cases and the cursor of the next page (None on the last page).
+    """
+    if sort not in CASE_SORTS:
+        raise HTTPException(status_code=400, detail=f"Invalid sort. Supported: {', '.join(CASE_SORTS)}")
+    sort_column, descending = CASE_SORTS[sort]
+
+    query = db.query(models.Case).filter(models.Case.doctor_id == doctor_id)
+    if name_prefix:
+        # A range instead of LIKE so the (doctor_id, name) index is used; the match is case-sensitive.
+        query = query.filter(models.Case.name >= name_prefix, models.Case.name < name_prefix + "\uffff")
+    if min_age is not None:
+        query = query.filter(models.Case.age >= min_age)
+    if max_age is not None:
+        query = query.filter(models.Case.age <= max_age)
+    if gender:
+        query = query.filter(models.Case.gender == gender)
+    if nationality:
+        query = query.filter(models.Case.nationality == nationality)
+    if result:
+        query = query.filter(models.Case.syndrome_detections.any(models.SyndromeDetection.result == result))
+
+    if cursor:
+        if sort_column is models.Case.id:
+            values = utils.decode_cursor(cursor, (int,))
+            query = query.filter(models.Case.id < values[0] if descending else models.Case.id > values[0])
+        else:
+            # The sort column's value, then the id
+            last_value, last_id = utils.decode_cursor(cursor, (sort_column.type.python_type, int))
+            if descending:
+                query = query.filter(or_(sort_column < last_value, and_(sort_column == last_value, models.Case.id < last_id)))
+            else:
+                query = query.filter(or_(sort_column > last_value, and_(sort_column == last_value, models.Case.id > last_id)))
+
+    if sort_column is models.Case.id:
+        order = [models.Case.id.desc() if descending else models.Case.id]
+    else:
+        order = [sort_column.desc(), models.Case.id.desc()] if descending else [sort_column, models.Case.id]
+    cases = query.order_by(*order).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(cases) > limit:
+        cases = cases[:limit]
+        last = cases[-1]
+        if sort_column is models.Case.id:
+            next_cursor = utils.encode_cursor([last.id])
+        else:
+            next_cursor = utils.encode_cursor([getattr(last, sort_column.key), last.id])
+    return {"items": cases, "next_cursor": next_cursor}
+
+
+def attach_latest_detections(db: Session, cases: List[models.Case], latest: int) -> List[models.Case]:
+    """
+    Populate `detection_count` and the newest `latest` entries of `syndrome_detections`
+    for every case with two statements, whatever the number of cases.
+    """
+    case_ids = [case.id for case in cases]
+    counts = {}
+    grouped = {case_id: [] for case_id in case_ids}
+    if case_ids:
+        counts = dict(
+            db.query(models.SyndromeDetection.case_id, func.count(models.SyndromeDetection.id))
+            .filter(models.SyndromeDetection.case_id.in_(case_ids))
+            .group_by(models.SyndromeDetection.case_id)
+            .all()
+        )
+        if latest > 0:
+            position = func.row_number().over(
+                partition_by=models.SyndromeDetection.case_id,
+                order_by=models.SyndromeDetection.id.desc(),
+            ).label("position")
+            ranked = (
+                db.query(models.SyndromeDetection.id, position)
+                .filter(models.SyndromeDetection.case_id.in_(case_ids))
+                .subquery()
+            )
+            detections = (
+                db.query(models.SyndromeDetection)
+                .join(ranked, ranked.c.id == models.SyndromeDetection.id)
+                .filter(ranked.c.position <= latest)
+                .order_by(models.SyndromeDetection.case_id, models.SyndromeDetection.id.desc())
+                .all()
+            )
+            for detection in detections:
+                grouped[detection.case_id].append(detection)
+
+    for case in cases:
+        # Set the relationship as already loaded so serialization never lazy-loads it.
+        set_committed_value(case, "syndrome_detections", grouped[case.id])
+        case.detection_count = counts.get(case.id, 0)
+    return cases
+
+
 def get_case_by_id(db: Session, case_id: int) -> Optional[models.Case]:
     return db.query(models.Case).filter(models.Case.id == case_id).first()
 
 
 # Syndrome Detection CRUD
-def create_syndrome_detection(db: Session, detection: schemas.SyndromeDetectionCreate, image_file: UploadFile) -> models.SyndromeDetection:
+def create_syndrome_detection(
+    db: Session,
+    detection: schemas.SyndromeDetectionCreate,
+    image_file: Optional[UploadFile] = None,
+    upload_token: Optional[str] = None,
+) -> models.SyndromeDetection:
     # Validate input fields based on user or doctor case
     if detection.case_id and detection.normal_user_id:
         raise ValueError("Both case_id and normal_user_id cannot be provided.")
@@ -176,30 +374,41 @@ def create_syndrome_detection(db: Session, detection: schemas.SyndromeDetectionC
         # Exclude doctor-specific fields
         detection_data = detection.dict(exclude={"case_id"})
 
-    # Save the uploaded file
-    if not image_file:
-        raise HTTPException(status_code=400, detail="Image file is required.")
-
-    file_extension = os.path.splitext(image_file.filename)[1]
-    if file_extension.lower() not in [".jpg", ".jpeg", ".png"]:
-        raise HTTPException(status_code=400, detail="Invalid image format. Supported formats: .jpg, .jpeg, .png")
-    
-    # Generate a unique filename and save the file
-    unique_filename = f"{uuid4().hex}{file_extension}"
-    file_path = os.path.join("media/detections", unique_filename)
-    os.makedirs(os.path.dirname(file_path), exist_ok=True)
-
-    with open(file_path, "wb") as buffer:
-        buffer.write(image_file.file.read())
+    doctor_id = None
+    if detection.case_id:
+        case = get_case_by_id(db, detection.case_id)
+        if case is None:
+            raise HTTPException(status_code=404, detail="Case not found.")
+        doctor_id = case.doctor_id
+
+    if upload_token:
+        # The image was uploaded straight to storage; only verify and reference it
+        image_url = uploads.claim_upload(upload_token, "detections")
+    else:
+        # Save the uploaded file
+        image_url = _save_upload(image_file, "detections")
 
     # Add the image URL to detection data
-    detection_data["image_url"] = f"/media/detections/{unique_filename}"
-
-    # Create and save the detection
-    db_detection = models.SyndromeDetection(**detection_data)
-    db.add(db_detection)
-    db.commit()
-    db.refresh(db_detection)
+    detection_data["image_url"] = image_url
+
+    def insert(session: Session):
+        if upload_token:
+            claimed = session.query(models.SyndromeDetection.id).filter(models.SyndromeDetection.image_url == image_url).first()
+            if claimed:
+                raise HTTPException(status_code=400, detail="This upload is already attached to a detection.")
+        # Create and save the detection
+        db_detection = models.SyndromeDetection(**detection_data)
+        session.add(db_detection)
+        session.flush()
+        search.index_detection(session, db_detection)
+        changes.touch(session, db_detection)
+        # Image post-processing and analysis run in the background, committed together with the row
+        job = jobs.enqueue(session, "detection.process", {"detection_id": db_detection.id})
+        return db_detection, job.id
+
+    db_detection, job_id = groupcommit.run(db, insert)
+    db_detection.job_id = job_id
+    events.publish_detection(db_detection, "detection.created", doctor_id)
     return db_detection
 
 def get_detections_by_case(db: Session, case_id: int) -> List[models.SyndromeDetection]:
@@ -217,29 +426,18 @@ def get_detection_history_for_case(db: Session, case_id: int) -> List[models.Syn
 # Article CRUD
 def create_article(db: Session, article: schemas.ArticleCreate, photo: UploadFile) -> models.Article:
     # Save the uploaded file
-    if not photo:
-        raise HTTPException(status_code=400, detail="Image file is required.")
-
-    file_extension = os.path.splitext(photo.filename)[1]
-    if file_extension.lower() not in [".jpg", ".jpeg", ".png"]:
-        raise HTTPException(status_code=400, detail="Invalid image format. Supported formats: .jpg, .jpeg, .png")
-    
-    # Generate a unique filename and save the file
-    unique_filename = f"{uuid4().hex}{file_extension}"
-    file_path = os.path.join("media/articles", unique_filename)
-    os.makedirs(os.path.dirname(file_path), exist_ok=True)
-
-    with open(file_path, "wb") as buffer:
-        buffer.write(photo.file.read())
+    photo_url = _save_upload(photo, "articles")
 
     # Save the article record with the photo URL
     db_article = models.Article(
         title=article.title,
         author=article.author,
-        photo_url=f"/media/articles/{unique_filename}",  # Save the URL to the file
+        photo_url=photo_url,
         content=article.content
     )
     db.add(db_article)
+    db.flush()
+    search.index_article(db, db_article)
     db.commit()
     db.refresh(db_article)
     return db_article
@@ -248,33 +446,231 @@ def create_article(db: Session, article: schemas.ArticleCreate, photo: UploadFil
 def get_articles(db: Session) -> List[models.Article]:
     return db.query(models.Article).order_by(models.Article.id.desc()).all()
 
+
+# Search
+def search_content(db: Session, q: str, scope: str = "all", limit: int = 20, offset: int = 0,
+                   case_id: Optional[int] = None, normal_user_id: Optional[int] = None) -> dict:
+    if scope not in ("all", "articles", "detections"):
+        raise HTTPException(status_code=400, detail="Invalid scope. It must be 'all', 'articles' or 'detections'.")
+    total, hits = search.search(db, q, scope=scope, limit=limit, offset=offset,
+                                case_id=case_id, normal_user_id=normal_user_id)
+    return {"total": total, "limit": limit, "offset": offset, "hits": hits}
+
+# Incremental sync
+def sync_detections(db: Session, since_token: Optional[str], limit: int,
+                    normal_user_id: Optional[int] = None, case_id: Optional[int] = None) -> Optional[dict]:
+    """Changes after `since_token` for one user or case, or None when there are none."""
+    if (normal_user_id is None) == (case_id is None):
+        raise HTTPException(status_code=400, detail="Provide either normal_user_id or case_id.")
+    since = 0
+    if since_token:
+        values = utils.decode_cursor(since_token)
+        if len(values) != 1 or not isinstance(values[0], int):
+            raise HTTPException(status_code=400, detail="Invalid sync token.")
+        since = values[0]
+        if since < changes.tombstone_horizon(db):
+            raise HTTPException(status_code=status.HTTP_410_GONE, detail="Sync token has expired; sync from scratch.")
+    # Read before the changes, so every sequence up to it is already committed and seen below
+    floor = None if since_token else changes.current_seq(db)
+
+    if normal_user_id is not None:
+        owner = models.SyndromeDetection.normal_user_id == normal_user_id
+        tombstone_owner = models.DetectionTombstone.normal_user_id == normal_user_id
+    else:
+        owner = models.SyndromeDetection.case_id == case_id
+        tombstone_owner = models.DetectionTombstone.case_id == case_id
+    page = changes.changes_since(db, owner, tombstone_owner, since, limit)
+    if since_token and not page["items"] and not page["deleted"]:
+        return None
+    last_seq = page["last_seq"]
+    if floor is not None and not page["has_more"]:
+        # A full download saw everything up to the floor; 0 from an empty one would be behind the tombstone horizon
+        last_seq = max(last_seq, floor)
+    return {
+        "items": page["items"],
+        "deleted": page["deleted"],
+        "sync_token": utils.encode_cursor([last_seq]),
+        "has_more": page["has_more"],
+    }
+
+
+# Near-duplicate images
+SIMILAR_CANDIDATE_CHUNK = 500
+
+
+def find_similar_detections(db: Session, image_hash: str, max_distance: int, limit: int = 20,
+                            normal_user_id: Optional[int] = None, doctor_id: Optional[int] = None,
+                            exclude_id: Optional[int] = None) -> List[models.SyndromeDetection]:
+    """
+    Detections owned by `normal_user_id` or `doctor_id` whose image hash is within
+    `max_distance` bits of `image_hash`, nearest first, each with a `distance` attribute.
+    """
+    matches = phash.index.search(db, phash.owner_key(normal_user_id, doctor_id), image_hash, max_distance)
+    matches.pop(exclude_id, None)
+    candidates = sorted(matches, key=lambda detection_id: (matches[detection_id], detection_id))
+
+    owner = (
+        models.SyndromeDetection.normal_user_id == normal_user_id
+        if normal_user_id is not None
+        else models.SyndromeDetection.case_id.in_(db.query(models.Case.id).filter(models.Case.doctor_id == doctor_id))
+    )
+    found = []
+    # The owner's tree may still hold deleted detections; resolve nearest candidates chunk by chunk
+    for start in range(0, len(candidates), SIMILAR_CANDIDATE_CHUNK):
+        chunk = candidates[start:start + SIMILAR_CANDIDATE_CHUNK]
+        rows = db.query(models.SyndromeDetection).filter(models.SyndromeDetection.id.in_(chunk), owner).all()
+        found.extend(rows)
+        if len(found) >= limit:
+            break
+    found.sort(key=lambda detection: (matches[detection.id], detection.id))
+    for detection in found:
+        detection.distance = matches[detection.id]
+    return found[:limit]
+
+
+def get_similar_to_detection(db: Session, detection_id: int, max_distance: int, limit: int = 20) -> List[models.SyndromeDetection]:
+    detection = db.query(models.SyndromeDetection).filter(models.SyndromeDetection.id == detection_id).first()
+    if not detection:
+        raise HTTPException(status_code=404, detail="Detection not found.")
+    if not detection.phash:
+        raise HTTPException(status_code=409, detail="The detection image has not been processed yet.")
+    if detection.normal_user_id is not None:
+        return find_similar_detections(db, detection.phash, max_distance, limit,
+                                       normal_user_id=detection.normal_user_id, exclude_id=detection.id)
+    return find_similar_detections(db, detection.phash, max_distance, limit,
+                                   doctor_id=detection.case.doctor_id, exclude_id=detection.id)
+
+
+def get_similar_to_upload(db: Session, image_file: UploadFile, max_distance: int, limit: int = 20,
+                          normal_user_id: Optional[int] = None, doctor_id: Optional[int] = None) -> List[models.SyndromeDetection]:
+    if (normal_user_id is None) == (doctor_id is None):
+        raise HTTPException(status_code=400, detail="Provide either normal_user_id or doctor_id.")
+    _, data = _read_upload(image_file)
+    try:
+        image_hash = imaging.compute_dhash(data)
+    except Exception:
+        raise HTTPException(status_code=400, detail="The image could not be decoded.")
+    if image_hash is None:
+        raise HTTPException(status_code=503, detail="Image hashing is not available on this server.")
+    return find_similar_detections(db, image_hash, max_distance, limit,
+                                   normal_user_id=normal_user_id, doctor_id=doctor_id)
+
+
 # Add the delete_article function
 def delete_article(db: Session, article_id: int) -> bool:
     article = db.query(models.Article).filter(models.Article.id == article_id).first()
     if article:
-        # Optionally delete the file from the filesystem
-        if os.path.exists(article.photo_url):
-            os.remove(article.photo_url)
+        photo_url = article.photo_url
+        search.remove_article(db, article.id)
         db.delete(article)
         db.commit()
+        # Remove the photo only once the row is gone, so a failed commit never leaves a dangling URL
+        utils.remove_media_files([photo_url])
         return True
     raise HTTPException(status_code=404, detail="Article not found.")
     # return True  # Return True if deletion is successful
 
 # User Deletion
-def delete_user(db: Session, user_id: int) -> None:
-    user = db.query(models.NormalUser).filter(models.NormalUser.id == user_id).first()
-    if user:
-        db.delete(user)
+# Users and doctors are deleted with set-based DELETEs in short, separately committed
+# chunks rather than through the ORM cascade, which loads every child row and holds
+# one long write transaction.
+DELETE_CHUNK_SIZE = int(os.getenv("DELETE_CHUNK_SIZE", 500))
+DELETE_CHUNK_PAUSE = float(os.getenv("DELETE_CHUNK_PAUSE", 0.01))
+
+
+def _delete_detections_in_chunks(db: Session, condition, progress: dict) -> None:
+    while True:
+        rows = (
+            db.query(models.SyndromeDetection.id, models.SyndromeDetection.image_url,
+                     models.SyndromeDetection.thumbnail_url, models.SyndromeDetection.case_id,
+                     models.SyndromeDetection.normal_user_id)
+            .filter(condition)
+            # No ORDER BY: every chunk is deleted before the next is read, and sorting would
+            # read all of an owner's detections once per chunk
+            .limit(DELETE_CHUNK_SIZE)
+            .all()
+        )
+        if not rows:
+            return
+        ids = [row.id for row in rows]
+        search.remove_detections(db, ids)
+        changes.record_deletions(db, rows)
+        db.query(models.SyndromeDetection).filter(models.SyndromeDetection.id.in_(ids)).delete(synchronize_session=False)
         db.commit()
-        return
-    user = db.query(models.Doctor).filter(models.Doctor.id == user_id).first()
+        progress["detections"] += len(ids)
+        progress["files"] += utils.remove_media_files(
+            url for row in rows for url in (row.image_url, row.thumbnail_url)
+        )
+        time.sleep(DELETE_CHUNK_PAUSE)
+
+
+def _delete_archived(db: Session, owner_type: str, owner_ids: List[int], progress: dict) -> None:
+    """Delete the archived detections of some cases or a user; commits."""
+    archived = archive.delete_archived(db, owner_type, owner_ids)
+    db.commit()
+    progress["detections"] += archived["detections"]
+    progress["files"] += utils.remove_media_files(archived["media"])
+
+
+def _delete_refresh_tokens(db: Session, user_type: str, user_id: int) -> None:
+    db.query(models.RefreshToken).filter(
+        models.RefreshToken.user_type == user_type, models.RefreshToken.user_id == user_id
+    ).delete(synchronize_session=False)
+
+
+def _new_progress() -> dict:
+    return {"detections": 0, "cases": 0, "files": 0}
+
+
+def delete_normal_user(db: Session, user_id: int, progress: Optional[dict] = None) -> dict:
+    progress = progress if progress is not None else _new_progress()
+    _delete_detections_in_chunks(db, models.SyndromeDetection.normal_user_id == user_id, progress)
+    _delete_archived(db, "normal_user", [user_id], progress)
+    user = get_normal_user_by_id(db, user_id)
     if user:
-        db.delete(user)
+        profile_image = user.profile_image
+        _delete_refresh_tokens(db, "normal_user", user_id)
+        db.query(models.NormalUser).filter(models.NormalUser.id == user_id).delete(synchronize_session=False)
+        db.commit()
+        progress["files"] += utils.remove_media_files([profile_image])
+    return progress
+
+
+def delete_doctor(db: Session, doctor_id: int, progress: Optional[dict] = None) -> dict:
+    progress = progress if progress is not None else _new_progress()
+    while True:
+        case_ids = [
+            row.id for row in
+            db.query(models.Case.id).filter(models.Case.doctor_id == doctor_id)
+            .order_by(models.Case.id).limit(DELETE_CHUNK_SIZE).all()
+        ]
+        if not case_ids:
+            break
+        _delete_detections_in_chunks(db, models.SyndromeDetection.case_id.in_(case_ids), progress)
+        _delete_archived(db, "case", case_ids, progress)
+        db.query(models.Case).filter(models.Case.id.in_(case_ids)).delete(synchronize_session=False)
+        db.commit()
+        progress["cases"] += len(case_ids)
+    doctor = get_doctor_by_id(db, doctor_id)
+    if doctor:
+        profile_image = doctor.profile_image
+        _delete_refresh_tokens(db, "doctor", doctor_id)
+        db.query(models.Doctor).filter(models.Doctor.id == doctor_id).delete(synchronize_session=False)
         db.commit()
+        progress["files"] += utils.remove_media_files([profile_image])
+    return progress
+
+
+def delete_user(db: Session, user_id: int) -> None:
+    if get_normal_user_by_id(db, user_id):
+        delete_normal_user(db, user_id)
+        return
+    if get_doctor_by_id(db, user_id):
+        delete_doctor(db, user_id)
         return
     user = db.query(models.Admin).filter(models.Admin.id == user_id).first()
     if user:
+        _delete_refresh_tokens(db, "admin", user_id)
         db.delete(user)
         db.commit()
         return
@@ -285,17 +681,5 @@ def delete_user(db: Session, user_id: int) -> None:
 def get_normal_user_by_id(db: Session, user_id: int):
     return db.query(models.NormalUser).filter(models.NormalUser.id == user_id).first()
 
-def delete_normal_user(db: Session, user_id: int):
-    user = get_normal_user_by_id(db, user_id)
-    if user:
-        db.delete(user)
-        db.commit()
-
 def get_doctor_by_id(db: Session, doctor_id: int):
     return db.query(models.Doctor).filter(models.Doctor.id == doctor_id).first()
-
-def delete_doctor(db: Session, doctor_id: int):
-    doctor = get_doctor_by_id(db, doctor_id)
-    if doctor:
-        db.delete(doctor)
-        db.commit()
\ No newline at end of file
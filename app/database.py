@@ -1,43 +1,208 @@
 # app/database.py
 
-from sqlalchemy import create_engine
+from contextvars import ContextVar
+from functools import lru_cache
+from typing import List, Optional
+import sqlalchemy
+from sqlalchemy import create_engine, event, inspect, text
+from sqlalchemy.engine import Engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
 from dotenv import load_dotenv
+from . import metrics
 import os
 import logging
+import time
+import traceback
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Load environment variables from .env file
+# Load environment variables from .env file; modules read their settings from the environment on import
 dotenv_path = os.path.join(os.path.dirname(__file__), '..', '.env')
-if not os.path.exists(dotenv_path):
-    logger.warning(".env file not found. Ensure DATABASE_URL is set as an environment variable.")
-else:
+if os.path.exists(dotenv_path):
     load_dotenv(dotenv_path=dotenv_path)
 
 # Get the database URL from environment variables
 DATABASE_URL = os.getenv("DATABASE_URL")
 
-if not DATABASE_URL:
-    raise ValueError("DATABASE_URL not found in environment variables. Check your .env file or environment setup.")
+# Development aid: report sessions left open at request end and connections held too long
+DB_LEAK_DETECTION = os.getenv("DB_LEAK_DETECTION", "false").lower() == "true"
+DB_LEAK_THRESHOLD_SECONDS = float(os.getenv("DB_LEAK_THRESHOLD_SECONDS", 5))
 
-logger.info(f"Using database: {DATABASE_URL}")
 
-# Create database engine and session
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+@lru_cache(maxsize=None)
+def get_engine() -> Engine:
+    """Create the engine on first use rather than on import."""
+    if not DATABASE_URL:
+        raise ValueError("DATABASE_URL not found in environment variables. Check your .env file or environment setup.")
+    logger.info(f"Using database: {DATABASE_URL}")
+    engine = create_engine(DATABASE_URL)
+    if DB_LEAK_DETECTION:
+        event.listen(engine, "checkout", _on_checkout)
+        event.listen(engine, "checkin", _on_checkin)
+    SessionLocal.configure(bind=engine)
+    return engine
+
+
+class LazySessionmaker(sessionmaker):
+    def __call__(self, **local_kw):
+        get_engine()
+        session = super().__call__(**local_kw)
+        if DB_LEAK_DETECTION:
+            session.info["created_by"] = _caller_stack()
+            request_sessions = _request_sessions.get()
+            if request_sessions is not None:
+                request_sessions.append(session)
+        return session
+
+
+def __getattr__(name):
+    # `database.engine` / `from .database import engine` keep working without an import-time engine
+    if name == "engine":
+        return get_engine()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+SessionLocal = LazySessionmaker(autocommit=False, autoflush=False)
 Base = declarative_base()
 
+
+def get_db():
+    """
+    The request-scoped session. Every dependency that needs the database depends on
+    this, so FastAPI hands one session per request to all of them and closes it at the
+    end. The session checks out a connection only when it first runs a query.
+    """
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+# --------------------------------------
+# Leak detection (DB_LEAK_DETECTION=true)
+# --------------------------------------
+
+_request_sessions: ContextVar[Optional[List[Session]]] = ContextVar("request_sessions", default=None)
+leak_stats = {"open_at_request_end": 0, "held_too_long": 0}
+
+
+_SQLALCHEMY_DIR = os.path.dirname(sqlalchemy.__file__)
+
+
+def _caller_stack() -> str:
+    # Drop SQLAlchemy's and this module's frames, so the report ends at the code that asked for the connection
+    frames = [
+        frame for frame in traceback.extract_stack()
+        if frame.filename != __file__ and not frame.filename.startswith((_SQLALCHEMY_DIR, "<sqlalchemy"))
+    ]
+    return "".join(traceback.format_list(frames[-12:]))
+
+
+def _on_checkout(dbapi_connection, connection_record, connection_proxy) -> None:
+    connection_record.info["checked_out_at"] = time.monotonic()
+    connection_record.info["checked_out_by"] = _caller_stack()
+
+
+def _on_checkin(dbapi_connection, connection_record) -> None:
+    started = connection_record.info.pop("checked_out_at", None)
+    stack = connection_record.info.pop("checked_out_by", "")
+    if started is not None and time.monotonic() - started > DB_LEAK_THRESHOLD_SECONDS:
+        leak_stats["held_too_long"] += 1
+        logger.warning(f"Connection held for {time.monotonic() - started:.1f}s, checked out at:\n{stack}")
+
+
+class SessionLeakMiddleware:
+    """Report sessions created while handling a request that still hold a transaction when it ends."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        sessions: List[Session] = []
+        token = _request_sessions.set(sessions)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _request_sessions.reset(token)
+            for session in sessions:
+                if session.in_transaction():
+                    leak_stats["open_at_request_end"] += 1
+                    logger.warning(
+                        f"Session still open after {scope['method']} {scope['path']}, created at:\n"
+                        f"{session.info.get('created_by', '')}"
+                    )
+
+
+def pool_status() -> dict:
+    """Connection pool occupancy of this process, for readiness checks."""
+    pool = get_engine().pool
+    status = {"pool": type(pool).__name__}
+    for name in ("size", "checkedin", "checkedout", "overflow"):
+        if hasattr(pool, name):
+            status[name] = getattr(pool, name)()
+    if "size" in status:
+        capacity = status["size"] + max(getattr(pool, "_max_overflow", 0), 0)
+        status["saturated"] = status["checkedout"] >= capacity
+    return status
+
+
+def add_missing_columns():
+    """
+    create_all() never alters existing tables, so nullable columns added to a
+    model after its table exists are added here.
+    """
+    engine = get_engine()
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                if not column.nullable:
+                    raise RuntimeError(f"Cannot add NOT NULL column {table.name}.{column.name} automatically.")
+                column_type = column.type.compile(dialect=engine.dialect)
+                conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+                logger.info(f"Added column {table.name}.{column.name}.")
+
+def create_missing_indexes():
+    """
+    create_all() only creates indexes together with their table, so indexes added
+    to a model after its table exists are created here.
+    """
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=get_engine(), checkfirst=True)
+
 def init_db():
     """
     Initialize the database by creating all tables.
     Import all models here to ensure they are registered with SQLAlchemy.
     """
-    from .models import Admin, Doctor, NormalUser, Case, SyndromeDetection, Article
+    from .models import (
+        Admin, Doctor, NormalUser, Case, SyndromeDetection, Article, Job,
+        IdempotencyKey, RefreshToken, RevokedToken, ChangeCounter, DetectionTombstone,
+        DetectionArchiveSegment, ArchivedMedia,
+    )
+    from .search import init_search_index
+    from .changes import init_change_tracking
+    from .archive import backfill_archived_media, backfill_created_at
     
     logger.info("Initializing the database...")
-    Base.metadata.create_all(bind=engine)
+    Base.metadata.create_all(bind=get_engine())
+    add_missing_columns()
+    create_missing_indexes()
+    init_search_index(get_engine())
+    init_change_tracking(get_engine())
+    backfill_created_at(get_engine())
+    backfill_archived_media(get_engine())
     logger.info("Database initialized successfully.")
+
+
+metrics.register("database", lambda: dict(pool_status(), **leak_stats))
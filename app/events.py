@@ -0,0 +1,244 @@
+# app/events.py
+"""
+Server-sent events for detection changes.
+
+Clients subscribe to their principal's channel (`doctor:<id>`,
+`normal_user:<id>`, or `admin`, which receives everything) via `GET /events`.
+Publishing is fire-and-forget from any thread. Each subscriber has a bounded
+queue, so a slow client cannot hold memory or block publishers. If its queue
+overflows, the queued events are dropped and the client is sent a single
+`resync` event, telling it to catch up through `/sync/detections`.
+
+With EVENTS_BROKER=socket, every worker process binds a unix datagram socket
+in EVENTS_SOCKET_DIR and sends each event to the other sockets there. That
+fans events out across the workers of one host as a local stand-in for a
+network pub/sub. With the default `local` broker, events reach only
+subscribers connected to the publishing process.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from typing import Dict, List, Optional, Set
+from uuid import uuid4
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+EVENTS_BROKER = os.getenv("EVENTS_BROKER", "local")
+EVENTS_SOCKET_DIR = os.getenv("EVENTS_SOCKET_DIR", "/tmp/syndrome-events")
+EVENTS_QUEUE_SIZE = int(os.getenv("EVENTS_QUEUE_SIZE", 100))
+EVENTS_MAX_CLIENTS = int(os.getenv("EVENTS_MAX_CLIENTS", 1000))
+EVENTS_HEARTBEAT_SECONDS = float(os.getenv("EVENTS_HEARTBEAT_SECONDS", 15))
+# Streams end after this long and the client reconnects: spreads clients over workers and lets shutdown finish
+EVENTS_MAX_STREAM_SECONDS = float(os.getenv("EVENTS_MAX_STREAM_SECONDS", 300))
+
+stats = {"published": 0, "delivered": 0, "dropped": 0, "resyncs": 0, "peer_errors": 0}
+
+
+class TooManySubscribers(Exception):
+    pass
+
+
+class Subscription:
+    def __init__(self, channel: str, loop: asyncio.AbstractEventLoop):
+        self.channel = channel
+        self.loop = loop
+        self.queue: asyncio.Queue = asyncio.Queue(EVENTS_QUEUE_SIZE)
+
+    def offer(self, event: dict) -> None:
+        """Runs on the subscriber's event loop."""
+        if self.queue.full():
+            # Backpressure: shed this client's backlog instead of growing without bound
+            stats["dropped"] += self.queue.qsize()
+            stats["resyncs"] += 1
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait({"event": "resync", "data": {"reason": "client fell behind"}})
+            return
+        self.queue.put_nowait(event)
+        stats["delivered"] += 1
+
+
+class Hub:
+    """Subscribers of this process, by channel."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.channels: Dict[str, Set[Subscription]] = {}
+        self.count = 0
+
+    def subscribe(self, channel: str) -> Subscription:
+        subscription = Subscription(channel, asyncio.get_running_loop())
+        with self.lock:
+            if self.count >= EVENTS_MAX_CLIENTS:
+                raise TooManySubscribers()
+            self.channels.setdefault(channel, set()).add(subscription)
+            self.count += 1
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self.lock:
+            subscribers = self.channels.get(subscription.channel)
+            if subscribers and subscription in subscribers:
+                subscribers.discard(subscription)
+                self.count -= 1
+                if not subscribers:
+                    del self.channels[subscription.channel]
+
+    def deliver(self, channels: List[str], event: dict) -> None:
+        """Hand an event to local subscribers; safe to call from any thread."""
+        with self.lock:
+            targets = [subscription for channel in channels for subscription in self.channels.get(channel, ())]
+        for subscription in targets:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.offer, event)
+            except RuntimeError:
+                # The subscriber's loop has closed; its stream is gone
+                self.unsubscribe(subscription)
+
+
+class SocketFanout:
+    """Relay events to the other worker processes on this host over unix datagram sockets."""
+
+    def __init__(self, hub: Hub, directory: str = EVENTS_SOCKET_DIR):
+        self.hub = hub
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, f"{os.getpid()}-{uuid4().hex[:8]}.sock")
+        self.receiver = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.receiver.bind(self.path)
+        self.sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sender.setblocking(False)
+        self.thread = threading.Thread(target=self._receive, name="events-fanout", daemon=True)
+        self.thread.start()
+
+    def _receive(self) -> None:
+        while True:
+            try:
+                message = json.loads(self.receiver.recv(65536))
+            except OSError:
+                return  # socket closed on shutdown
+            except ValueError:
+                continue
+            self.hub.deliver(message["channels"], message["event"])
+
+    def send(self, channels: List[str], event: dict) -> None:
+        data = json.dumps({"channels": channels, "event": event}).encode()
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if path == self.path or not name.endswith(".sock"):
+                continue
+            try:
+                self.sender.sendto(data, path)
+            except (ConnectionRefusedError, FileNotFoundError):
+                # The worker that bound it has exited
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+            except OSError:
+                # Peer's buffer is full (or the event is too large): drop, never block the publisher
+                stats["peer_errors"] += 1
+
+    def close(self) -> None:
+        self.receiver.close()
+        self.sender.close()
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+
+hub = Hub()
+_fanout: Optional[SocketFanout] = None
+
+
+def start() -> None:
+    global _fanout
+    if EVENTS_BROKER == "socket" and _fanout is None:
+        _fanout = SocketFanout(hub)
+        logger.info(f"Relaying events through {EVENTS_SOCKET_DIR}.")
+
+
+def stop() -> None:
+    global _fanout
+    if _fanout is not None:
+        _fanout.close()
+        _fanout = None
+
+
+def publish(channels: List[str], event_type: str, data: dict) -> None:
+    event = {"event": event_type, "data": data}
+    stats["published"] += 1
+    hub.deliver(channels, event)
+    if _fanout is not None:
+        _fanout.send(channels, event)
+
+
+def publish_detection(detection, event_type: str, doctor_id: Optional[int] = None) -> None:
+    """
+    Announce a committed detection change to its owner's channel and to admins.
+    Pass `doctor_id` when the caller already knows the case's doctor. The change
+    is already committed, so a failure here is logged, never raised.
+    """
+    try:
+        channels = ["admin"]
+        if detection.normal_user_id is not None:
+            channels.append(f"normal_user:{detection.normal_user_id}")
+        elif doctor_id is not None:
+            channels.append(f"doctor:{doctor_id}")
+        elif detection.case is not None:
+            channels.append(f"doctor:{detection.case.doctor_id}")
+        publish(channels, event_type, {
+            "id": detection.id,
+            "case_id": detection.case_id,
+            "normal_user_id": detection.normal_user_id,
+            "result": detection.result,
+            "date_of_detection": detection.date_of_detection,
+            "thumbnail_url": detection.thumbnail_url,
+            "computed_result": detection.computed_result,
+            "computed_confidence": detection.computed_confidence,
+            "change_seq": detection.change_seq,
+        })
+    except Exception:
+        logger.exception(f"Publishing {event_type} for detection {detection.id} failed")
+
+
+def format_event(event: dict) -> str:
+    lines = [f"event: {event['event']}"]
+    change_seq = event["data"].get("change_seq")
+    if change_seq is not None:
+        lines.append(f"id: {change_seq}")
+    lines.append(f"data: {json.dumps(event['data'], separators=(',', ':'))}")
+    return "\n".join(lines) + "\n\n"
+
+
+async def stream(subscription: Subscription):
+    """SSE body for one subscriber; Starlette cancels it when the client disconnects."""
+    deadline = time.monotonic() + EVENTS_MAX_STREAM_SECONDS
+    try:
+        yield "retry: 5000\n\n"
+        while time.monotonic() < deadline:
+            try:
+                timeout = min(EVENTS_HEARTBEAT_SECONDS, max(0.0, deadline - time.monotonic()))
+                event = await asyncio.wait_for(subscription.queue.get(), timeout)
+            except asyncio.TimeoutError:
+                # Comment line: keeps proxies from closing an idle connection
+                yield ": ping\n\n"
+                continue
+            yield format_event(event)
+    finally:
+        hub.unsubscribe(subscription)
+
+
+def snapshot() -> dict:
+    return dict(stats, subscribers=hub.count, channels=len(hub.channels), broker=EVENTS_BROKER)
+
+
+metrics.register("events", snapshot)
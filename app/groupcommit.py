@@ -0,0 +1,200 @@
+# app/groupcommit.py
+"""
+Group commit for inserts.
+
+`run(db, work)` executes `work(session)` (which adds rows and may flush) and
+commits it. By default that happens on the caller's session, one transaction
+per call. With GROUP_COMMIT=true, calls are handed to a single writer thread
+instead. The writer collects up to GROUP_COMMIT_MAX_BATCH of them, or whatever
+arrives within GROUP_COMMIT_WINDOW_MS of the first, and commits them all in
+one transaction, so one fsync and one write lock serve the whole batch.
+
+Each call runs inside its own SAVEPOINT. If one fails, only its savepoint is
+rolled back and only its caller gets the exception; the rest of the batch
+commits. If the commit itself fails, each call of the batch is retried in a
+transaction of its own, so every caller still gets its own result or error.
+ORM objects returned by `work` are merged into the caller's session.
+
+A caller that has waited GROUP_COMMIT_TIMEOUT_SECONDS cancels its call if the
+writer has not picked it up yet, and gets 503: nothing was written, so a retry
+cannot duplicate it. Once the writer has started a call, its caller waits for
+the outcome.
+
+The writer keeps a connection of its own. Waiting callers still hold theirs,
+so a writer that borrowed from the pool could starve behind them.
+"""
+
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from typing import Callable, Optional, TypeVar
+
+from fastapi import HTTPException
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from . import metrics
+from .database import Base, SessionLocal, get_engine
+
+logger = logging.getLogger(__name__)
+
+GROUP_COMMIT = os.getenv("GROUP_COMMIT", "false").lower() == "true"
+GROUP_COMMIT_WINDOW_MS = float(os.getenv("GROUP_COMMIT_WINDOW_MS", 5))
+GROUP_COMMIT_MAX_BATCH = int(os.getenv("GROUP_COMMIT_MAX_BATCH", 64))
+# How long a caller waits for its batch before giving up
+GROUP_COMMIT_TIMEOUT_SECONDS = float(os.getenv("GROUP_COMMIT_TIMEOUT_SECONDS", 30))
+
+T = TypeVar("T")
+
+
+def _attach(db: Session, value):
+    """Move ORM objects the writer created into the caller's session (tuples are walked)."""
+    if isinstance(value, tuple):
+        return tuple(_attach(db, item) for item in value)
+    if isinstance(value, Base):
+        return db.merge(value, load=False)
+    return value
+
+
+class GroupCommitWriter:
+    def __init__(self):
+        self.queue: "queue.Queue" = queue.Queue()
+        self.thread: Optional[threading.Thread] = None
+        self.connection = None
+        self.stats = {"calls": 0, "batches": 0, "failed_calls": 0, "commit_failures": 0, "largest_batch": 0,
+                      "timed_out": 0}
+
+    @property
+    def running(self) -> bool:
+        return self.thread is not None
+
+    def start(self) -> None:
+        if self.thread is None:
+            self.connection = get_engine().connect()
+            self.thread = threading.Thread(target=self._run, name="group-commit", daemon=True)
+            self.thread.start()
+            logger.info(f"Group commit on: batches of up to {GROUP_COMMIT_MAX_BATCH} within {GROUP_COMMIT_WINDOW_MS} ms.")
+
+    def stop(self) -> None:
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join(GROUP_COMMIT_TIMEOUT_SECONDS)
+            self.thread = None
+            self.connection.close()
+            self.connection = None
+
+    def submit(self, work: Callable[[Session], T]) -> T:
+        future: Future = Future()
+        self.queue.put((work, future))
+        try:
+            return future.result(GROUP_COMMIT_TIMEOUT_SECONDS)
+        except FutureTimeout:
+            if not future.cancel():
+                # The writer is running it; the commit may already have happened
+                return future.result()
+            self.stats["timed_out"] += 1
+            raise HTTPException(status_code=503, detail="The database is busy. Try again shortly.")
+
+    # Writer thread
+
+    def _collect(self) -> Optional[list]:
+        first = self.queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = time.monotonic() + GROUP_COMMIT_WINDOW_MS / 1000
+        while len(batch) < GROUP_COMMIT_MAX_BATCH:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self.queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                self.queue.put(None)  # finish this batch, then stop
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+            # Calls whose callers gave up are skipped; the rest can no longer be cancelled
+            batch = [(work, future) for work, future in batch if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            self.stats["batches"] += 1
+            self.stats["calls"] += len(batch)
+            self.stats["largest_batch"] = max(self.stats["largest_batch"], len(batch))
+            try:
+                self._commit_batch(batch)
+            except Exception:
+                self.stats["commit_failures"] += 1
+                logger.exception(f"Group commit of {len(batch)} writes failed; retrying them one by one")
+                for work, future in batch:
+                    if not future.done():
+                        self._commit_one(work, future)
+
+    def _commit_batch(self, batch: list) -> None:
+        db = SessionLocal(bind=self.connection, expire_on_commit=False)
+        try:
+            if db.get_bind().dialect.name == "sqlite":
+                # Explicit BEGIN so SAVEPOINTs nest in it (pysqlite starts transactions lazily),
+                # IMMEDIATE so the write lock is taken once, up front
+                db.execute(text("BEGIN IMMEDIATE"))
+            results = []
+            for work, future in batch:
+                try:
+                    with db.begin_nested():
+                        results.append((future, work(db)))
+                except Exception as e:
+                    self.stats["failed_calls"] += 1
+                    future.set_exception(e)
+            db.commit()
+            db.expunge_all()
+        finally:
+            db.close()
+        for future, result in results:
+            future.set_result(result)
+
+    def _commit_one(self, work, future: Future) -> None:
+        db = SessionLocal(bind=self.connection, expire_on_commit=False)
+        try:
+            result = work(db)
+            db.commit()
+            db.expunge_all()
+            future.set_result(result)
+        except Exception as e:
+            db.rollback()
+            self.stats["failed_calls"] += 1
+            future.set_exception(e)
+        finally:
+            db.close()
+
+    def snapshot(self) -> dict:
+        batches = self.stats["batches"]
+        return dict(
+            self.stats,
+            enabled=GROUP_COMMIT,
+            queued=self.queue.qsize(),
+            average_batch=round(self.stats["calls"] / batches, 2) if batches else None,
+        )
+
+
+writer = GroupCommitWriter()
+metrics.register("group_commit", writer.snapshot)
+
+
+def run(db: Session, work: Callable[[Session], T]) -> T:
+    """Execute `work` and commit it: batched on the writer thread when group commit is on."""
+    if not (GROUP_COMMIT and writer.running):
+        result = work(db)
+        db.commit()
+        return result
+    return _attach(db, writer.submit(work))
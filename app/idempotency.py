@@ -0,0 +1,325 @@
+# app/idempotency.py
+"""
+`Idempotency-Key` support for POST endpoints that create resources.
+
+A client that retries a request with the same key gets the first response back
+without the route running again. The key is stored with a fingerprint of the
+request (content type and body), and a key reused for a different request is
+refused with 422 rather than replaying someone else's response; the wrapped
+routes take no credentials, so the key alone does not tell callers apart.
+Responses are kept in the `idempotency_keys` table for IDEMPOTENCY_TTL_SECONDS
+and in a small in-process cache. A key's row is inserted before the route runs, so duplicates
+arriving while the original is still in flight wait for it instead of
+repeating it. Within one process they wait on a future; across processes they
+poll the row.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Iterable, Optional, Tuple
+
+from sqlalchemy.exc import IntegrityError
+from starlette.concurrency import run_in_threadpool
+
+from . import metrics, models
+from .database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", 24 * 3600))
+IDEMPOTENCY_LOCK_SECONDS = int(os.getenv("IDEMPOTENCY_LOCK_SECONDS", 120))
+IDEMPOTENCY_WAIT_SECONDS = float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", 30))
+IDEMPOTENCY_MAX_BODY = int(os.getenv("IDEMPOTENCY_MAX_BODY", 64 * 1024))
+IDEMPOTENCY_CACHE_SIZE = int(os.getenv("IDEMPOTENCY_CACHE_SIZE", 1024))
+PURGE_INTERVAL_SECONDS = 60
+
+IDEMPOTENT_PATHS = ("/user/detections", "/doctor/detections", "/user/register", "/doctor/register")
+
+# Headers that describe the original transfer rather than the response itself
+SKIPPED_HEADERS = {b"content-length", b"date", b"server", b"set-cookie"}
+# Transient outcomes a retry should re-run rather than replay
+RETRYABLE_STATUSES = {408, 409, 425, 429}
+
+StoredResponse = Tuple[int, list, bytes]
+
+MISMATCH_RESPONSE: StoredResponse = (
+    422, [["content-type", "application/json"]],
+    b'{"detail":"This Idempotency-Key was already used for a different request."}',
+)
+
+stats = {"requests": 0, "replayed": 0, "coalesced": 0, "stored": 0, "conflicts": 0, "mismatches": 0}
+_last_purge = 0.0
+
+
+# --------------------------------------
+# Store
+# --------------------------------------
+
+def _purge_expired(db) -> None:
+    global _last_purge
+    if time.monotonic() - _last_purge < PURGE_INTERVAL_SECONDS:
+        return
+    _last_purge = time.monotonic()
+    db.query(models.IdempotencyKey).filter(models.IdempotencyKey.expires_at < datetime.utcnow()).delete(
+        synchronize_session=False
+    )
+    db.commit()
+
+
+def fingerprint(content_type: bytes, body: bytes) -> str:
+    """
+    sha256 of what a request asks for. A multipart boundary is random per encoding,
+    so it is taken out, and a retry that re-encodes the same form still matches.
+    """
+    media_type, _, params = content_type.partition(b";")
+    boundary = re.search(rb'boundary="?([^";]+)"?', params)
+    if boundary:
+        body = body.replace(boundary.group(1), b"")
+    return hashlib.sha256(media_type.strip().lower() + b"\0" + body).hexdigest()
+
+
+def _as_response(row: models.IdempotencyKey) -> StoredResponse:
+    return row.status_code, json.loads(row.headers), row.body
+
+
+def claim(key: str, request_fingerprint: str) -> Tuple[str, Optional[StoredResponse]]:
+    """
+    ("done", response) if the key already has a stored response, ("claimed", None)
+    if the caller should run the request, ("busy", None) while another request owns
+    it, or ("mismatch", None) if the key was used for a request with another fingerprint.
+    """
+    db = SessionLocal()
+    try:
+        _purge_expired(db)
+        now = datetime.utcnow()
+        row = db.get(models.IdempotencyKey, key)
+        if row is not None and row.expires_at <= now:
+            db.delete(row)
+            db.commit()
+            row = None
+        if row is None:
+            db.add(models.IdempotencyKey(key=key, fingerprint=request_fingerprint, locked_at=now,
+                                         expires_at=now + timedelta(seconds=IDEMPOTENCY_TTL_SECONDS)))
+            try:
+                db.commit()
+            except IntegrityError:
+                db.rollback()
+                return "busy", None
+            return "claimed", None
+        # Rows from before fingerprints were stored match any request
+        if row.fingerprint is not None and row.fingerprint != request_fingerprint:
+            return "mismatch", None
+        if row.status_code is not None:
+            return "done", _as_response(row)
+        # The owner of a stale pending row died mid-request; take it over with a conditional UPDATE
+        taken = (
+            db.query(models.IdempotencyKey)
+            .filter(
+                models.IdempotencyKey.key == key,
+                models.IdempotencyKey.status_code.is_(None),
+                models.IdempotencyKey.locked_at < now - timedelta(seconds=IDEMPOTENCY_LOCK_SECONDS),
+            )
+            .update({"locked_at": now}, synchronize_session=False)
+        )
+        db.commit()
+        return ("claimed" if taken else "busy"), None
+    finally:
+        db.close()
+
+
+def complete(key: str, response: StoredResponse) -> None:
+    status_code, headers, body = response
+    db = SessionLocal()
+    try:
+        db.query(models.IdempotencyKey).filter(models.IdempotencyKey.key == key).update(
+            {
+                "status_code": status_code,
+                "headers": json.dumps(headers),
+                "body": body,
+                "expires_at": datetime.utcnow() + timedelta(seconds=IDEMPOTENCY_TTL_SECONDS),
+            },
+            synchronize_session=False,
+        )
+        db.commit()
+    finally:
+        db.close()
+
+
+def release(key: str) -> None:
+    """Forget a pending key so the request can be retried, e.g. after a server error."""
+    db = SessionLocal()
+    try:
+        db.query(models.IdempotencyKey).filter(
+            models.IdempotencyKey.key == key, models.IdempotencyKey.status_code.is_(None)
+        ).delete(synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+
+
+# --------------------------------------
+# Middleware
+# --------------------------------------
+
+class IdempotencyMiddleware:
+    def __init__(self, app, paths: Iterable[str] = IDEMPOTENT_PATHS):
+        self.app = app
+        self.paths = set(paths)
+        self.cache: "OrderedDict[str, Tuple[float, str, StoredResponse]]" = OrderedDict()
+        self.in_flight = {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] not in self.paths:
+            return await self.app(scope, receive, send)
+        headers = dict(scope["headers"])
+        client_key = headers.get(b"idempotency-key")
+        if not client_key:
+            return await self.app(scope, receive, send)
+        if len(client_key) > 255:
+            return await self._send(send, (400, [["content-type", "application/json"]],
+                                           b'{"detail":"Idempotency-Key must be at most 255 characters."}'))
+
+        stats["requests"] += 1
+        # Keys are scoped to the route and the Authorization header when one is sent; the
+        # wrapped routes mostly take none, so the request fingerprint is checked as well
+        key = hashlib.sha256(b"\0".join(
+            [scope["method"].encode(), scope["path"].encode(), headers.get(b"authorization", b""), client_key]
+        )).hexdigest()
+
+        body = await self._read_body(receive)
+        if body is None:
+            return
+        request_fingerprint = fingerprint(headers.get(b"content-type", b""), body)
+        receive = self._replay_body(body, receive)
+
+        while True:
+            cached = self._cached(key)
+            if cached is not None:
+                cached_fingerprint, stored = cached
+                if cached_fingerprint != request_fingerprint:
+                    return await self._mismatch(send)
+                return await self._replay(send, stored)
+            pending = self.in_flight.get(key)
+            if pending is None:
+                break
+            stats["coalesced"] += 1
+            await asyncio.shield(pending)
+
+        pending = asyncio.get_running_loop().create_future()
+        self.in_flight[key] = pending
+        try:
+            outcome, stored = await run_in_threadpool(claim, key, request_fingerprint)
+            deadline = time.monotonic() + IDEMPOTENCY_WAIT_SECONDS
+            while outcome == "busy" and time.monotonic() < deadline:
+                # Another process is running this request; wait for its response
+                stats["coalesced"] += 1
+                await asyncio.sleep(0.25)
+                outcome, stored = await run_in_threadpool(claim, key, request_fingerprint)
+            if outcome == "mismatch":
+                return await self._mismatch(send)
+            if outcome == "done":
+                self._remember(key, request_fingerprint, stored)
+                return await self._replay(send, stored)
+            if outcome == "busy":
+                stats["conflicts"] += 1
+                return await self._send(send, (409, [["content-type", "application/json"], ["retry-after", "1"]],
+                                               b'{"detail":"A request with this Idempotency-Key is still in progress."}'))
+            await self._run_and_store(key, request_fingerprint, scope, receive, send)
+        finally:
+            del self.in_flight[key]
+            pending.set_result(None)
+
+    @staticmethod
+    async def _read_body(receive) -> Optional[bytes]:
+        """The whole request body, or None if the client went away; it is needed before anything is replayed."""
+        chunks = []
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return None
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body", False):
+                return b"".join(chunks)
+
+    @staticmethod
+    def _replay_body(body: bytes, receive):
+        """A receive that hands the app the body already read, then waits on the client as before."""
+        pending = [{"type": "http.request", "body": body, "more_body": False}]
+
+        async def replay():
+            return pending.pop() if pending else await receive()
+
+        return replay
+
+    async def _run_and_store(self, key: str, request_fingerprint: str, scope, receive, send) -> None:
+        response = {"status": 500, "headers": [], "body": bytearray(), "overflow": False}
+
+        async def capture(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+                response["headers"] = [
+                    [name.decode("latin-1"), value.decode("latin-1")]
+                    for name, value in message.get("headers", []) if name.lower() not in SKIPPED_HEADERS
+                ]
+            elif message["type"] == "http.response.body" and not response["overflow"]:
+                response["body"] += message.get("body", b"")
+                response["overflow"] = len(response["body"]) > IDEMPOTENCY_MAX_BODY
+            await send(message)
+
+        try:
+            await self.app(scope, receive, capture)
+        except BaseException:
+            await run_in_threadpool(release, key)
+            raise
+        if response["status"] >= 500 or response["status"] in RETRYABLE_STATUSES or response["overflow"]:
+            await run_in_threadpool(release, key)
+            return
+        stored = (response["status"], response["headers"], bytes(response["body"]))
+        await run_in_threadpool(complete, key, stored)
+        self._remember(key, request_fingerprint, stored)
+        stats["stored"] += 1
+
+    def _cached(self, key: str) -> Optional[Tuple[str, StoredResponse]]:
+        """(fingerprint, response) stored for the key in this process."""
+        entry = self.cache.get(key)
+        if entry is None:
+            return None
+        expires, request_fingerprint, stored = entry
+        if expires <= time.monotonic():
+            del self.cache[key]
+            return None
+        self.cache.move_to_end(key)
+        return request_fingerprint, stored
+
+    def _remember(self, key: str, request_fingerprint: str, stored: StoredResponse) -> None:
+        self.cache[key] = (time.monotonic() + IDEMPOTENCY_TTL_SECONDS, request_fingerprint, stored)
+        self.cache.move_to_end(key)
+        while len(self.cache) > IDEMPOTENCY_CACHE_SIZE:
+            self.cache.popitem(last=False)
+
+    async def _mismatch(self, send) -> None:
+        stats["mismatches"] += 1
+        await self._send(send, MISMATCH_RESPONSE)
+
+    async def _replay(self, send, stored: StoredResponse) -> None:
+        stats["replayed"] += 1
+        status_code, headers, body = stored
+        await self._send(send, (status_code, headers + [["idempotent-replayed", "true"]], body))
+
+    @staticmethod
+    async def _send(send, response: StoredResponse) -> None:
+        status_code, headers, body = response
+        raw_headers = [(name.encode("latin-1"), value.encode("latin-1")) for name, value in headers]
+        raw_headers.append((b"content-length", str(len(body)).encode()))
+        await send({"type": "http.response.start", "status": status_code, "headers": raw_headers})
+        await send({"type": "http.response.body", "body": body})
+
+
+metrics.register("idempotency", lambda: dict(stats))
@@ -0,0 +1,251 @@
+# app/imaging.py
+"""
+Image validation and sanitising.
+
+Uploads are identified by their magic bytes, not their filename, and their
+dimensions are read from the format header alone (PNG IHDR, JPEG SOFn), so a
+non-image or a decompression bomb is rejected after the first few KB without
+decoding any pixels. Accepted images are re-encoded in a process pool, which
+drops EXIF and other metadata (GPS position, device details) before storage.
+"""
+
+import importlib.util
+import io
+import logging
+import os
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from typing import BinaryIO, Optional
+
+logger = logging.getLogger(__name__)
+
+MAX_IMAGE_PIXELS = int(os.getenv("MAX_IMAGE_PIXELS", 40_000_000))
+MAX_IMAGE_SIDE = int(os.getenv("MAX_IMAGE_SIDE", 12_000))
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", min(4, os.cpu_count() or 1)))
+
+# JPEG metadata segments (EXIF, ICC) come before the frame header, so allow for them.
+HEADER_LIMIT = 256 * 1024
+READ_CHUNK = 64 * 1024
+
+ImageInfo = namedtuple("ImageInfo", ["content_type", "width", "height"])
+
+EXTENSIONS = {
+    "image/jpeg": ".jpg",
+    "image/png": ".png",
+}
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+JPEG_SIGNATURE = b"\xff\xd8\xff"
+# Start-of-frame markers carrying the frame size (all SOFn except DHT, JPG and DAC).
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+class InvalidImage(ValueError):
+    pass
+
+
+def sniff(head: bytes) -> Optional[str]:
+    if head.startswith(PNG_SIGNATURE):
+        return "image/png"
+    if head.startswith(JPEG_SIGNATURE):
+        return "image/jpeg"
+    return None
+
+
+def _png_size(head: bytes):
+    if len(head) < 24:
+        return None
+    if head[12:16] != b"IHDR":
+        raise InvalidImage("Corrupt PNG header.")
+    return int.from_bytes(head[16:20], "big"), int.from_bytes(head[20:24], "big")
+
+
+def _jpeg_size(head: bytes):
+    i = 2
+    while True:
+        # Markers may be padded with any number of 0xFF fill bytes.
+        while i < len(head) and head[i] == 0xFF and i + 1 < len(head) and head[i + 1] == 0xFF:
+            i += 1
+        if i + 4 > len(head):
+            return None
+        if head[i] != 0xFF:
+            raise InvalidImage("Corrupt JPEG header.")
+        marker = head[i + 1]
+        if marker == 0x01 or 0xD0 <= marker <= 0xD8:
+            i += 2
+            continue
+        if marker in (0xD9, 0xDA):
+            raise InvalidImage("JPEG has no frame header.")
+        length = int.from_bytes(head[i + 2:i + 4], "big")
+        if length < 2:
+            raise InvalidImage("Corrupt JPEG header.")
+        if marker in JPEG_SOF_MARKERS:
+            if i + 9 > len(head):
+                return None
+            height = int.from_bytes(head[i + 5:i + 7], "big")
+            width = int.from_bytes(head[i + 7:i + 9], "big")
+            return width, height
+        i += 2 + length
+
+
+def inspect_header(head: bytes) -> Optional[ImageInfo]:
+    """
+    Identify an image from its leading bytes. Returns None while more bytes are
+    needed and raises InvalidImage for anything that is not an acceptable image.
+    """
+    if len(head) < len(PNG_SIGNATURE):
+        return None
+    content_type = sniff(head)
+    if content_type is None:
+        raise InvalidImage("File is not a JPEG or PNG image.")
+    size = _png_size(head) if content_type == "image/png" else _jpeg_size(head)
+    if size is None:
+        return None
+    width, height = size
+    if width == 0 or height == 0:
+        raise InvalidImage("Image has no pixels.")
+    if width > MAX_IMAGE_SIDE or height > MAX_IMAGE_SIDE or width * height > MAX_IMAGE_PIXELS:
+        raise InvalidImage(f"Image dimensions {width}x{height} exceed the allowed size.")
+    return ImageInfo(content_type, width, height)
+
+
+class HeaderValidator:
+    """Incremental inspect_header() for bodies that arrive in chunks."""
+
+    def __init__(self):
+        self.head = bytearray()
+        self.info: Optional[ImageInfo] = None
+
+    def feed(self, chunk: bytes) -> Optional[ImageInfo]:
+        if self.info is None:
+            self.head += chunk[:HEADER_LIMIT - len(self.head)]
+            self.info = inspect_header(bytes(self.head))
+            if self.info is None and len(self.head) >= HEADER_LIMIT:
+                raise InvalidImage("Image header is too large or corrupt.")
+        return self.info
+
+    def finish(self) -> ImageInfo:
+        if self.info is None:
+            raise InvalidImage("File is truncated or not an image.")
+        return self.info
+
+
+def read_header(fileobj: BinaryIO):
+    """
+    Read just enough of a file to validate its header.
+    Returns the ImageInfo and the bytes consumed, which must be replayed ahead of the rest.
+    """
+    validator = HeaderValidator()
+    consumed = bytearray()
+    while validator.info is None:
+        chunk = fileobj.read(READ_CHUNK)
+        if not chunk:
+            break
+        consumed += chunk
+        validator.feed(chunk)
+    return validator.finish(), bytes(consumed)
+
+
+# --------------------------------------
+# Metadata stripping
+# --------------------------------------
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pillow_available: Optional[bool] = None
+
+
+def pillow_available() -> bool:
+    global _pillow_available
+    if _pillow_available is None:
+        _pillow_available = importlib.util.find_spec("PIL") is not None
+        if not _pillow_available:
+            logger.warning("Pillow is not installed; images are stored without stripping metadata.")
+    return _pillow_available
+
+
+def get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=IMAGE_WORKERS)
+    return _pool
+
+
+def shutdown_pool() -> None:
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=True)
+        _pool = None
+
+
+def reencode(data: bytes, content_type: str) -> bytes:
+    """Decode and re-encode an image without its metadata. Runs inside the pool."""
+    from PIL import Image, ImageOps
+
+    Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+    with Image.open(io.BytesIO(data)) as image:
+        # Apply the EXIF orientation to the pixels before the tag is dropped.
+        image = ImageOps.exif_transpose(image)
+        out = io.BytesIO()
+        if content_type == "image/jpeg":
+            if image.mode not in ("RGB", "L"):
+                image = image.convert("RGB")
+            image.save(out, "JPEG", quality=90)
+        else:
+            image.save(out, "PNG")
+    return out.getvalue()
+
+
+def thumbnail(data: bytes, size: int) -> bytes:
+    """Render a JPEG thumbnail fitting in `size` x `size`. Runs inside the pool."""
+    from PIL import Image
+
+    Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+    with Image.open(io.BytesIO(data)) as image:
+        image.draft("RGB", (size, size))  # lets JPEG decode at a reduced scale
+        image = image.convert("RGB")
+        image.thumbnail((size, size))
+        out = io.BytesIO()
+        image.save(out, "JPEG", quality=80)
+    return out.getvalue()
+
+
+def dhash(data: bytes) -> str:
+    """
+    64-bit difference hash as 16 hex digits: each bit says whether a pixel of a
+    9x8 greyscale reduction is brighter than its right neighbour. Runs inside the pool.
+    """
+    from PIL import Image
+
+    Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+    with Image.open(io.BytesIO(data)) as image:
+        image.draft("L", (64, 64))
+        pixels = list(image.convert("L").resize((9, 8), Image.LANCZOS).getdata())
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            value = (value << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return f"{value:016x}"
+
+
+def compute_dhash(data: bytes) -> Optional[str]:
+    """Perceptual hash of `data` computed in the process pool; None when Pillow is missing."""
+    if not pillow_available():
+        return None
+    return get_pool().submit(dhash, data).result()
+
+
+def render_thumbnail(data: bytes, size: int) -> Optional[bytes]:
+    """Thumbnail `data` in the process pool; None when Pillow is missing."""
+    if not pillow_available():
+        return None
+    return get_pool().submit(thumbnail, data, size).result()
+
+
+def strip_metadata(data: bytes, content_type: str) -> bytes:
+    """Re-encode `data` in the process pool; returns it unchanged when Pillow is missing."""
+    if not pillow_available():
+        return data
+    try:
+        return get_pool().submit(reencode, data, content_type).result()
+    except Exception as e:
+        raise InvalidImage(f"Image could not be decoded: {e}")
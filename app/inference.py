@@ -0,0 +1,198 @@
+# app/inference.py
+"""
+Server-side syndrome inference.
+
+The model named by INFERENCE_MODEL (`module:Class`, a ModelRunner) is loaded
+once in each process of a CPU process pool. Requests are micro-batched: the
+first queued image opens a batch that closes when it holds
+INFERENCE_MAX_BATCH images or INFERENCE_MAX_WAIT_MS has passed, and the whole
+batch goes to one pool process in a single call.
+"""
+
+import asyncio
+import hashlib
+import importlib
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Tuple
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+INFERENCE_MODEL = os.getenv("INFERENCE_MODEL", "app.inference:DeterministicModel")
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", min(2, os.cpu_count() or 1)))
+INFERENCE_MAX_BATCH = int(os.getenv("INFERENCE_MAX_BATCH", 16))
+INFERENCE_MAX_WAIT_MS = float(os.getenv("INFERENCE_MAX_WAIT_MS", 10))
+
+
+class ModelRunner:
+    """Interface for syndrome classifiers run by the inference pool."""
+
+    name = "model"
+
+    def load(self) -> None:
+        """Load weights; called once per pool process."""
+
+    def predict(self, images: List[bytes]) -> List[Tuple[str, float]]:
+        """Return a (result, confidence) pair for each encoded image, in order."""
+        raise NotImplementedError
+
+
+class DeterministicModel(ModelRunner):
+    """
+    CPU stand-in model for development and tests: the label and confidence are
+    derived from a digest of the image bytes, so equal images always agree.
+    """
+
+    name = "deterministic-stand-in"
+    labels = ["Down syndrome", "Williams syndrome", "Noonan syndrome", "Angelman syndrome", "No syndrome detected"]
+
+    def predict(self, images: List[bytes]) -> List[Tuple[str, float]]:
+        results = []
+        for image in images:
+            digest = hashlib.sha256(image).digest()
+            label = self.labels[digest[0] % len(self.labels)]
+            confidence = round(0.5 + digest[1] / 510, 4)
+            results.append((label, confidence))
+        return results
+
+
+def load_model(path: str) -> ModelRunner:
+    module_name, _, class_name = path.partition(":")
+    model = getattr(importlib.import_module(module_name), class_name)()
+    model.load()
+    return model
+
+
+# --------------------------------------
+# Pool process side
+# --------------------------------------
+
+_model: Optional[ModelRunner] = None
+
+
+def _init_worker(model_path: str) -> None:
+    global _model
+    _model = load_model(model_path)
+
+
+def _predict_batch(images: List[bytes]) -> List[Tuple[str, float]]:
+    return _model.predict(images)
+
+
+# --------------------------------------
+# API process side
+# --------------------------------------
+
+class MicroBatcher:
+    def __init__(self, model_path: str = INFERENCE_MODEL, workers: int = INFERENCE_WORKERS,
+                 max_batch: int = INFERENCE_MAX_BATCH, max_wait_ms: float = INFERENCE_MAX_WAIT_MS):
+        self.model_path = model_path
+        self.workers = workers
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.pool: Optional[ProcessPoolExecutor] = None
+        self.pool_lock = threading.Lock()
+        self.queue: Optional[asyncio.Queue] = None
+        self.task: Optional[asyncio.Task] = None
+        self.in_flight: Optional[asyncio.Semaphore] = None
+        self.started_at = time.monotonic()
+        self.stats = {"requests": 0, "batches": 0, "errors": 0, "busy_seconds": 0.0, "batch_sizes": {}}
+
+    def _ensure_pool(self) -> ProcessPoolExecutor:
+        with self.pool_lock:
+            if self.pool is None:
+                self.pool = ProcessPoolExecutor(
+                    max_workers=self.workers, initializer=_init_worker, initargs=(self.model_path,),
+                )
+            return self.pool
+
+    def start(self) -> None:
+        self._ensure_pool()
+        self.queue = asyncio.Queue()
+        self.in_flight = asyncio.Semaphore(self.workers)
+        self.task = asyncio.get_running_loop().create_task(self._collect())
+        logger.info(f"Inference pool started: {self.model_path} x{self.workers}")
+
+    async def stop(self) -> None:
+        if self.task:
+            self.task.cancel()
+            self.task = None
+        if self.pool:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
+
+    async def predict(self, image: bytes) -> Tuple[str, float]:
+        if self.task is None:
+            self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((image, future))
+        self.stats["requests"] += 1
+        return await future
+
+    def predict_blocking(self, image: bytes) -> Tuple[str, float]:
+        """Classify one image from a worker thread (e.g. a background job), bypassing the batcher."""
+        return self._ensure_pool().submit(_predict_batch, [image]).result()[0]
+
+    async def _collect(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            # Keep at most one batch per pool process in flight; later requests keep queueing.
+            await self.in_flight.acquire()
+            loop.create_task(self._run(batch))
+
+    async def _run(self, batch) -> None:
+        started = time.perf_counter()
+        try:
+            results = await asyncio.get_running_loop().run_in_executor(
+                self.pool, _predict_batch, [image for image, _ in batch],
+            )
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+        except Exception as e:
+            self.stats["errors"] += 1
+            logger.exception("Inference batch failed")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            self.in_flight.release()
+            self.stats["batches"] += 1
+            self.stats["busy_seconds"] += time.perf_counter() - started
+            sizes = self.stats["batch_sizes"]
+            sizes[len(batch)] = sizes.get(len(batch), 0) + 1
+
+    def snapshot(self) -> dict:
+        items = sum(size * count for size, count in self.stats["batch_sizes"].items())
+        elapsed = time.monotonic() - self.started_at
+        return {
+            "model": self.model_path,
+            "workers": self.workers,
+            "requests": self.stats["requests"],
+            "batches": self.stats["batches"],
+            "errors": self.stats["errors"],
+            "queued": self.queue.qsize() if self.queue else 0,
+            "mean_batch_size": round(items / self.stats["batches"], 3) if self.stats["batches"] else 0,
+            "batch_sizes": dict(sorted(self.stats["batch_sizes"].items())),
+            "throughput_per_second": round(items / elapsed, 3) if elapsed else 0,
+            "mean_batch_seconds": round(self.stats["busy_seconds"] / self.stats["batches"], 6) if self.stats["batches"] else 0,
+        }
+
+
+batcher = MicroBatcher()
+metrics.register("inference", batcher.snapshot)
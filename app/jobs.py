@@ -0,0 +1,163 @@
+# app/jobs.py
+"""
+Persistent background jobs without an external broker.
+
+Jobs are rows in the `jobs` table. Worker threads in every app process poll
+for due jobs and claim one with a conditional UPDATE, so any number of
+processes can share the table. A failed job is retried with exponential
+backoff until `max_attempts`; a job whose worker died is reclaimed once its
+lease expires. Handlers are registered per `kind` with `@handler`.
+"""
+
+import json
+import logging
+import os
+import random
+import threading
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional
+from uuid import uuid4
+
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import Session
+
+from . import models
+from .database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 2))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", 1.0))
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", 600))
+JOB_BACKOFF_BASE = float(os.getenv("JOB_BACKOFF_BASE", 2.0))
+JOB_BACKOFF_MAX = float(os.getenv("JOB_BACKOFF_MAX", 300.0))
+
+HANDLERS: Dict[str, Callable[[dict], Optional[dict]]] = {}
+
+_wakeup = threading.Event()
+_stopping = threading.Event()
+_threads: List[threading.Thread] = []
+
+
+def handler(kind: str):
+    """Register the function run for jobs of `kind`. It receives the payload and may return a result dict."""
+    def register(func):
+        HANDLERS[kind] = func
+        return func
+    return register
+
+
+def enqueue(db: Session, kind: str, payload: dict, max_attempts: int = 5) -> models.Job:
+    """
+    Add a job to the session. It becomes visible to workers when the caller
+    commits, so it is enqueued atomically with the caller's own changes.
+    """
+    job = models.Job(kind=kind, payload=json.dumps(payload), max_attempts=max_attempts)
+    db.add(job)
+    db.flush()
+    _wakeup.set()
+    return job
+
+
+def get_job(db: Session, job_id: int) -> Optional[models.Job]:
+    return db.query(models.Job).filter(models.Job.id == job_id).first()
+
+
+def backoff_seconds(attempts: int) -> float:
+    delay = min(JOB_BACKOFF_MAX, JOB_BACKOFF_BASE * 2 ** (attempts - 1))
+    return delay * random.uniform(0.5, 1.0)
+
+
+def claim_next(db: Session, worker_id: str) -> Optional[models.Job]:
+    now = datetime.utcnow()
+    due = or_(
+        and_(models.Job.status == "queued", models.Job.run_after <= now),
+        and_(models.Job.status == "running", models.Job.locked_at < now - timedelta(seconds=JOB_LEASE_SECONDS)),
+    )
+    candidate = db.query(models.Job.id).filter(due).order_by(models.Job.run_after, models.Job.id).first()
+    if candidate is None:
+        return None
+    # Only one worker's UPDATE can match the row it saw; the others move on.
+    claimed = (
+        db.query(models.Job)
+        .filter(models.Job.id == candidate.id, due)
+        .update(
+            {
+                "status": "running",
+                "locked_by": worker_id,
+                "locked_at": now,
+                "attempts": models.Job.attempts + 1,
+                "updated_at": now,
+            },
+            synchronize_session=False,
+        )
+    )
+    db.commit()
+    return get_job(db, candidate.id) if claimed else None
+
+
+def run_job(db: Session, job: models.Job) -> None:
+    func = HANDLERS.get(job.kind)
+    try:
+        if func is None:
+            raise LookupError(f"No handler registered for job kind {job.kind!r}")
+        result = func(json.loads(job.payload))
+    except Exception as e:
+        db.rollback()
+        logger.exception(f"Job {job.id} ({job.kind}) failed on attempt {job.attempts}")
+        job.last_error = f"{type(e).__name__}: {e}"
+        if job.attempts >= job.max_attempts or func is None:
+            job.status = "failed"
+        else:
+            job.status = "queued"
+            job.run_after = datetime.utcnow() + timedelta(seconds=backoff_seconds(job.attempts))
+    else:
+        job.status = "succeeded"
+        job.result = json.dumps(result) if result is not None else None
+    job.locked_by = None
+    job.locked_at = None
+    job.updated_at = datetime.utcnow()
+    db.commit()
+
+
+def _work(worker_id: str) -> None:
+    while not _stopping.is_set():
+        db = SessionLocal()
+        try:
+            job = claim_next(db, worker_id)
+            if job is not None:
+                run_job(db, job)
+        except Exception:
+            logger.exception("Job worker error")
+            job = None
+        finally:
+            db.close()
+        if job is None:
+            _wakeup.wait(JOB_POLL_INTERVAL)
+            _wakeup.clear()
+
+
+def start_workers(count: int = JOB_WORKERS) -> None:
+    # Importing the task modules registers their handlers.
+    from . import tasks  # noqa: F401
+
+    _stopping.clear()
+    for i in range(count):
+        thread = threading.Thread(target=_work, args=(f"{os.getpid()}-{i}-{uuid4().hex[:6]}",),
+                                  name=f"job-worker-{i}", daemon=True)
+        thread.start()
+        _threads.append(thread)
+    logger.info(f"Started {count} job workers.")
+
+
+def alive_workers() -> int:
+    return sum(thread.is_alive() for thread in _threads)
+
+
+def stop_workers(timeout: float = 10.0) -> None:
+    """Stop polling and wait for running jobs to finish."""
+    _stopping.set()
+    _wakeup.set()
+    for thread in _threads:
+        thread.join(timeout)
+    _threads.clear()
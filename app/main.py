@@ -1,26 +1,81 @@
 # app/main.py
 
-
-# from fastapi import FastAPI
-# from .routes import router
-# from .database import init_db
+import logging
 import os
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import RedirectResponse
 from fastapi.staticfiles import StaticFiles
+from . import archive, compression, events, groupcommit, idempotency, imaging, inference, jobs, phash, ratelimit, revocation
+from .database import DB_LEAK_DETECTION, SessionLeakMiddleware, init_db
 from .routes import router
+from .storage import get_storage
+
+# Create missing tables, columns and indexes at startup; turn off where migrations own the
+# schema. run.py does it once before forking and starts its workers with this off.
+INIT_DB_ON_STARTUP = os.getenv("INIT_DB_ON_STARTUP", "true").lower() == "true"
+
+
+def create_app(init_schema: bool = INIT_DB_ON_STARTUP, run_jobs: bool = True) -> FastAPI:
+    """
+    Build the API. The database is first touched, and worker threads started,
+    when the lifespan begins, so importing and building the app stays cheap.
+    """
+    logging.basicConfig(level=logging.INFO)
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        if init_schema:
+            await run_in_threadpool(init_db)
+        await run_in_threadpool(revocation.revocations.start)
+        phash.index.start()
+        events.start()
+        if groupcommit.GROUP_COMMIT:
+            groupcommit.writer.start()
+        if run_jobs:
+            jobs.start_workers()
+            archive.start()
+        yield
+        if run_jobs:
+            archive.stop()
+            jobs.stop_workers()
+        groupcommit.writer.stop()
+        phash.index.stop()
+        revocation.revocations.stop()
+        events.stop()
+        await inference.batcher.stop()
+        imaging.shutdown_pool()
 
-app = FastAPI(title="Syndrome API", version="0.112.2")
+    app = FastAPI(title="Syndrome API", version="0.112.2", lifespan=lifespan)
+    if DB_LEAK_DETECTION:
+        app.add_middleware(SessionLeakMiddleware)
+    app.add_middleware(idempotency.IdempotencyMiddleware)
+    # Outside the idempotency store, so stored responses stay uncompressed and replay in any encoding
+    app.add_middleware(compression.CompressionMiddleware)
+    # Outermost, so rejected requests never reach the idempotency store or the threadpool
+    app.add_middleware(ratelimit.RateLimitMiddleware)
 
+    media_storage = get_storage()
+    if media_storage.serves_locally:
+        # Serve the "media" directory for uploaded files
+        media_path = os.path.join(os.getcwd(), media_storage.root)
+        os.makedirs(media_path, exist_ok=True)
+        app.mount("/media", StaticFiles(directory=media_path), name="media")
+    else:
+        # Media lives in object storage: hand clients a short-lived signed URL instead of proxying bytes
+        @app.get("/media/{key:path}", include_in_schema=False)
+        def read_media(key: str):
+            return RedirectResponse(media_storage.presigned_url(key), status_code=307)
 
-# Serve the "media" directory for uploaded files
-media_path = os.path.join(os.getcwd(), "media")
-app.mount("/media", StaticFiles(directory=media_path), name="media")
+    # Include your routers or other configurations
+    app.include_router(router)
 
-# Include your routers or other configurations
-app.include_router(router)
+    @app.get("/")
+    def read_root():
+        return {"message": "Welcome to my FastAPI project!"}
 
+    return app
 
 
-@app.get("/")
-def read_root():
-    return {"message": "Welcome to my FastAPI project!"}
+app = create_app()
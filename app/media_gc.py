@@ -0,0 +1,155 @@
+# app/media_gc.py
+"""
+Media garbage collector.
+
+Reconciles the objects in media storage with the URLs stored in the database, one
+category at a time. Both sides are produced in sorted order (the database side
+is streamed straight from an ORDER BY query, the storage side comes from a
+sorted listing) and merge-joined, so memory stays flat no matter how many
+rows there are.
+
+    python -m app.media_gc                 # report only
+    python -m app.media_gc --delete        # also remove orphaned files
+"""
+
+import argparse
+import json
+import logging
+import time
+from typing import Iterator, List, Optional, Tuple
+
+from sqlalchemy import select, union_all
+from sqlalchemy.orm import Session
+
+from . import models, storage, utils
+from .database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+# Category directory -> model columns holding its `/media/<category>/<name>` URLs.
+MEDIA_REFERENCES = {
+    "articles": [models.Article.photo_url],
+    # Archived detections keep their files; their URLs are listed in archived_media
+    "detections": [models.SyndromeDetection.image_url, models.ArchivedMedia.url],
+    "thumbnails": [models.SyndromeDetection.thumbnail_url, models.ArchivedMedia.url],
+    "users": [models.Doctor.profile_image, models.NormalUser.profile_image],
+}
+
+STREAM_BATCH_SIZE = 1000
+
+
+def iter_referenced_names(db: Session, category: str) -> Iterator[str]:
+    """Distinct file names referenced by the database for a category, in sorted order."""
+    prefix = f"{utils.MEDIA_URL_PREFIX}{category}/"
+    selects = [
+        select(column.label("url")).where(column.like(prefix + "%"))
+        for column in MEDIA_REFERENCES[category]
+    ]
+    query = union_all(*selects).subquery()
+    result = db.execute(
+        select(query.c.url).order_by(query.c.url).execution_options(yield_per=STREAM_BATCH_SIZE)
+    )
+    previous = None
+    for (url,) in result:
+        if url != previous:
+            yield url[len(prefix):]
+            previous = url
+
+
+def merge_join(referenced: Iterator[str], stored: Iterator[Tuple[str, int, float]]):
+    """
+    Walk both sorted streams together and yield (name, referenced, stored_entry),
+    where stored_entry is None for references whose file is missing.
+    """
+    sentinel = object()
+    ref = next(referenced, sentinel)
+    entry = next(stored, sentinel)
+    while ref is not sentinel or entry is not sentinel:
+        if entry is sentinel or (ref is not sentinel and ref < entry[0]):
+            yield ref, True, None
+            ref = next(referenced, sentinel)
+        elif ref is sentinel or entry[0] < ref:
+            yield entry[0], False, entry
+            entry = next(stored, sentinel)
+        else:
+            yield ref, True, entry
+            ref = next(referenced, sentinel)
+            entry = next(stored, sentinel)
+
+
+def _delete_batch(category: str, names: List[str]) -> int:
+    return utils.remove_media_files(f"{utils.MEDIA_URL_PREFIX}{category}/{name}" for name in names)
+
+
+def reconcile_category(
+    db: Session,
+    category: str,
+    delete: bool = False,
+    batch_size: int = 100,
+    pause: float = 0.5,
+    min_age: float = 3600,
+) -> dict:
+    """
+    Report (and optionally delete) orphaned files of one category.
+    Files younger than `min_age` seconds are never treated as orphans, since an
+    upload is written to disk before its row is committed.
+    """
+    report = {
+        "referenced_files": 0, "referenced_bytes": 0,
+        "orphan_files": 0, "orphan_bytes": 0,
+        "missing_files": 0, "deleted_files": 0,
+    }
+    cutoff = time.time() - min_age
+    stored = storage.get_storage().iter_objects(category)
+    batch = []
+    for name, referenced, entry in merge_join(iter_referenced_names(db, category), stored):
+        if referenced:
+            if entry is None:
+                report["missing_files"] += 1
+            else:
+                report["referenced_files"] += 1
+                report["referenced_bytes"] += entry[1]
+            continue
+        _, size, mtime = entry
+        if mtime > cutoff:
+            continue
+        report["orphan_files"] += 1
+        report["orphan_bytes"] += size
+        if delete:
+            batch.append(name)
+            if len(batch) >= batch_size:
+                report["deleted_files"] += _delete_batch(category, batch)
+                batch = []
+                time.sleep(pause)
+    if batch:
+        report["deleted_files"] += _delete_batch(category, batch)
+    return report
+
+
+def reconcile(db: Session, categories: Optional[List[str]] = None, **options) -> dict:
+    return {category: reconcile_category(db, category, **options) for category in categories or MEDIA_REFERENCES}
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Report and remove media files no longer referenced by the database.")
+    parser.add_argument("--delete", action="store_true", help="delete orphaned files (default: report only)")
+    parser.add_argument("--category", action="append", choices=sorted(MEDIA_REFERENCES),
+                        help="limit to a media category (repeatable)")
+    parser.add_argument("--batch-size", type=int, default=100, help="files deleted per batch")
+    parser.add_argument("--pause", type=float, default=0.5, help="seconds to sleep between delete batches")
+    parser.add_argument("--min-age", type=float, default=3600, help="ignore files modified in the last N seconds")
+    args = parser.parse_args(argv)
+
+    db = SessionLocal()
+    try:
+        report = reconcile(
+            db, args.category,
+            delete=args.delete, batch_size=args.batch_size, pause=args.pause, min_age=args.min_age,
+        )
+    finally:
+        db.close()
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
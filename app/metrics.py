@@ -0,0 +1,17 @@
+# app/metrics.py
+"""
+In-process metrics registry. Subsystems register a callable returning a
+JSON-serialisable snapshot, and `GET /metrics` reports all of them.
+"""
+
+from typing import Callable, Dict
+
+_sources: Dict[str, Callable[[], dict]] = {}
+
+
+def register(name: str, snapshot: Callable[[], dict]) -> None:
+    _sources[name] = snapshot
+
+
+def collect() -> dict:
+    return {name: snapshot() for name, snapshot in _sources.items()}
@@ -1,6 +1,8 @@
 # app/models.py
 
-from sqlalchemy import Column, Integer, String, ForeignKey, Text
+from datetime import datetime
+
+from sqlalchemy import Column, DateTime, Float, Integer, LargeBinary, String, ForeignKey, Text, Index
 from sqlalchemy.orm import relationship
 from .database import Base
 
@@ -36,9 +38,15 @@ class NormalUser(Base):
 
 class Case(Base):
     __tablename__ = "cases"
+    # Composite indexes backing the doctor case search (filter + keyset sort in one index range).
+    __table_args__ = (
+        Index("ix_cases_doctor_name", "doctor_id", "name", "id"),
+        Index("ix_cases_doctor_age", "doctor_id", "age", "id"),
+        Index("ix_cases_doctor_gender_nationality", "doctor_id", "gender", "nationality"),
+    )
     id = Column(Integer, primary_key=True, index=True)
     description = Column(String, nullable=True)  # Allow description to be null
-    doctor_id = Column(Integer, ForeignKey("doctors.id"), nullable=False)
+    doctor_id = Column(Integer, ForeignKey("doctors.id"), nullable=False, index=True)
     name = Column(String, nullable=False)
     age = Column(Integer, nullable=False)
     gender = Column(String, nullable=False)
@@ -49,11 +57,16 @@ class Case(Base):
 
 class SyndromeDetection(Base):
     __tablename__ = "syndrome_detections"
+    __table_args__ = (
+        Index("ix_syndrome_detections_case_result", "case_id", "result"),
+        Index("ix_syndrome_detections_user_change_seq", "normal_user_id", "change_seq"),
+        Index("ix_syndrome_detections_case_change_seq", "case_id", "change_seq"),
+    )
     id = Column(Integer, primary_key=True, index=True)
     result = Column(String, nullable=False)
-    image_url = Column(String, nullable=False)
+    image_url = Column(String, nullable=False, index=True)
     date_of_detection = Column(String, nullable=False)
-    case_id = Column(Integer, ForeignKey("cases.id"), nullable=True)
+    case_id = Column(Integer, ForeignKey("cases.id"), nullable=True, index=True)
     normal_user_id = Column(Integer, ForeignKey("normal_users.id"), nullable=True)
     # User-specific attributes
     name = Column(String, nullable=True)
@@ -61,6 +74,15 @@ class SyndromeDetection(Base):
     gender = Column(String, nullable=True)
     nationality = Column(String, nullable=True)
     description = Column(String, nullable=True)
+    # Filled in by background processing
+    thumbnail_url = Column(String, nullable=True)
+    computed_result = Column(String, nullable=True)
+    computed_confidence = Column(Float, nullable=True)
+    phash = Column(String(16), nullable=True, index=True)
+    # Position in the detections change stream; bumped on every insert and update (see changes.py)
+    change_seq = Column(Integer, nullable=True)
+    # When the row was stored; date_of_detection is free-form client input. Drives archival (see archive.py)
+    created_at = Column(DateTime, nullable=True, default=datetime.utcnow, index=True)
 
     case = relationship("Case", back_populates="syndrome_detections")
     normal_user = relationship("NormalUser", back_populates="syndrome_detections")
@@ -73,3 +95,111 @@ class Article(Base):
     author = Column(String, nullable=False)
     photo_url = Column(String, nullable=False)
     content = Column(Text, nullable=False)
+
+
+class Job(Base):
+    __tablename__ = "jobs"
+    __table_args__ = (
+        Index("ix_jobs_status_run_after", "status", "run_after"),
+        # Pending runs of one kind (archive.schedule); status alone barely narrows a long job history
+        Index("ix_jobs_kind_status", "kind", "status"),
+    )
+    id = Column(Integer, primary_key=True, index=True)
+    kind = Column(String, nullable=False)
+    payload = Column(Text, nullable=False)  # JSON
+    status = Column(String, nullable=False, default="queued")  # queued, running, succeeded, failed
+    attempts = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False, default=5)
+    run_after = Column(DateTime, nullable=False, default=datetime.utcnow)
+    locked_by = Column(String, nullable=True)
+    locked_at = Column(DateTime, nullable=True)
+    result = Column(Text, nullable=True)  # JSON
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    updated_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_keys"
+    key = Column(String(64), primary_key=True)  # sha256 of method, path, principal and client key
+    fingerprint = Column(String(64), nullable=True)  # sha256 of the request's content type and body
+    status_code = Column(Integer, nullable=True)  # NULL while the first request is still running
+    headers = Column(Text, nullable=True)  # JSON list of [name, value]
+    body = Column(LargeBinary, nullable=True)
+    locked_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    expires_at = Column(DateTime, nullable=False, index=True)
+
+
+class RefreshToken(Base):
+    __tablename__ = "refresh_tokens"
+    __table_args__ = (
+        Index("ix_refresh_tokens_user", "user_type", "user_id"),
+    )
+    id = Column(Integer, primary_key=True, index=True)
+    token_hash = Column(String(64), nullable=False, unique=True, index=True)  # sha256 of the opaque token
+    family_id = Column(String(32), nullable=False, index=True)  # shared by every rotation of one login
+    user_type = Column(String, nullable=False)  # admin, doctor or normal_user
+    user_id = Column(Integer, nullable=False)
+    email = Column(String, nullable=False)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    expires_at = Column(DateTime, nullable=False)
+    session_expires_at = Column(DateTime, nullable=False)  # absolute end of the login, however often it is refreshed
+    revoked_at = Column(DateTime, nullable=True)
+
+
+class RevokedToken(Base):
+    __tablename__ = "revoked_tokens"
+    __table_args__ = (
+        Index("ix_revoked_tokens_key", "kind", "value"),
+    )
+    id = Column(Integer, primary_key=True, index=True)
+    kind = Column(String, nullable=False)  # jti: one access token; principal: every token of an account issued before revoked_at
+    value = Column(String, nullable=False)  # the jti, or "<user_type>:<user_id>"
+    revoked_at = Column(DateTime, nullable=False, default=datetime.utcnow, index=True)  # workers sync recent rows by this
+    expires_at = Column(DateTime, nullable=False, index=True)  # no token it covers is valid past this
+
+
+class ChangeCounter(Base):
+    __tablename__ = "change_counters"
+    name = Column(String, primary_key=True)
+    value = Column(Integer, nullable=False, default=0)
+
+
+class DetectionTombstone(Base):
+    __tablename__ = "detection_tombstones"
+    __table_args__ = (
+        Index("ix_detection_tombstones_user_change_seq", "normal_user_id", "change_seq"),
+        Index("ix_detection_tombstones_case_change_seq", "case_id", "change_seq"),
+    )
+    id = Column(Integer, primary_key=True, index=True)
+    detection_id = Column(Integer, nullable=False)
+    case_id = Column(Integer, nullable=True)
+    normal_user_id = Column(Integer, nullable=True)
+    change_seq = Column(Integer, nullable=False)
+    deleted_at = Column(DateTime, nullable=False, default=datetime.utcnow, index=True)
+
+
+class DetectionArchiveSegment(Base):
+    """Archived detections of one case or normal user, stored column by column and compressed (see archive.py)."""
+    __tablename__ = "detection_archive_segments"
+    __table_args__ = (
+        Index("ix_detection_archive_segments_owner", "owner_type", "owner_id"),
+    )
+    id = Column(Integer, primary_key=True, index=True)
+    owner_type = Column(String, nullable=False)  # "case" or "normal_user"
+    owner_id = Column(Integer, nullable=False)
+    row_count = Column(Integer, nullable=False)
+    first_id = Column(Integer, nullable=False)
+    last_id = Column(Integer, nullable=False)
+    oldest_at = Column(DateTime, nullable=True)
+    newest_at = Column(DateTime, nullable=True)
+    data = Column(LargeBinary, nullable=False)
+    archived_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+
+class ArchivedMedia(Base):
+    """A media URL (image or thumbnail) held by an archive segment, so media GC still sees it as referenced."""
+    __tablename__ = "archived_media"
+    id = Column(Integer, primary_key=True, index=True)
+    segment_id = Column(Integer, ForeignKey("detection_archive_segments.id"), nullable=False, index=True)
+    url = Column(String, nullable=False, index=True)
@@ -0,0 +1,172 @@
+# app/phash.py
+"""
+Near-duplicate lookup over detection image hashes.
+
+Each detection stores a 64-bit perceptual hash (see imaging.dhash). This module
+keeps a BK-tree of those hashes in memory per owner (a normal user, or the
+doctor of the detection's case), so every image of that owner within a Hamming
+radius of a query hash is found without scanning the table or walking other
+owners' images. The trees are built from the database on first use (one
+request builds them, concurrent ones wait for it), extended as this process
+hashes new images, and rebuilt every PHASH_REBUILD_SECONDS by a background
+thread to pick up other processes' work. Requests keep using the current
+trees while a rebuild runs.
+"""
+
+import logging
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from . import metrics, models
+from .database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+PHASH_REBUILD_SECONDS = float(os.getenv("PHASH_REBUILD_SECONDS", 300))
+PHASH_MAX_DISTANCE = int(os.getenv("PHASH_MAX_DISTANCE", 6))
+
+
+Owner = Tuple[str, int]
+
+
+def owner_key(normal_user_id: Optional[int] = None, doctor_id: Optional[int] = None) -> Owner:
+    """The tree a detection belongs to: ("user", id) or ("doctor", id)."""
+    return ("user", normal_user_id) if normal_user_id is not None else ("doctor", doctor_id)
+
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+class BKTree:
+    """Metric tree over 64-bit hashes; each node holds the ids sharing its hash."""
+
+    def __init__(self):
+        self.root: Optional[list] = None  # [hash, ids, {distance: child}]
+        self.size = 0
+
+    def add(self, value: int, item_id: int) -> None:
+        self.size += 1
+        if self.root is None:
+            self.root = [value, [item_id], {}]
+            return
+        node = self.root
+        while True:
+            distance = hamming(value, node[0])
+            if distance == 0:
+                node[1].append(item_id)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [value, [item_id], {}]
+                return
+            node = child
+
+    def search(self, value: int, radius: int) -> List[Tuple[int, int]]:
+        """(item_id, distance) for every entry within `radius` of `value`."""
+        found = []
+        stack = [self.root] if self.root else []
+        while stack:
+            node = stack.pop()
+            distance = hamming(value, node[0])
+            if distance <= radius:
+                found.extend((item_id, distance) for item_id in node[1])
+            # Triangle inequality: only subtrees at distance d +/- radius can hold matches.
+            for child_distance, child in node[2].items():
+                if distance - radius <= child_distance <= distance + radius:
+                    stack.append(child)
+        return found
+
+
+class PerceptualIndex:
+    def __init__(self):
+        self.lock = threading.Lock()
+        # Held for the whole table scan, so only one rebuild runs at a time
+        self.rebuild_lock = threading.Lock()
+        self.trees: Dict[Owner, BKTree] = {}
+        self.built_at: Optional[float] = None
+        self.lookups = 0
+        self.rebuild_errors = 0
+        self.thread: Optional[threading.Thread] = None
+        self.stopping = threading.Event()
+
+    def rebuild(self, db: Session) -> None:
+        with self.rebuild_lock:
+            self._rebuild(db)
+
+    def _rebuild(self, db: Session) -> None:
+        trees: Dict[Owner, BKTree] = {}
+        rows = (
+            db.query(models.SyndromeDetection.id, models.SyndromeDetection.phash,
+                     models.SyndromeDetection.normal_user_id, models.Case.doctor_id)
+            .outerjoin(models.Case, models.SyndromeDetection.case_id == models.Case.id)
+            .filter(models.SyndromeDetection.phash.isnot(None))
+            .execution_options(yield_per=5000)
+        )
+        for row in rows:
+            owner = owner_key(row.normal_user_id, row.doctor_id)
+            trees.setdefault(owner, BKTree()).add(int(row.phash, 16), row.id)
+        with self.lock:
+            self.trees = trees
+            self.built_at = time.monotonic()
+
+    def ensure_fresh(self, db: Session) -> None:
+        """Build the trees if none exist yet; refreshing stale ones is the background thread's job."""
+        if self.built_at is not None:
+            return
+        with self.rebuild_lock:
+            # Requests that queued behind the first build use its result
+            if self.built_at is None:
+                self._rebuild(db)
+
+    def _run(self) -> None:
+        while not self.stopping.wait(PHASH_REBUILD_SECONDS):
+            db = SessionLocal()
+            try:
+                self.rebuild(db)
+            except Exception:
+                self.rebuild_errors += 1
+                logger.exception("Perceptual-hash index rebuild failed")
+            finally:
+                db.close()
+
+    def start(self) -> None:
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self._run, name="phash-rebuild", daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.stopping.set()
+        if self.thread:
+            self.thread.join(5)
+            self.thread = None
+
+    def add(self, owner: Owner, detection_id: int, phash: str) -> None:
+        with self.lock:
+            if self.built_at is not None:
+                self.trees.setdefault(owner, BKTree()).add(int(phash, 16), detection_id)
+
+    def search(self, db: Session, owner: Owner, phash: str, radius: int) -> Dict[int, int]:
+        """detection id -> Hamming distance for every hash of `owner` within `radius`."""
+        self.ensure_fresh(db)
+        with self.lock:
+            self.lookups += 1
+            tree = self.trees.get(owner)
+            return dict(tree.search(int(phash, 16), radius)) if tree else {}
+
+    def snapshot(self) -> dict:
+        return {
+            "indexed_hashes": sum(tree.size for tree in self.trees.values()),
+            "owners": len(self.trees),
+            "lookups": self.lookups,
+            "rebuild_errors": self.rebuild_errors,
+            "age_seconds": round(time.monotonic() - self.built_at, 1) if self.built_at else None,
+        }
+
+
+index = PerceptualIndex()
+metrics.register("phash", index.snapshot)
@@ -0,0 +1,260 @@
+# app/ratelimit.py
+"""
+Rate limiting and admission control.
+
+Every request is put in a route class (`auth`, `upload` or `default`) and
+charged to a token bucket keyed by class and caller: the JWT subject when a
+valid bearer token is sent, the client IP otherwise. Buckets live in this
+process (`RATE_LIMIT_STORE=memory`) or in a SQLite file that all workers on the
+host share (`RATE_LIMIT_STORE=sqlite`). SQLite takes run in the threadpool so a
+contended write never stalls the event loop. Over-limit requests get 429.
+
+Admission control caps the requests each class may have in flight. The default
+caps (4 + 8 + 24) add up to less than the 40 threads of the sync route
+threadpool, so bcrypt logins or uploads can never take every thread. A request that cannot get a
+slot within ADMISSION_QUEUE_TIMEOUT is shed with 503. Both answers carry Retry-After.
+"""
+
+import asyncio
+import json
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from typing import Dict, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+from . import auth, metrics
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+RATE_LIMIT_STORE = os.getenv("RATE_LIMIT_STORE", "memory")
+RATE_LIMIT_SQLITE_PATH = os.getenv("RATE_LIMIT_SQLITE_PATH", "ratelimit.db")
+RATE_LIMIT_TRUST_PROXY = os.getenv("RATE_LIMIT_TRUST_PROXY", "false").lower() == "true"
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", 0.25))
+
+
+def _limit(name: str, default: str) -> Tuple[float, float]:
+    """'<requests>/<seconds>' -> (bucket capacity, tokens refilled per second)."""
+    requests, seconds = os.getenv(name, default).split("/")
+    return float(requests), float(requests) / float(seconds)
+
+
+RATE_LIMITS = {
+    "auth": _limit("RATE_LIMIT_AUTH", "10/60"),
+    "upload": _limit("RATE_LIMIT_UPLOAD", "60/60"),
+    "default": _limit("RATE_LIMIT_DEFAULT", "300/60"),
+}
+CONCURRENCY_LIMITS = {
+    # Fixed rather than per-CPU, so the sum stays under the threadpool on any host
+    "auth": int(os.getenv("ADMISSION_AUTH", 4)),
+    "upload": int(os.getenv("ADMISSION_UPLOAD", 8)),
+    "default": int(os.getenv("ADMISSION_DEFAULT", 24)),
+}
+
+EXEMPT_PATHS = {"/metrics", "/health", "/ready"}
+# Long-lived streams: opening one is rate limited, but it never holds an admission slot
+STREAM_PATHS = {"/events"}
+UPLOAD_PATHS = {"/user/detections", "/doctor/detections", "/detections/similar", "/inference/detect", "/admin/articles"}
+
+
+def route_class(method: str, path: str) -> str:
+    if method == "POST" and (path == "/auth/login" or path.endswith("/register")):
+        return "auth"
+    if method in ("POST", "PUT") and (path in UPLOAD_PATHS or path.startswith("/uploads/")):
+        return "upload"
+    return "default"
+
+
+def caller_identity(scope) -> str:
+    headers = dict(scope["headers"])
+    authorization = headers.get(b"authorization", b"").decode("latin-1")
+    if authorization.lower().startswith("bearer "):
+        claims = auth.decode_signed_token(authorization[7:])
+        if claims and claims.get("sub"):
+            return f"sub:{claims['sub']}"
+    if RATE_LIMIT_TRUST_PROXY and b"x-forwarded-for" in headers:
+        return "ip:" + headers[b"x-forwarded-for"].decode("latin-1").split(",")[0].strip()
+    client = scope.get("client")
+    return f"ip:{client[0] if client else 'unknown'}"
+
+
+# --------------------------------------
+# Bucket stores
+# --------------------------------------
+
+def _refill(tokens: float, updated: float, now: float, capacity: float, rate: float) -> float:
+    return min(capacity, tokens + (now - updated) * rate)
+
+
+class MemoryStore:
+    """Token buckets for this process only."""
+
+    max_keys = 100_000
+
+    blocking = False
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.buckets: Dict[str, Tuple[float, float]] = {}
+
+    def take(self, key: str, capacity: float, rate: float) -> Tuple[bool, float]:
+        """Spend one token; returns (allowed, seconds until a token is available)."""
+        now = time.monotonic()
+        with self.lock:
+            tokens, updated = self.buckets.get(key, (capacity, now))
+            tokens = _refill(tokens, updated, now, capacity, rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self.buckets[key] = (tokens, now)
+            if len(self.buckets) > self.max_keys:
+                self._evict(now)
+        return allowed, 0.0 if allowed else (1 - tokens) / rate
+
+    def _evict(self, now: float) -> None:
+        # Buckets idle for a minute have refilled (or nearly); forgetting them changes nothing
+        self.buckets = {key: value for key, value in self.buckets.items() if now - value[1] < 60}
+
+
+class SQLiteStore:
+    """
+    Token buckets in a SQLite file shared by every worker process on the host,
+    a local stand-in for a network store. Each take is one short write transaction.
+    """
+
+    blocking = True
+
+    def __init__(self, path: str = RATE_LIMIT_SQLITE_PATH):
+        self.path = path
+        self.local = threading.local()
+        with closing(self._connect()) as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=0.05, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=OFF")
+        return conn
+
+    def _conn(self) -> sqlite3.Connection:
+        if not hasattr(self.local, "conn"):
+            self.local.conn = self._connect()
+        return self.local.conn
+
+    def take(self, key: str, capacity: float, rate: float) -> Tuple[bool, float]:
+        now = time.time()
+        conn = self._conn()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+            tokens = _refill(row[0], row[1], now, capacity, rate) if row else capacity
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            conn.execute("INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)", (key, tokens, now))
+            conn.execute("COMMIT")
+        except sqlite3.OperationalError:
+            # A contended or unavailable store must not take the API down with it
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            stats["store_errors"] += 1
+            return True, 0.0
+        return allowed, 0.0 if allowed else (1 - tokens) / rate
+
+
+def make_store(kind: str = RATE_LIMIT_STORE):
+    if kind == "sqlite":
+        logger.info(f"Using shared rate limit store {RATE_LIMIT_SQLITE_PATH}.")
+        return SQLiteStore()
+    return MemoryStore()
+
+
+# --------------------------------------
+# Middleware
+# --------------------------------------
+
+stats = {
+    "store_errors": 0,
+    "classes": {name: {"allowed": 0, "rate_limited": 0, "shed": 0, "in_flight": 0} for name in RATE_LIMITS},
+}
+
+
+class RateLimitMiddleware:
+    def __init__(self, app, store=None):
+        self.app = app
+        self.store = store or make_store()
+        self.slots: Dict[str, asyncio.Semaphore] = {}
+
+    async def __call__(self, scope, receive, send):
+        if not RATE_LIMIT_ENABLED or scope["type"] != "http" or scope["path"] in EXEMPT_PATHS:
+            return await self.app(scope, receive, send)
+        name = route_class(scope["method"], scope["path"])
+        counters = stats["classes"][name]
+
+        capacity, rate = RATE_LIMITS[name]
+        key = f"{name}:{caller_identity(scope)}"
+        if self.store.blocking:
+            allowed, retry_after = await run_in_threadpool(self.store.take, key, capacity, rate)
+        else:
+            allowed, retry_after = self.store.take(key, capacity, rate)
+        if not allowed:
+            counters["rate_limited"] += 1
+            return await self._reject(send, 429, retry_after, "Too many requests. Try again later.")
+        if scope["path"] in STREAM_PATHS:
+            counters["allowed"] += 1
+            return await self.app(scope, receive, send)
+
+        slots = self.slots.get(name)
+        if slots is None:
+            slots = self.slots[name] = asyncio.Semaphore(CONCURRENCY_LIMITS[name])
+        # Acquire in this task: wait_for runs it in a child task, and a permit it takes as the
+        # timeout fires can be dropped and never released
+        try:
+            async with asyncio.timeout(ADMISSION_QUEUE_TIMEOUT):
+                await slots.acquire()
+        except TimeoutError:
+            counters["shed"] += 1
+            return await self._reject(send, 503, 1, "The server is busy. Try again shortly.")
+
+        counters["allowed"] += 1
+        counters["in_flight"] += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            counters["in_flight"] -= 1
+            slots.release()
+
+    @staticmethod
+    async def _reject(send, status_code: int, retry_after: float, detail: str) -> None:
+        body = json.dumps({"detail": detail}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": status_code,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(max(1, math.ceil(retry_after))).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+
+def snapshot() -> dict:
+    return {
+        "enabled": RATE_LIMIT_ENABLED,
+        "store": RATE_LIMIT_STORE,
+        "store_errors": stats["store_errors"],
+        "classes": {
+            name: dict(counters, limit=RATE_LIMITS[name][0], concurrency=CONCURRENCY_LIMITS[name])
+            for name, counters in stats["classes"].items()
+        },
+    }
+
+
+metrics.register("ratelimit", snapshot)
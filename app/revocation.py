@@ -0,0 +1,198 @@
+# app/revocation.py
+"""
+Access-token revocation.
+
+Revocations are rows in `revoked_tokens`. A row revokes either one token (by
+its `jti`) or every token of an account issued before `revoked_at` (a
+principal). Each process keeps a Bloom filter of the revoked keys, so checking
+a token is normally a few memory reads. Only a filter hit, which is a real
+revocation or a rare false positive, is confirmed in the database.
+
+The filter follows the table: a background thread adds the rows revoked since
+its last sync every REVOCATION_SYNC_SECONDS and rebuilds the filter from the live
+rows every REVOCATION_REBUILD_SECONDS, which also drops expired revocations.
+Each sync reaches back REVOCATION_SYNC_OVERLAP_SECONDS further: a row can
+commit after rows stamped (or, on PostgreSQL, numbered) later than it, and
+adding a key twice is harmless.
+Revocations made in this process enter its filter at once; other processes
+pick them up within one sync interval.
+"""
+
+import hashlib
+import logging
+import math
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy.orm import Session
+
+from . import metrics, models
+from .database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+REVOCATION_SYNC_SECONDS = float(os.getenv("REVOCATION_SYNC_SECONDS", 2))
+REVOCATION_REBUILD_SECONDS = float(os.getenv("REVOCATION_REBUILD_SECONDS", 3600))
+REVOCATION_SYNC_OVERLAP_SECONDS = float(os.getenv("REVOCATION_SYNC_OVERLAP_SECONDS", 60))
+REVOCATION_BLOOM_CAPACITY = int(os.getenv("REVOCATION_BLOOM_CAPACITY", 100_000))
+REVOCATION_BLOOM_ERROR_RATE = float(os.getenv("REVOCATION_BLOOM_ERROR_RATE", 0.001))
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter; k bit positions per key by double hashing one sha256 digest."""
+
+    def __init__(self, capacity: int, error_rate: float):
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key: str):
+        digest = hashlib.sha256(key.encode()).digest()
+        h1 = int.from_bytes(digest[:8], "big")
+        h2 = int.from_bytes(digest[8:16], "big") | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, key: str) -> None:
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+def principal(user_type: str, user_id: int) -> str:
+    return f"{user_type}:{user_id}"
+
+
+class RevocationList:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.filter: Optional[BloomFilter] = None
+        # Rows revoked before this (less the overlap) are already in the filter
+        self.synced_through: Optional[datetime] = None
+        self.built_at = 0.0
+        self.synced_at = 0.0
+        self.thread: Optional[threading.Thread] = None
+        self.stopping = threading.Event()
+        self.stats = {"checks": 0, "filter_hits": 0, "confirmed": 0, "false_positives": 0, "sync_errors": 0}
+
+    # Filter maintenance
+
+    def rebuild(self, db: Session) -> None:
+        now = datetime.utcnow()
+        db.query(models.RevokedToken).filter(models.RevokedToken.expires_at < now).delete(synchronize_session=False)
+        db.commit()
+        rows = db.query(models.RevokedToken.kind, models.RevokedToken.value).all()
+        bloom = BloomFilter(max(REVOCATION_BLOOM_CAPACITY, len(rows) * 2), REVOCATION_BLOOM_ERROR_RATE)
+        for row in rows:
+            bloom.add(f"{row.kind}:{row.value}")
+        with self.lock:
+            self.filter = bloom
+            self.synced_through = now
+            self.built_at = self.synced_at = time.monotonic()
+
+    def sync(self, db: Session) -> None:
+        now = datetime.utcnow()
+        since = self.synced_through - timedelta(seconds=REVOCATION_SYNC_OVERLAP_SECONDS)
+        rows = (
+            db.query(models.RevokedToken.kind, models.RevokedToken.value)
+            .filter(models.RevokedToken.revoked_at >= since)
+            .all()
+        )
+        with self.lock:
+            for row in rows:
+                key = f"{row.kind}:{row.value}"
+                if key not in self.filter:
+                    self.filter.add(key)
+            self.synced_through = now
+            self.synced_at = time.monotonic()
+
+    def refresh(self, db: Session) -> None:
+        if self.filter is None or time.monotonic() - self.built_at > REVOCATION_REBUILD_SECONDS:
+            self.rebuild(db)
+        else:
+            self.sync(db)
+
+    def _run(self) -> None:
+        while not self.stopping.wait(REVOCATION_SYNC_SECONDS):
+            db = SessionLocal()
+            try:
+                self.refresh(db)
+            except Exception:
+                self.stats["sync_errors"] += 1
+                logger.exception("Revocation list sync failed")
+            finally:
+                db.close()
+
+    def start(self) -> None:
+        db = SessionLocal()
+        try:
+            self.rebuild(db)
+        finally:
+            db.close()
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self._run, name="revocation-sync", daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.stopping.set()
+        if self.thread:
+            self.thread.join(5)
+            self.thread = None
+
+    # Revoking and checking
+
+    def revoke(self, db: Session, kind: str, value: str, expires_at: datetime) -> None:
+        """Record a revocation; the caller commits. This process's filter learns it immediately."""
+        db.add(models.RevokedToken(kind=kind, value=value, revoked_at=datetime.utcnow(), expires_at=expires_at))
+        if self.filter is not None:
+            with self.lock:
+                self.filter.add(f"{kind}:{value}")
+
+    def revoke_token(self, db: Session, claims: dict) -> None:
+        """Revoke a single access token until it would have expired anyway."""
+        self.revoke(db, "jti", claims["jti"], datetime.utcfromtimestamp(claims["exp"]))
+
+    def revoke_principal(self, db: Session, user_type: str, user_id: int, token_lifetime: timedelta) -> None:
+        """Revoke every access token of an account issued up to now."""
+        self.revoke(db, "principal", principal(user_type, user_id), datetime.utcnow() + token_lifetime)
+
+    def is_revoked(self, db: Session, claims: dict) -> bool:
+        if self.filter is None:
+            self.rebuild(db)
+        self.stats["checks"] += 1
+        keys = [("principal", principal(claims.get("user_type"), claims.get("user_id")))]
+        if claims.get("jti"):
+            keys.append(("jti", claims["jti"]))
+        suspects = [(kind, value) for kind, value in keys if f"{kind}:{value}" in self.filter]
+        if not suspects:
+            return False
+
+        self.stats["filter_hits"] += 1
+        issued_at = datetime.utcfromtimestamp(claims.get("iat", 0))
+        for kind, value in suspects:
+            query = db.query(models.RevokedToken.id).filter(models.RevokedToken.kind == kind, models.RevokedToken.value == value)
+            if kind == "principal":
+                query = query.filter(models.RevokedToken.revoked_at >= issued_at)
+            if query.first():
+                self.stats["confirmed"] += 1
+                return True
+        self.stats["false_positives"] += 1
+        return False
+
+    def snapshot(self) -> dict:
+        return dict(
+            self.stats,
+            filter_bits=self.filter.size if self.filter else 0,
+            filter_items=self.filter.count if self.filter else 0,
+            sync_age_seconds=round(time.monotonic() - self.synced_at, 1) if self.filter else None,
+        )
+
+
+revocations = RevocationList()
+metrics.register("revocation", revocations.snapshot)
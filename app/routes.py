@@ -1,10 +1,17 @@
 # app/routes.py
 
+import json
+import tempfile
+import time
 from typing import List, Optional
-from fastapi import APIRouter, Depends, File, Form, HTTPException, UploadFile, status
+from fastapi import APIRouter, Depends, File, Form, HTTPException, Query, Request, Response, UploadFile, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, StreamingResponse
+from sqlalchemy import text
 from sqlalchemy.orm import Session
 
-from . import schemas, models, crud, auth, utils
+from . import schemas, models, crud, archive, auth, utils, database, events, imaging, jobs, inference, metrics, phash, revocation, storage, uploads
 from app.schemas import GenericResponse
 
 router = APIRouter()
@@ -12,6 +19,16 @@ router = APIRouter()
 # Dependency
 db_dependency = Depends(utils.get_db)
 
+# Sparse fieldset selector shared by the list and batch endpoints
+fields_query = Query(None, description="Comma-separated fields to return, e.g. `id,result,image_url`; defaults to all.")
+# Archived detections are read only on request; they come first, being the oldest
+archived_query = Query(False, description="Also return detections moved to the archive.")
+
+
+def _fieldset_response(rows, names):
+    """Rows loaded for ?fields= are partial, so they bypass the response model, which requires every field."""
+    return JSONResponse(jsonable_encoder(rows)) if names is not None else rows
+
 # # Dependency to get DB session
 # def get_db():
 #     db = SessionLocal()
@@ -33,8 +50,8 @@ def login(login_request: schemas.LoginRequest, db: Session = db_dependency):
     if isinstance(user, models.Admin):
         user_type = "admin"
         user_id = user.id
-        access_token = auth.create_access_token(data={"sub": user.email, "user_type": user_type, "user_id": user_id})
-        return {"access_token": access_token, "token_type": "bearer", "user_type": user_type, "user_id": user_id}
+        tokens = auth.create_session_tokens(db, user_type, user_id, user.email)
+        return {**tokens, "token_type": "bearer", "user_type": user_type, "user_id": user_id}
     
     elif isinstance(user, models.Doctor):
         user_type = "doctor"
@@ -61,9 +78,9 @@ def login(login_request: schemas.LoginRequest, db: Session = db_dependency):
     else:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid user type.")
 
-    access_token = auth.create_access_token(data={"sub": user.email, "user_type": user_type, "user_id": user_id})
+    tokens = auth.create_session_tokens(db, user_type, user_id, user.email)
     return {
-        "access_token": access_token,
+        **tokens,
         "token_type": "bearer",
         "user_type": user_type,
         "user_id": user_id,
@@ -71,6 +88,41 @@ def login(login_request: schemas.LoginRequest, db: Session = db_dependency):
     }
 
 
+@router.post("/auth/refresh", response_model=schemas.Token)
+def refresh(refresh_request: schemas.RefreshRequest, db: Session = db_dependency):
+    """
+    Exchange a refresh token for a new access token and a new refresh token, without
+    a password check. Each refresh token works once; reusing one ends its session.
+    """
+    spent, refresh_token = auth.rotate_refresh_token(db, refresh_request.refresh_token)
+    access_token = auth.create_access_token(
+        data={"sub": spent.email, "user_type": spent.user_type, "user_id": spent.user_id}
+    )
+    return {
+        "access_token": access_token,
+        "refresh_token": refresh_token,
+        "expires_in": auth.ACCESS_TOKEN_EXPIRE_MINUTES * 60,
+        "token_type": "bearer",
+        "user_type": spent.user_type,
+        "user_id": spent.user_id,
+    }
+
+
+@router.post("/auth/logout", response_model=schemas.GenericResponse)
+def logout(
+    refresh_request: schemas.RefreshRequest,
+    access_token: Optional[str] = Depends(auth.optional_oauth2_scheme),
+    db: Session = db_dependency,
+):
+    """End the session the refresh token belongs to, and revoke the bearer access token if one is sent."""
+    auth.revoke_refresh_token(db, refresh_request.refresh_token)
+    claims = auth.decode_signed_token(access_token) if access_token else None
+    if claims and claims.get("jti"):
+        revocation.revocations.revoke_token(db, claims)
+    db.commit()
+    return {"success": True, "message": "Logged out."}
+
+
 # --------------------------------------
 # Admin Endpoints
 # --------------------------------------
@@ -111,11 +163,16 @@ def delete_article(article_id: int, db: Session = Depends(utils.get_db)):
 
 
 
-@router.delete("/admin/delete/{id}/{user_type}", response_model=schemas.GenericResponse)
+@router.delete(
+    "/admin/delete/{id}/{user_type}",
+    response_model=schemas.DeletionJobAccepted,
+    status_code=status.HTTP_202_ACCEPTED,
+)
 def delete_user_or_doctor(id: int, user_type: str, db: Session = Depends(utils.get_db)):
     """
     Delete a user or doctor based on the provided id and user_type.
     `user_type` should be either 'user' or 'doctor'.
+    The deletion runs as a background job; poll `/jobs/{job_id}` for its status.
     """
     if user_type.lower() == "user":
         user = crud.get_normal_user_by_id(db, id)
@@ -124,9 +181,8 @@ def delete_user_or_doctor(id: int, user_type: str, db: Session = Depends(utils.g
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail=f"User with id {id} not found."
             )
-        crud.delete_normal_user(db, id)
-        return {"success": True, "message": f"User with id {id} has been deleted successfully."}
-    
+        label = "User"
+
     elif user_type.lower() == "doctor":
         doctor = crud.get_doctor_by_id(db, id)
         if not doctor:
@@ -134,37 +190,69 @@ def delete_user_or_doctor(id: int, user_type: str, db: Session = Depends(utils.g
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail=f"Doctor with id {id} not found."
             )
-        crud.delete_doctor(db, id)
-        return {"success": True, "message": f"Doctor with id {id} has been deleted successfully."}
-    
+        label = "Doctor"
+
     else:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Invalid user_type. It must be either 'user' or 'doctor'."
         )
 
+    # Sessions end now; the data itself is removed in the background
+    auth.revoke_user_sessions(db, "normal_user" if label == "User" else "doctor", id)
+    job = jobs.enqueue(db, "account.delete", {"user_type": user_type.lower(), "target_id": id})
+    db.commit()
+    return {
+        "success": True,
+        "message": f"{label} with id {id} is scheduled for deletion.",
+        "job_id": job.id,
+    }
+
+@router.post("/admin/archive", response_model=schemas.ArchiveJobAccepted, status_code=status.HTTP_202_ACCEPTED)
+def run_archival(db: Session = Depends(utils.get_db)):
+    """
+    Archive detections older than ARCHIVE_AFTER_DAYS now instead of at the next scheduled run.
+    Poll `/jobs/{job_id}` for the number archived.
+    """
+    if archive.ARCHIVE_AFTER_DAYS <= 0:
+        raise HTTPException(status_code=409, detail="Archival is turned off; set ARCHIVE_AFTER_DAYS to enable it.")
+    job = archive.schedule(db)
+    if job is None:
+        raise HTTPException(status_code=409, detail="An archival run is already queued or running.")
+    db.commit()
+    return {"success": True, "message": "Archival is scheduled.", "job_id": job.id}
+
 @router.get("/admin/users", response_model=List[schemas.NormalUserResponse])
-def view_all_normal_users(db: Session = Depends(utils.get_db)):
+def view_all_normal_users(fields: Optional[str] = fields_query, db: Session = Depends(utils.get_db)):
     """Fetch a list of all normal users."""
-    return crud.get_all_normal_users(db)
+    names = crud.parse_fields(fields, schemas.NormalUserResponse, models.NormalUser)
+    return _fieldset_response(crud.select_rows(db, models.NormalUser, names), names)
 
 
 
 @router.get("/admin/doctors", response_model=List[schemas.DoctorResponse])
-def view_all_doctors(db: Session = Depends(utils.get_db)):
+def view_all_doctors(fields: Optional[str] = fields_query, db: Session = Depends(utils.get_db)):
     """Fetch a list of all doctors."""
-    return crud.get_all_doctors(db)
+    names = crud.parse_fields(fields, schemas.DoctorResponse, models.Doctor)
+    return _fieldset_response(crud.select_rows(db, models.Doctor, names), names)
 
 
 @router.get("/admin/detections", response_model=List[schemas.SyndromeDetectionResponse])
-def get_all_detections(db: Session = Depends(utils.get_db)):
+def get_all_detections(
+    fields: Optional[str] = fields_query,
+    include_archived: bool = archived_query,
+    db: Session = Depends(utils.get_db),
+):
     """
     Get all detections in the database, regardless of whether they belong to a user or a doctor.
     """
-    detections = db.query(models.SyndromeDetection).all()
+    names = crud.parse_fields(fields, schemas.SyndromeDetectionResponse, models.SyndromeDetection)
+    detections = crud.select_rows(db, models.SyndromeDetection, names)
+    if include_archived:
+        detections = archive.archived_detections(db, names) + detections
     if not detections:
         raise HTTPException(status_code=404, detail="No detections found.")
-    return detections
+    return _fieldset_response(detections, names)
 
 
 # --------------------------------------
@@ -220,19 +308,66 @@ def create_case(
 
 
 @router.get("/doctor/cases/{doctor_id}", response_model=List[schemas.CaseResponse])
-def get_cases_for_doctor(doctor_id: int, db: Session = db_dependency):
-    cases = crud.get_cases_by_doctor(db, doctor_id)
+def get_cases_for_doctor(doctor_id: int, fields: Optional[str] = fields_query, db: Session = db_dependency):
+    names = crud.parse_fields(fields, schemas.CaseResponse, models.Case)
+    cases = crud.select_rows(db, models.Case, names, models.Case.doctor_id == doctor_id)
     if not cases:
         raise HTTPException(status_code=404, detail="No cases found for this doctor.")
-    return cases
+    return _fieldset_response(cases, names)
 
-@router.post("/doctor/detections", response_model=schemas.SyndromeDetectionResponse)
+@router.get("/doctor/cases/{doctor_id}/search", response_model=schemas.CasePage)
+def search_cases_for_doctor(
+    doctor_id: int,
+    name_prefix: Optional[str] = None,
+    min_age: Optional[int] = Query(None, ge=0),
+    max_age: Optional[int] = Query(None, ge=0),
+    gender: Optional[str] = None,
+    nationality: Optional[str] = None,
+    result: Optional[str] = None,
+    sort: str = "id",
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
+    db: Session = db_dependency,
+):
+    """
+    Filter a doctor's cases server-side. `result` keeps cases having at least one detection
+    with that result. Pass the returned `next_cursor` back as `cursor` to fetch the next page.
+    """
+    return crud.search_cases(
+        db, doctor_id,
+        name_prefix=name_prefix, min_age=min_age, max_age=max_age, gender=gender,
+        nationality=nationality, result=result, sort=sort, limit=limit, cursor=cursor,
+    )
+
+@router.get("/doctor/cases/{doctor_id}/with-detections", response_model=schemas.CaseWithDetectionsPage)
+def get_cases_with_detections(
+    doctor_id: int,
+    latest: int = Query(3, ge=0, le=50),
+    sort: str = "-id",
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
+    db: Session = db_dependency,
+):
+    """
+    A page of a doctor's cases, each with its detection count and its `latest` newest
+    detections (`latest=0` returns counts only), in three SQL statements per page.
+    """
+    page = crud.search_cases(db, doctor_id, sort=sort, limit=limit, cursor=cursor)
+    crud.attach_latest_detections(db, page["items"], latest)
+    return page
+
+@router.post(
+    "/doctor/detections",
+    response_model=schemas.SyndromeDetectionAccepted,
+    status_code=status.HTTP_202_ACCEPTED,
+)
 def post_doctor_detection(
     result: str = Form(...),
     date_of_detection: str = Form(...),
     case_id: int = Form(...),
     description: str = Form(...),
-    image_file: UploadFile = File(...),
+    image_file: Optional[UploadFile] = File(None),
+    upload_token: Optional[str] = Form(None),
     db: Session = Depends(utils.get_db),
 ):
     detection = schemas.SyndromeDetectionCreate(
@@ -241,8 +376,10 @@ def post_doctor_detection(
         case_id=case_id,
         description=description,
     )
+    if (image_file is None) == (upload_token is None):
+        raise HTTPException(status_code=400, detail="Provide either image_file or upload_token.")
     try:
-        new_detection = crud.create_syndrome_detection(db, detection, image_file)
+        new_detection = crud.create_syndrome_detection(db, detection, image_file, upload_token)
         return new_detection
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
@@ -253,25 +390,34 @@ def post_doctor_detection(
 @router.get("/doctor/detections/{case_id}", response_model=List[schemas.SyndromeDetectionResponse])
 def get_detections_by_case_id(
     case_id: int,
+    fields: Optional[str] = fields_query,
+    include_archived: bool = archived_query,
     db: Session = Depends(utils.get_db),
 ):
-    detections = db.query(models.SyndromeDetection).filter(models.SyndromeDetection.case_id == case_id).all()
+    names = crud.parse_fields(fields, schemas.SyndromeDetectionResponse, models.SyndromeDetection)
+    detections = crud.select_rows(db, models.SyndromeDetection, names, models.SyndromeDetection.case_id == case_id)
+    if include_archived:
+        detections = archive.archived_detections(db, names, case_ids=[case_id]) + detections
     if not detections:
         raise HTTPException(status_code=404, detail="No detections found for the given case_id.")
-    return detections
+    return _fieldset_response(detections, names)
 
 @router.get("/doctor/detection-history/{doctor_id}", response_model=List[schemas.SyndromeDetectionResponse])
 def get_detection_history_by_doctor_id(
     doctor_id: int,
+    fields: Optional[str] = fields_query,
+    include_archived: bool = archived_query,
     db: Session = Depends(utils.get_db),
 ):
-    cases = db.query(models.Case).filter(models.Case.doctor_id == doctor_id).all()
-    if not cases:
+    names = crud.parse_fields(fields, schemas.SyndromeDetectionResponse, models.SyndromeDetection)
+    case_ids = [case_id for case_id, in db.query(models.Case.id).filter(models.Case.doctor_id == doctor_id)]
+    if not case_ids:
         raise HTTPException(status_code=404, detail="No cases found for the given doctor_id.")
 
-    case_ids = [case.id for case in cases]
-    detections = db.query(models.SyndromeDetection).filter(models.SyndromeDetection.case_id.in_(case_ids)).all()
-    return detections
+    detections = crud.select_rows(db, models.SyndromeDetection, names, models.SyndromeDetection.case_id.in_(case_ids))
+    if include_archived:
+        detections = archive.archived_detections(db, names, case_ids=case_ids) + detections
+    return _fieldset_response(detections, names)
 
 
 # --------------------------------------
@@ -296,7 +442,11 @@ def register_normal_user(
     )
     return crud.create_normal_user(db, user, profile_image)
 
-@router.post("/user/detections", response_model=schemas.SyndromeDetectionResponse)
+@router.post(
+    "/user/detections",
+    response_model=schemas.SyndromeDetectionAccepted,
+    status_code=status.HTTP_202_ACCEPTED,
+)
 def post_user_detection(
     result: str = Form(...),
     date_of_detection: str = Form(...),
@@ -306,7 +456,8 @@ def post_user_detection(
     gender: str = Form(...),
     nationality: str = Form(...),
     description: str = Form(...),
-    image_file: UploadFile = File(...),
+    image_file: Optional[UploadFile] = File(None),
+    upload_token: Optional[str] = Form(None),
     db: Session = Depends(utils.get_db),
 ):
     detection = schemas.SyndromeDetectionCreate(
@@ -319,8 +470,10 @@ def post_user_detection(
         nationality=nationality,
         description=description,
     )
+    if (image_file is None) == (upload_token is None):
+        raise HTTPException(status_code=400, detail="Provide either image_file or upload_token.")
     try:
-        new_detection = crud.create_syndrome_detection(db, detection, image_file)
+        new_detection = crud.create_syndrome_detection(db, detection, image_file, upload_token)
         return new_detection
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
@@ -329,13 +482,322 @@ def post_user_detection(
 @router.get("/user/detections/{user_id}", response_model=List[schemas.SyndromeDetectionResponse])
 def get_detections_by_user_id(
     user_id: int,
+    fields: Optional[str] = fields_query,
+    include_archived: bool = archived_query,
     db: Session = Depends(utils.get_db),
 ):
-    detections = db.query(models.SyndromeDetection).filter(models.SyndromeDetection.normal_user_id == user_id).all()
+    names = crud.parse_fields(fields, schemas.SyndromeDetectionResponse, models.SyndromeDetection)
+    detections = crud.select_rows(db, models.SyndromeDetection, names, models.SyndromeDetection.normal_user_id == user_id)
+    if include_archived:
+        detections = archive.archived_detections(db, names, normal_user_ids=[user_id]) + detections
     if not detections:
         raise HTTPException(status_code=404, detail="No detections found for the given user_id.")
-    return detections
+    return _fieldset_response(detections, names)
+
+
+# --------------------------------------
+# Batch Endpoints
+# --------------------------------------
+
+BATCH_IDS_DESCRIPTION = "Comma-separated ids, e.g. `4,8,15`."
+
+
+def _batch(db: Session, model, schema, ids: str, fields: Optional[str]):
+    names = crud.parse_fields(fields, schema, model)
+    batch = crud.get_batch(db, model, crud.parse_ids(ids), names)
+    return JSONResponse(jsonable_encoder(batch)) if names is not None else batch
+
+
+@router.get("/users/batch", response_model=schemas.NormalUserBatch)
+def get_normal_users_batch(
+    ids: str = Query(..., description=BATCH_IDS_DESCRIPTION),
+    fields: Optional[str] = fields_query,
+    db: Session = Depends(utils.get_db),
+):
+    """Fetch several normal users by id in one call."""
+    return _batch(db, models.NormalUser, schemas.NormalUserResponse, ids, fields)
+
+
+@router.get("/doctors/batch", response_model=schemas.DoctorBatch)
+def get_doctors_batch(
+    ids: str = Query(..., description=BATCH_IDS_DESCRIPTION),
+    fields: Optional[str] = fields_query,
+    db: Session = Depends(utils.get_db),
+):
+    """Fetch several doctors by id in one call."""
+    return _batch(db, models.Doctor, schemas.DoctorResponse, ids, fields)
+
+
+@router.get("/cases/batch", response_model=schemas.CaseBatch)
+def get_cases_batch(
+    ids: str = Query(..., description=BATCH_IDS_DESCRIPTION),
+    fields: Optional[str] = fields_query,
+    db: Session = Depends(utils.get_db),
+):
+    """Fetch several cases by id in one call."""
+    return _batch(db, models.Case, schemas.CaseResponse, ids, fields)
+
+
+@router.get("/detections/batch", response_model=schemas.DetectionBatch)
+def get_detections_batch(
+    ids: str = Query(..., description=BATCH_IDS_DESCRIPTION),
+    fields: Optional[str] = fields_query,
+    db: Session = Depends(utils.get_db),
+):
+    """Fetch several detections by id in one call."""
+    return _batch(db, models.SyndromeDetection, schemas.SyndromeDetectionResponse, ids, fields)
+
+
+# --------------------------------------
+# Sync Endpoints
+# --------------------------------------
+
+@router.get(
+    "/sync/detections",
+    response_model=schemas.DetectionSyncResponse,
+    responses={304: {"description": "Nothing changed since the sync token."}},
+)
+def sync_detections(
+    normal_user_id: Optional[int] = None,
+    case_id: Optional[int] = None,
+    since: Optional[str] = None,
+    limit: int = Query(500, ge=1, le=1000),
+    db: Session = Depends(utils.get_db),
+):
+    """
+    Detections of a user or case created, updated or deleted after the `since` sync token.
+    Omit `since` for a full download. Store the returned `sync_token` and send it next time,
+    repeating while `has_more` is true. Answers 304 when nothing changed, and 410 when the
+    token is too old and the client must sync from scratch.
+    """
+    page = crud.sync_detections(db, since, limit, normal_user_id=normal_user_id, case_id=case_id)
+    if page is None:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED)
+    return page
 
 
+# --------------------------------------
+# Event Endpoints
+# --------------------------------------
+
+def _event_channel(token: str) -> str:
+    """Authenticate a stream with a short-lived session, so no connection is held while it runs."""
+    db = database.SessionLocal()
+    try:
+        user = auth.get_current_user(db, token)
+    finally:
+        db.close()
+    if isinstance(user, models.Admin):
+        return "admin"
+    if isinstance(user, models.Doctor):
+        return f"doctor:{user.id}"
+    return f"normal_user:{user.id}"
 
 
+@router.get("/events", response_class=StreamingResponse, responses={200: {"content": {"text/event-stream": {}}}})
+async def stream_events(request: Request, token: Optional[str] = None):
+    """
+    Server-sent events for new and processed detections: a doctor receives those of their
+    cases, a user their own, an admin all of them. Browsers' EventSource cannot send headers,
+    so the access token may be passed as `?token=`. On a `resync` event, or after
+    reconnecting, catch up through /sync/detections.
+    """
+    authorization = request.headers.get("authorization", "")
+    if authorization.lower().startswith("bearer "):
+        token = authorization[7:]
+    if not token:
+        raise HTTPException(status_code=401, detail="Not authenticated", headers={"WWW-Authenticate": "Bearer"})
+    channel = await run_in_threadpool(_event_channel, token)
+    try:
+        subscription = events.hub.subscribe(channel)
+    except events.TooManySubscribers:
+        raise HTTPException(status_code=503, detail="Too many event streams open. Try again later.", headers={"Retry-After": "30"})
+    return StreamingResponse(
+        events.stream(subscription),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# --------------------------------------
+# Search Endpoints
+# --------------------------------------
+
+@router.get("/search", response_model=schemas.SearchResponse)
+def search(
+    q: str = Query(..., min_length=1),
+    scope: str = "all",
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0),
+    case_id: Optional[int] = None,
+    normal_user_id: Optional[int] = None,
+    db: Session = Depends(utils.get_db),
+):
+    """
+    Ranked full-text search over article title/author/content and detection result/description.
+    `scope` is one of 'all', 'articles' or 'detections'; `case_id` / `normal_user_id` narrow detection hits.
+    """
+    return crud.search_content(db, q, scope=scope, limit=limit, offset=offset,
+                               case_id=case_id, normal_user_id=normal_user_id)
+
+
+# --------------------------------------
+# Near-Duplicate Endpoints
+# --------------------------------------
+
+@router.get("/detections/{detection_id}/similar", response_model=List[schemas.SimilarDetection])
+def get_similar_detections(
+    detection_id: int,
+    max_distance: int = Query(phash.PHASH_MAX_DISTANCE, ge=0, le=32),
+    limit: int = Query(20, ge=1, le=100),
+    db: Session = Depends(utils.get_db),
+):
+    """
+    Other detections by the same user or doctor whose image is a duplicate or near-duplicate
+    of this one: perceptual hashes at most `max_distance` bits apart, nearest first.
+    """
+    return crud.get_similar_to_detection(db, detection_id, max_distance, limit)
+
+
+@router.post("/detections/similar", response_model=List[schemas.SimilarDetection])
+def find_similar_detections(
+    image_file: UploadFile = File(...),
+    normal_user_id: Optional[int] = Form(None),
+    doctor_id: Optional[int] = Form(None),
+    max_distance: int = Form(phash.PHASH_MAX_DISTANCE),
+    limit: int = Form(20),
+    db: Session = Depends(utils.get_db),
+):
+    """
+    Check an image against the detections of `normal_user_id` or `doctor_id` before
+    submitting it, so a re-upload can reuse an earlier result.
+    """
+    if not 0 <= max_distance <= 32 or not 1 <= limit <= 100:
+        raise HTTPException(status_code=400, detail="max_distance must be 0-32 and limit 1-100.")
+    return crud.get_similar_to_upload(db, image_file, max_distance, limit,
+                                      normal_user_id=normal_user_id, doctor_id=doctor_id)
+
+
+# --------------------------------------
+# Upload Endpoints
+# --------------------------------------
+
+@router.post("/uploads/detections", response_model=schemas.UploadTicket)
+def request_detection_upload(filename: str = Form(...), content_type: Optional[str] = Form(None)):
+    """
+    Reserve a detection image upload. Send the image to the returned `url` (with `fields`
+    for a presigned POST), then create the detection with `upload_token` instead of `image_file`.
+    """
+    return uploads.issue_upload("detections", filename, content_type)
+
+
+@router.put("/uploads/{token}", status_code=status.HTTP_204_NO_CONTENT)
+async def upload_sink(token: str, request: Request):
+    """
+    Local upload sink for storage backends without presigned uploads. The body is the raw
+    image, streamed to storage with the token's size limit enforced as it arrives.
+    """
+    claims = uploads.decode_upload_token(token)
+    if request.headers.get("content-type", "").split(";")[0].strip() != claims["content_type"]:
+        raise HTTPException(status_code=415, detail=f"Content-Type must be {claims['content_type']}.")
+    media_storage = storage.get_storage()
+    if await run_in_threadpool(media_storage.stat, claims["key"]) is not None:
+        raise HTTPException(status_code=409, detail="This upload token has already been used.")
+
+    validator = imaging.HeaderValidator()
+    with tempfile.SpooledTemporaryFile(max_size=1024 * 1024) as buffer:
+        size = 0
+        try:
+            async for chunk in request.stream():
+                size += len(chunk)
+                if size > claims["max_size"]:
+                    raise HTTPException(status_code=413, detail="Upload exceeds the allowed size.")
+                # Reject non-images and oversized dimensions as soon as the header has arrived
+                validator.feed(chunk)
+                buffer.write(chunk)
+            info = validator.finish()
+        except imaging.InvalidImage as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        if info.content_type != claims["content_type"]:
+            raise HTTPException(status_code=400, detail="Uploaded image does not match its declared type.")
+        buffer.seek(0)
+        await run_in_threadpool(media_storage.save, claims["key"], buffer, claims["content_type"])
+
+
+# --------------------------------------
+# Inference Endpoints
+# --------------------------------------
+
+@router.post("/inference/detect", response_model=schemas.InferenceResponse)
+async def detect_syndrome(image_file: UploadFile = File(...)):
+    """
+    Run the server-side classifier on an uploaded face image and return the computed
+    `result` with its confidence, e.g. to fill in a subsequent detection POST.
+    """
+    data = await image_file.read(uploads.MAX_UPLOAD_BYTES + 1)
+    if len(data) > uploads.MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail="Image file is too large.")
+    try:
+        validator = imaging.HeaderValidator()
+        validator.feed(data)
+        validator.finish()
+    except imaging.InvalidImage as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    result, confidence = await inference.batcher.predict(data)
+    return {"result": result, "confidence": confidence, "model": inference.batcher.model_path}
+
+
+# --------------------------------------
+# Health Endpoints
+# --------------------------------------
+
+@router.get("/health")
+def health():
+    """Liveness: the worker is up and serving requests."""
+    return {"status": "ok"}
+
+
+@router.get("/ready")
+def ready():
+    """
+    Readiness: the database answers and this worker's connection pool has a free
+    connection. Load balancers should stop routing here while it returns 503.
+    """
+    pool = database.pool_status()
+    report = {"status": "ok", "database": {"pool": pool}}
+    if pool.get("saturated"):
+        report["status"] = "unavailable"
+        report["database"]["error"] = "connection pool exhausted"
+        return JSONResponse(report, status_code=status.HTTP_503_SERVICE_UNAVAILABLE)
+    started = time.perf_counter()
+    try:
+        with database.engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+    except Exception as e:
+        report["status"] = "unavailable"
+        report["database"]["error"] = type(e).__name__
+        return JSONResponse(report, status_code=status.HTTP_503_SERVICE_UNAVAILABLE)
+    report["database"]["latency_ms"] = round((time.perf_counter() - started) * 1000, 2)
+    report["job_workers"] = jobs.alive_workers()
+    return report
+
+
+@router.get("/metrics")
+def get_metrics():
+    """Snapshot of the in-process metrics of this worker."""
+    return metrics.collect()
+
+
+# --------------------------------------
+# Job Endpoints
+# --------------------------------------
+
+@router.get("/jobs/{job_id}", response_model=schemas.JobResponse)
+def get_job(job_id: int, db: Session = Depends(utils.get_db)):
+    job = jobs.get_job(db, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return {
+        **{column.name: getattr(job, column.name) for column in models.Job.__table__.columns},
+        "result": json.loads(job.result) if job.result else None,
+    }
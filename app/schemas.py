@@ -1,5 +1,6 @@
 # app/schemas.py
 
+from datetime import datetime
 from typing import List, Optional
 from pydantic import BaseModel
 
@@ -17,6 +18,8 @@ class Token(BaseModel):
     user_type: str
     user_id: int
     user_data: Optional[dict] = None
+    refresh_token: Optional[str] = None
+    expires_in: Optional[int] = None
 
 
 
@@ -25,6 +28,10 @@ class LoginRequest(BaseModel):
     password: str
 
 
+class RefreshRequest(BaseModel):
+    refresh_token: str
+
+
 class TokenData(BaseModel):
     email: str
     user_type: str
@@ -53,6 +60,11 @@ class DeleteResponse(BaseModel):
     success: bool
     message: str
 
+
+class DeletionJobAccepted(GenericResponse):
+    job_id: int
+
+
 # Doctor Schemas
 class DoctorBase(BaseModel):
     name: str
@@ -120,6 +132,11 @@ class CaseResponse(CaseBase):
     class Config:
         from_attributes = True
 
+
+class CasePage(BaseModel):
+    items: List[CaseResponse]
+    next_cursor: Optional[str] = None
+
 class SyndromeDetectionBase(BaseModel):
     result: str
     image_url: str
@@ -165,10 +182,32 @@ class SyndromeDetectionResponse(BaseModel):
     gender: Optional[str] = None
     nationality: Optional[str] = None
     description: Optional[str] = None
+    # Filled in by background processing
+    thumbnail_url: Optional[str] = None
+    computed_result: Optional[str] = None
+    computed_confidence: Optional[float] = None
+    phash: Optional[str] = None
+    change_seq: Optional[int] = None
+    created_at: Optional[datetime] = None
 
     class Config:
         from_attributes = True
 
+
+class SyndromeDetectionAccepted(SyndromeDetectionResponse):
+    job_id: int
+
+
+class SimilarDetection(SyndromeDetectionResponse):
+    distance: int
+
+
+class DetectionSyncResponse(BaseModel):
+    items: List[SyndromeDetectionResponse]
+    deleted: List[int]
+    sync_token: str
+    has_more: bool
+
 # Article Schemas
 class ArticleBase(BaseModel):
     id: int
@@ -188,3 +227,89 @@ class ArticleResponse(ArticleBase):
 
     class Config:
         from_attributes = True
+
+
+# Search Schemas
+class SearchHit(BaseModel):
+    type: str
+    id: int
+    score: float
+    snippet: str
+
+
+class SearchResponse(BaseModel):
+    total: int
+    limit: int
+    offset: int
+    hits: List[SearchHit]
+
+
+# Dashboard Schemas
+class CaseWithDetectionsResponse(CaseResponse):
+    detection_count: int
+    syndrome_detections: List[SyndromeDetectionResponse] = []
+
+
+class CaseWithDetectionsPage(BaseModel):
+    items: List[CaseWithDetectionsResponse]
+    next_cursor: Optional[str] = None
+
+
+# Upload Schemas
+class UploadTicket(BaseModel):
+    upload_token: str
+    method: str
+    url: str
+    fields: dict
+    content_type: str
+    max_size: int
+    expires_in: int
+
+
+# Inference Schemas
+class InferenceResponse(BaseModel):
+    result: str
+    confidence: float
+    model: str
+
+
+# Job Schemas
+class JobResponse(BaseModel):
+    id: int
+    kind: str
+    status: str
+    attempts: int
+    max_attempts: int
+    run_after: datetime
+    result: Optional[dict] = None
+    last_error: Optional[str] = None
+    created_at: datetime
+    updated_at: datetime
+
+    class Config:
+        from_attributes = True
+
+
+# Batch-get responses: items in request order, plus the ids that were not found
+class NormalUserBatch(BaseModel):
+    items: List[NormalUserResponse]
+    missing: List[int]
+
+
+class DoctorBatch(BaseModel):
+    items: List[DoctorResponse]
+    missing: List[int]
+
+
+class CaseBatch(BaseModel):
+    items: List[CaseResponse]
+    missing: List[int]
+
+
+class DetectionBatch(BaseModel):
+    items: List[SyndromeDetectionResponse]
+    missing: List[int]
+
+
+class ArchiveJobAccepted(GenericResponse):
+    job_id: int
@@ -0,0 +1,205 @@
+# app/search.py
+
+import logging
+import re
+from typing import Iterable, List, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger(__name__)
+
+# SQLite keeps its own FTS5 copy of the searchable columns (rowid == source id),
+# maintained by the crud create/delete functions. Postgres searches the base
+# tables directly through GIN expression indexes, so it needs no maintenance.
+SQLITE_INDEXES = {
+    "articles_fts": ("articles", ("title", "author", "content")),
+    "detections_fts": ("syndrome_detections", ("result", "description")),
+}
+
+# Column weights for bm25(); title hits outrank author and body hits.
+ARTICLE_WEIGHTS = "10.0, 5.0, 1.0"
+DETECTION_WEIGHTS = "5.0, 1.0"
+
+PG_ARTICLE_VECTOR = (
+    "to_tsvector('english', coalesce(a.title, '') || ' ' || coalesce(a.author, '') || ' ' || coalesce(a.content, ''))"
+)
+PG_DETECTION_VECTOR = (
+    "to_tsvector('english', coalesce(d.result, '') || ' ' || coalesce(d.description, ''))"
+)
+
+
+def _dialect(bind) -> str:
+    return bind.dialect.name
+
+
+def init_search_index(engine) -> None:
+    """
+    Create the full-text indexes if they are missing and backfill them from the base tables.
+    """
+    with engine.begin() as conn:
+        if _dialect(conn) == "sqlite":
+            for fts_table, (source, columns) in SQLITE_INDEXES.items():
+                exists = conn.execute(
+                    text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+                    {"name": fts_table},
+                ).first()
+                if exists:
+                    continue
+                cols = ", ".join(columns)
+                conn.execute(text(f"CREATE VIRTUAL TABLE {fts_table} USING fts5({cols})"))
+                conn.execute(text(f"INSERT INTO {fts_table}(rowid, {cols}) SELECT id, {cols} FROM {source}"))
+                logger.info(f"Built full-text index {fts_table} from {source}.")
+        elif _dialect(conn) == "postgresql":
+            conn.execute(text(
+                f"CREATE INDEX IF NOT EXISTS ix_articles_fts ON articles USING GIN ({PG_ARTICLE_VECTOR.replace('a.', '')})"
+            ))
+            conn.execute(text(
+                f"CREATE INDEX IF NOT EXISTS ix_syndrome_detections_fts ON syndrome_detections "
+                f"USING GIN ({PG_DETECTION_VECTOR.replace('d.', '')})"
+            ))
+        else:
+            logger.warning(f"Full-text search is not supported on {_dialect(conn)}.")
+
+
+# --------------------------------------
+# Incremental index maintenance
+# --------------------------------------
+
+def index_article(db: Session, article) -> None:
+    """Add an article to the index. Call after flush, inside the creating transaction."""
+    if _dialect(db.get_bind()) != "sqlite":
+        return
+    db.execute(
+        text("INSERT INTO articles_fts(rowid, title, author, content) VALUES (:id, :title, :author, :content)"),
+        {"id": article.id, "title": article.title, "author": article.author, "content": article.content},
+    )
+
+
+def remove_article(db: Session, article_id: int) -> None:
+    if _dialect(db.get_bind()) != "sqlite":
+        return
+    db.execute(text("DELETE FROM articles_fts WHERE rowid = :id"), {"id": article_id})
+
+
+def index_detection(db: Session, detection) -> None:
+    """Add a detection to the index. Call after flush, inside the creating transaction."""
+    if _dialect(db.get_bind()) != "sqlite":
+        return
+    db.execute(
+        text("INSERT INTO detections_fts(rowid, result, description) VALUES (:id, :result, :description)"),
+        {"id": detection.id, "result": detection.result, "description": detection.description},
+    )
+
+
+def remove_detections(db: Session, detection_ids: Iterable[int]) -> None:
+    ids = list(detection_ids)
+    if not ids or _dialect(db.get_bind()) != "sqlite":
+        return
+    db.execute(
+        text("DELETE FROM detections_fts WHERE rowid IN (SELECT value FROM json_each(:ids))"),
+        {"ids": "[" + ",".join(str(int(i)) for i in ids) + "]"},
+    )
+
+
+# --------------------------------------
+# Querying
+# --------------------------------------
+
+def _fts5_query(q: str) -> Optional[str]:
+    """
+    Turn free text into a safe FTS5 expression: every word is quoted (so user input
+    can never be parsed as FTS syntax) and the last word matches as a prefix.
+    """
+    terms = re.findall(r"\w+", q)
+    if not terms:
+        return None
+    quoted = ['"' + term + '"' for term in terms]
+    quoted[-1] += "*"
+    return " ".join(quoted)
+
+
+def _sqlite_parts(scope: str, case_id: Optional[int], normal_user_id: Optional[int]) -> List[str]:
+    parts = []
+    if scope in ("all", "articles") and case_id is None and normal_user_id is None:
+        parts.append(
+            "SELECT 'article' AS type, rowid AS id, bm25(articles_fts, " + ARTICLE_WEIGHTS + ") AS rank, "
+            "snippet(articles_fts, -1, '[', ']', '...', 12) AS snippet "
+            "FROM articles_fts WHERE articles_fts MATCH :match"
+        )
+    if scope in ("all", "detections"):
+        filters = ""
+        if case_id is not None:
+            filters += " AND d.case_id = :case_id"
+        if normal_user_id is not None:
+            filters += " AND d.normal_user_id = :normal_user_id"
+        parts.append(
+            "SELECT 'detection' AS type, detections_fts.rowid AS id, bm25(detections_fts, " + DETECTION_WEIGHTS + ") AS rank, "
+            "snippet(detections_fts, -1, '[', ']', '...', 12) AS snippet "
+            "FROM detections_fts JOIN syndrome_detections d ON d.id = detections_fts.rowid "
+            "WHERE detections_fts MATCH :match" + filters
+        )
+    return parts
+
+
+def _postgres_parts(scope: str, case_id: Optional[int], normal_user_id: Optional[int]) -> List[str]:
+    parts = []
+    if scope in ("all", "articles") and case_id is None and normal_user_id is None:
+        parts.append(
+            f"SELECT 'article' AS type, a.id AS id, -ts_rank({PG_ARTICLE_VECTOR}, q) AS rank, "
+            "ts_headline('english', a.content, q, 'StartSel=[, StopSel=], MaxFragments=1') AS snippet "
+            f"FROM articles a, plainto_tsquery('english', :q) q WHERE {PG_ARTICLE_VECTOR} @@ q"
+        )
+    if scope in ("all", "detections"):
+        filters = ""
+        if case_id is not None:
+            filters += " AND d.case_id = :case_id"
+        if normal_user_id is not None:
+            filters += " AND d.normal_user_id = :normal_user_id"
+        parts.append(
+            f"SELECT 'detection' AS type, d.id AS id, -ts_rank({PG_DETECTION_VECTOR}, q) AS rank, "
+            "ts_headline('english', coalesce(d.result, '') || ' ' || coalesce(d.description, ''), q, "
+            "'StartSel=[, StopSel=], MaxFragments=1') AS snippet "
+            f"FROM syndrome_detections d, plainto_tsquery('english', :q) q WHERE {PG_DETECTION_VECTOR} @@ q" + filters
+        )
+    return parts
+
+
+def search(
+    db: Session,
+    q: str,
+    scope: str = "all",
+    limit: int = 20,
+    offset: int = 0,
+    case_id: Optional[int] = None,
+    normal_user_id: Optional[int] = None,
+) -> Tuple[int, List[dict]]:
+    """
+    Ranked full-text search over articles and/or detections.
+    Returns the total number of hits and the requested page, best match first.
+    """
+    dialect = _dialect(db.get_bind())
+    params = {"q": q, "limit": limit, "offset": offset, "case_id": case_id, "normal_user_id": normal_user_id}
+    if dialect == "sqlite":
+        params["match"] = _fts5_query(q)
+        if params["match"] is None:
+            return 0, []
+        parts = _sqlite_parts(scope, case_id, normal_user_id)
+    elif dialect == "postgresql":
+        parts = _postgres_parts(scope, case_id, normal_user_id)
+    else:
+        raise ValueError(f"Full-text search is not supported on {dialect}.")
+    if not parts:
+        return 0, []
+
+    union = " UNION ALL ".join(parts)
+    total = db.execute(text(f"SELECT COUNT(*) FROM ({union}) AS hits"), params).scalar()
+    rows = db.execute(
+        text(f"SELECT type, id, rank, snippet FROM ({union}) AS hits ORDER BY rank, id LIMIT :limit OFFSET :offset"),
+        params,
+    ).mappings().all()
+    hits = [
+        {"type": row["type"], "id": row["id"], "score": -row["rank"], "snippet": row["snippet"]}
+        for row in rows
+    ]
+    return total, hits
@@ -0,0 +1,245 @@
+# app/storage.py
+"""
+Media storage backends.
+
+Media is addressed by key (`<category>/<name>`, e.g. `detections/ab12.jpg`); the
+database keeps the public URL `/media/<key>` whatever the backend.
+
+MEDIA_STORAGE=local (default) writes under MEDIA_ROOT and `/media` is served by
+StaticFiles. MEDIA_STORAGE=s3 stores objects in S3_BUCKET (under S3_PREFIX) and
+`/media` redirects to short-lived presigned URLs. Point S3_ENDPOINT_URL at any
+S3-compatible server (MinIO, `moto_server`, ...) to run against a local stand-in.
+"""
+
+import logging
+import mimetypes
+import os
+import shutil
+import tempfile
+from typing import BinaryIO, Iterator, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+MEDIA_STORAGE = os.getenv("MEDIA_STORAGE", "local")
+MEDIA_ROOT = os.getenv("MEDIA_ROOT", "media")
+S3_BUCKET = os.getenv("S3_BUCKET")
+S3_PREFIX = os.getenv("S3_PREFIX", "media/")
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL")
+S3_REGION = os.getenv("S3_REGION", "us-east-1")
+S3_PRESIGN_EXPIRY = int(os.getenv("S3_PRESIGN_EXPIRY", 300))
+
+CHUNK_SIZE = 1024 * 1024
+MULTIPART_THRESHOLD = 8 * 1024 * 1024
+
+
+class Storage:
+    """Interface every media backend implements."""
+
+    # True when `/media` is served straight from MEDIA_ROOT by the app itself.
+    serves_locally = False
+
+    def save(self, key: str, fileobj: BinaryIO, content_type: Optional[str] = None) -> int:
+        """Stream `fileobj` to `key` and return the number of bytes stored."""
+        raise NotImplementedError
+
+    def delete(self, key: str) -> bool:
+        raise NotImplementedError
+
+    def iter_objects(self, category: str) -> Iterator[Tuple[str, int, float]]:
+        """Yield (name, size, mtime) for every object in a category, sorted by name."""
+        raise NotImplementedError
+
+    def presigned_url(self, key: str) -> str:
+        raise NotImplementedError
+
+    def presigned_upload(self, key: str, content_type: str, max_size: int, expiry: int) -> Optional[dict]:
+        """
+        A signed form (`url`, `fields`) the client can POST the object to directly,
+        or None when the backend has no upload tier of its own.
+        """
+        return None
+
+    def stat(self, key: str) -> Optional[Tuple[int, Optional[str]]]:
+        """(size, content_type) of a stored object, or None if it does not exist."""
+        raise NotImplementedError
+
+    def read_head(self, key: str, length: int) -> bytes:
+        """The first `length` bytes of a stored object."""
+        raise NotImplementedError
+
+    def open(self, key: str) -> BinaryIO:
+        """A readable stream over a stored object; the caller closes it."""
+        raise NotImplementedError
+
+
+class LocalStorage(Storage):
+    serves_locally = True
+
+    def __init__(self, root: str = MEDIA_ROOT):
+        self.root = root
+
+    def path(self, key: str) -> str:
+        relative = os.path.normpath(key)
+        if relative.startswith("..") or os.path.isabs(relative):
+            raise ValueError(f"Invalid media key: {key!r}")
+        return os.path.join(self.root, relative)
+
+    def save(self, key: str, fileobj: BinaryIO, content_type: Optional[str] = None) -> int:
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temporary file and rename, so readers never see a partial file.
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".upload-")
+        try:
+            with os.fdopen(fd, "wb") as buffer:
+                shutil.copyfileobj(fileobj, buffer, CHUNK_SIZE)
+                size = buffer.tell()
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        return size
+
+    def delete(self, key: str) -> bool:
+        try:
+            os.remove(self.path(key))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def iter_objects(self, category: str) -> Iterator[Tuple[str, int, float]]:
+        directory = self.path(category)
+        if not os.path.isdir(directory):
+            return
+        # Only the names are held in memory for sorting; stat() happens lazily.
+        names = sorted(
+            entry.name for entry in os.scandir(directory)
+            if entry.is_file() and not entry.name.startswith(".upload-")
+        )
+        for name in names:
+            try:
+                stat = os.stat(os.path.join(directory, name))
+            except FileNotFoundError:
+                continue
+            yield name, stat.st_size, stat.st_mtime
+
+    def presigned_url(self, key: str) -> str:
+        return f"/media/{key}"
+
+    def stat(self, key: str) -> Optional[Tuple[int, Optional[str]]]:
+        try:
+            size = os.path.getsize(self.path(key))
+        except FileNotFoundError:
+            return None
+        return size, mimetypes.guess_type(key)[0]
+
+    def read_head(self, key: str, length: int) -> bytes:
+        with open(self.path(key), "rb") as f:
+            return f.read(length)
+
+    def open(self, key: str) -> BinaryIO:
+        return open(self.path(key), "rb")
+
+
+class S3Storage(Storage):
+    def __init__(self, bucket: str, prefix: str = S3_PREFIX, endpoint_url: Optional[str] = S3_ENDPOINT_URL,
+                 region: str = S3_REGION, expiry: int = S3_PRESIGN_EXPIRY):
+        try:
+            import boto3
+            from boto3.s3.transfer import TransferConfig
+        except ImportError:
+            raise RuntimeError("MEDIA_STORAGE=s3 requires boto3 (pip install boto3).")
+        self.bucket = bucket
+        self.prefix = prefix
+        self.expiry = expiry
+        self.client = boto3.client("s3", endpoint_url=endpoint_url, region_name=region)
+        # Large bodies go up as multipart uploads, streamed part by part.
+        self.transfer_config = TransferConfig(
+            multipart_threshold=MULTIPART_THRESHOLD, multipart_chunksize=MULTIPART_THRESHOLD,
+        )
+
+    def object_key(self, key: str) -> str:
+        return self.prefix + key
+
+    def save(self, key: str, fileobj: BinaryIO, content_type: Optional[str] = None) -> int:
+        counter = _CountingReader(fileobj)
+        extra = {"ContentType": content_type} if content_type else None
+        self.client.upload_fileobj(counter, self.bucket, self.object_key(key),
+                                   ExtraArgs=extra, Config=self.transfer_config)
+        return counter.count
+
+    def delete(self, key: str) -> bool:
+        self.client.delete_object(Bucket=self.bucket, Key=self.object_key(key))
+        return True
+
+    def iter_objects(self, category: str) -> Iterator[Tuple[str, int, float]]:
+        # ListObjectsV2 returns keys in ascending UTF-8 order, so no sorting is needed.
+        prefix = self.object_key(f"{category}/")
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+            for obj in page.get("Contents", []):
+                name = obj["Key"][len(prefix):]
+                if "/" not in name:
+                    yield name, obj["Size"], obj["LastModified"].timestamp()
+
+    def presigned_url(self, key: str) -> str:
+        return self.client.generate_presigned_url(
+            "get_object", Params={"Bucket": self.bucket, "Key": self.object_key(key)}, ExpiresIn=self.expiry,
+        )
+
+    def presigned_upload(self, key: str, content_type: str, max_size: int, expiry: int) -> Optional[dict]:
+        # A presigned POST (unlike a presigned PUT) lets S3 itself enforce type and size.
+        return self.client.generate_presigned_post(
+            Bucket=self.bucket,
+            Key=self.object_key(key),
+            Fields={"Content-Type": content_type},
+            Conditions=[{"Content-Type": content_type}, ["content-length-range", 1, max_size]],
+            ExpiresIn=expiry,
+        )
+
+    def stat(self, key: str) -> Optional[Tuple[int, Optional[str]]]:
+        from botocore.exceptions import ClientError
+        try:
+            head = self.client.head_object(Bucket=self.bucket, Key=self.object_key(key))
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return None
+            raise
+        return head["ContentLength"], head.get("ContentType")
+
+    def read_head(self, key: str, length: int) -> bytes:
+        obj = self.client.get_object(Bucket=self.bucket, Key=self.object_key(key), Range=f"bytes=0-{length - 1}")
+        return obj["Body"].read()
+
+    def open(self, key: str) -> BinaryIO:
+        return self.client.get_object(Bucket=self.bucket, Key=self.object_key(key))["Body"]
+
+
+class _CountingReader:
+    """File wrapper counting the bytes read through it."""
+
+    def __init__(self, fileobj: BinaryIO):
+        self.fileobj = fileobj
+        self.count = 0
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.fileobj.read(size)
+        self.count += len(data)
+        return data
+
+
+_storage: Optional[Storage] = None
+
+
+def get_storage() -> Storage:
+    global _storage
+    if _storage is None:
+        if MEDIA_STORAGE == "local":
+            _storage = LocalStorage()
+        elif MEDIA_STORAGE == "s3":
+            if not S3_BUCKET:
+                raise ValueError("MEDIA_STORAGE=s3 requires S3_BUCKET.")
+            _storage = S3Storage(S3_BUCKET)
+        else:
+            raise ValueError(f"Unknown MEDIA_STORAGE: {MEDIA_STORAGE!r}")
+        logger.info(f"Using {type(_storage).__name__} for media.")
+    return _storage
@@ -0,0 +1,89 @@
+# app/tasks.py
+"""Background job handlers. Imported by jobs.start_workers() to register them."""
+
+import io
+import logging
+import os
+import time
+from contextlib import closing
+
+from . import archive, changes, crud, events, imaging, inference, models, phash, storage, utils
+from .database import SessionLocal
+from .jobs import handler
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_SIZE = int(os.getenv("THUMBNAIL_SIZE", 256))
+
+DELETERS = {
+    "user": crud.delete_normal_user,
+    "doctor": crud.delete_doctor,
+}
+
+
+@handler("account.delete")
+def delete_account(payload: dict) -> dict:
+    """Batched deletion of a doctor or normal user and everything they own."""
+    db = SessionLocal()
+    try:
+        return DELETERS[payload["user_type"]](db, payload["target_id"])
+    finally:
+        db.close()
+
+
+@handler("detection.process")
+def process_detection(payload: dict) -> dict:
+    """
+    Post-process a freshly created detection: render its thumbnail, hash it for
+    near-duplicate lookup and run the classifier on it. The image was stored
+    without its metadata when the detection was created.
+    """
+    db = SessionLocal()
+    try:
+        detection = db.query(models.SyndromeDetection).filter(models.SyndromeDetection.id == payload["detection_id"]).first()
+        if detection is None:
+            return {"skipped": "detection deleted"}
+
+        media_storage = storage.get_storage()
+        key = utils.media_url_to_key(detection.image_url)
+        with closing(media_storage.open(key)) as f:
+            data = f.read()
+
+        thumbnail = imaging.render_thumbnail(data, THUMBNAIL_SIZE)
+        if thumbnail is not None:
+            thumbnail_key = f"thumbnails/{os.path.splitext(os.path.basename(key))[0]}.jpg"
+            media_storage.save(thumbnail_key, io.BytesIO(thumbnail), "image/jpeg")
+            detection.thumbnail_url = utils.media_key_to_url(thumbnail_key)
+
+        detection.phash = imaging.compute_dhash(data)
+        detection.computed_result, detection.computed_confidence = inference.batcher.predict_blocking(data)
+        changes.touch(db, detection)
+        db.commit()
+        if detection.phash:
+            owner = phash.owner_key(detection.normal_user_id, detection.case.doctor_id if detection.case else None)
+            phash.index.add(owner, detection.id, detection.phash)
+        events.publish_detection(detection, "detection.processed")
+        return {
+            "thumbnail_url": detection.thumbnail_url,
+            "computed_result": detection.computed_result,
+            "computed_confidence": detection.computed_confidence,
+            "phash": detection.phash,
+        }
+    finally:
+        db.close()
+
+
+@handler(archive.JOB_KIND)
+def archive_detections(payload: dict) -> dict:
+    """Move detections older than ARCHIVE_AFTER_DAYS to the archive, one short transaction per batch."""
+    db = SessionLocal()
+    try:
+        archived = 0
+        while True:
+            moved = archive.archive_batch(db)
+            archived += moved
+            if moved < archive.ARCHIVE_BATCH_SIZE:
+                return {"archived": archived}
+            time.sleep(archive.ARCHIVE_BATCH_PAUSE)
+    finally:
+        db.close()
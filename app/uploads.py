@@ -0,0 +1,103 @@
+# app/uploads.py
+"""
+Two-phase direct uploads.
+
+1. `issue_upload` reserves a storage key and returns a signed upload token plus
+   where to send the bytes: a presigned S3 form, or the local upload sink
+   (`PUT /uploads/{token}`) when the backend has no upload tier of its own.
+2. The client uploads the image there, never through the API endpoint itself.
+3. Detection creation passes the token; `claim_upload` checks the signature,
+   then the stored object's size, type and image header, rewrites it without
+   its metadata and returns its media URL, so no detection ever references
+   an image that still carries EXIF or GPS data.
+"""
+
+import io
+import os
+from contextlib import closing
+from typing import Optional
+from uuid import uuid4
+
+from fastapi import HTTPException
+
+from . import auth, imaging, storage, utils
+
+UPLOAD_TOKEN_EXPIRE_SECONDS = int(os.getenv("UPLOAD_TOKEN_EXPIRE_SECONDS", 600))
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", 10 * 1024 * 1024))
+
+UPLOAD_CONTENT_TYPES = {
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".png": "image/png",
+}
+
+
+def issue_upload(category: str, filename: str, content_type: Optional[str] = None) -> dict:
+    file_extension = os.path.splitext(filename)[1].lower()
+    if file_extension not in UPLOAD_CONTENT_TYPES:
+        raise HTTPException(status_code=400, detail="Invalid image format. Supported formats: .jpg, .jpeg, .png")
+    expected_type = UPLOAD_CONTENT_TYPES[file_extension]
+    if content_type and content_type != expected_type:
+        raise HTTPException(status_code=400, detail=f"Content type must be {expected_type} for {file_extension} files.")
+
+    key = f"{category}/{uuid4().hex}{file_extension}"
+    token = auth.create_signed_token(
+        {"purpose": "upload", "key": key, "content_type": expected_type, "max_size": MAX_UPLOAD_BYTES},
+        UPLOAD_TOKEN_EXPIRE_SECONDS,
+    )
+    form = storage.get_storage().presigned_upload(key, expected_type, MAX_UPLOAD_BYTES, UPLOAD_TOKEN_EXPIRE_SECONDS)
+    if form:
+        method, url, fields = "POST", form["url"], form["fields"]
+    else:
+        method, url, fields = "PUT", f"/uploads/{token}", {}
+    return {
+        "upload_token": token,
+        "method": method,
+        "url": url,
+        "fields": fields,
+        "content_type": expected_type,
+        "max_size": MAX_UPLOAD_BYTES,
+        "expires_in": UPLOAD_TOKEN_EXPIRE_SECONDS,
+    }
+
+
+def decode_upload_token(token: str) -> dict:
+    claims = auth.decode_signed_token(token)
+    if not claims or claims.get("purpose") != "upload" or "key" not in claims:
+        raise HTTPException(status_code=400, detail="Invalid or expired upload token.")
+    return claims
+
+
+def claim_upload(token: str, category: str) -> str:
+    """Verify an uploaded object against its token and return its media URL."""
+    claims = decode_upload_token(token)
+    key = claims["key"]
+    if not key.startswith(f"{category}/"):
+        raise HTTPException(status_code=400, detail="Upload token is not valid for this resource.")
+
+    media_storage = storage.get_storage()
+    info = media_storage.stat(key)
+    if info is None:
+        raise HTTPException(status_code=400, detail="The upload has not been received.")
+    size, stored_type = info
+    if size == 0 or size > claims["max_size"]:
+        raise HTTPException(status_code=400, detail="Uploaded image is empty or too large.")
+    if stored_type and stored_type != claims["content_type"]:
+        raise HTTPException(status_code=400, detail="Uploaded image has the wrong content type.")
+    try:
+        validator = imaging.HeaderValidator()
+        validator.feed(media_storage.read_head(key, imaging.HEADER_LIMIT))
+        image = validator.finish()
+    except imaging.InvalidImage as e:
+        raise HTTPException(status_code=400, detail=f"Uploaded file is not a valid image: {e}")
+    if image.content_type != claims["content_type"]:
+        raise HTTPException(status_code=400, detail="Uploaded image does not match its declared type.")
+
+    with closing(media_storage.open(key)) as f:
+        data = f.read()
+    try:
+        data = imaging.strip_metadata(data, image.content_type)
+    except imaging.InvalidImage as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    media_storage.save(key, io.BytesIO(data), image.content_type)
+    return utils.media_key_to_url(key)
@@ -1,17 +1,21 @@
 # app/utils.py
 
+import base64
+import binascii
+import json
+import logging
+from typing import Iterable, Optional, Sequence
+
 from sqlalchemy.orm import Session
 from fastapi import Depends, HTTPException, status
 
-from .database import SessionLocal
+from . import storage
+from .database import get_db  # noqa: F401  (re-exported for the routes)
 from .models import Doctor
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+logger = logging.getLogger(__name__)
+
+MEDIA_URL_PREFIX = "/media/"
 
 def verify_doctor_ownership(doctor: Doctor, resource_doctor_id: int):
     if doctor.id != resource_doctor_id:
@@ -19,3 +23,53 @@ def verify_doctor_ownership(doctor: Doctor, resource_doctor_id: int):
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Operation not permitted."
         )
+
+
+def encode_cursor(values: list) -> str:
+    """Encode keyset pagination values as an opaque, URL-safe cursor."""
+    return base64.urlsafe_b64encode(json.dumps(values, separators=(",", ":")).encode()).decode().rstrip("=")
+
+
+def _is_a(value, kind: type) -> bool:
+    # JSON true/false decode to bool, which is an int subclass
+    return isinstance(value, kind) and not isinstance(value, bool)
+
+
+def decode_cursor(cursor: str, types: Optional[Sequence[type]] = None) -> list:
+    """Decode a cursor; with `types`, it must hold exactly one value of each type, in that order."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (binascii.Error, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
+    if not isinstance(values, list):
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
+    if types is not None and (len(values) != len(types) or not all(map(_is_a, values, types))):
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
+    return values
+
+
+def media_url_to_key(url: str) -> str:
+    """Map a stored media URL (`/media/<category>/<name>`) to its storage key."""
+    if not url or not url.startswith(MEDIA_URL_PREFIX):
+        raise ValueError(f"Not a media URL: {url!r}")
+    return url[len(MEDIA_URL_PREFIX):]
+
+
+def media_key_to_url(key: str) -> str:
+    return MEDIA_URL_PREFIX + key
+
+
+def remove_media_files(urls: Iterable[str]) -> int:
+    """Delete the objects behind media URLs, skipping ones already gone. Returns the number removed."""
+    media_storage = storage.get_storage()
+    removed = 0
+    for url in urls:
+        if not url:
+            continue
+        try:
+            if media_storage.delete(media_url_to_key(url)):
+                removed += 1
+        except Exception as e:
+            logger.warning(f"Could not remove media file for {url}: {e}")
+    return removed
@@ -0,0 +1,75 @@
+# bench_startup.py
+"""
+Measure API cold start in fresh interpreters.
+
+    python bench_startup.py [--runs 10] [--importtime]
+
+Each run starts a new Python process and reports, in milliseconds:
+  import   - `import app.main` (module loading and building the app)
+  startup  - running the lifespan startup (schema check, job workers)
+  first    - the first request served (GET /health)
+With --importtime the slowest modules of one extra run are listed as well.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+PROBE = r"""
+import json, time
+t0 = time.perf_counter()
+import app.main
+t1 = time.perf_counter()
+# The test client (httpx) is only the probe's transport; keep its import out of the numbers
+from fastapi.testclient import TestClient
+client_import = time.perf_counter() - t1
+t1 += client_import
+with TestClient(app.main.app) as client:
+    t2 = time.perf_counter()
+    client.get("/health")
+    t3 = time.perf_counter()
+print(json.dumps({"import": (t1 - t0) * 1000, "startup": (t2 - t1) * 1000, "first": (t3 - t2) * 1000}))
+"""
+
+
+def run_once() -> dict:
+    output = subprocess.run([sys.executable, "-c", PROBE], capture_output=True, text=True, check=True, env=os.environ)
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def slowest_imports(count: int = 15) -> list:
+    output = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app.main"],
+                            capture_output=True, text=True, check=True, env=os.environ)
+    rows = []
+    for line in output.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, module = line[len("import time:"):].split("|")
+        rows.append((int(cumulative) / 1000, module.strip()))
+    return sorted(rows, reverse=True)[:count]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark API cold start.")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--importtime", action="store_true", help="also list the slowest imports")
+    args = parser.parse_args()
+
+    results = [run_once() for _ in range(args.runs)]
+    for phase in ("import", "startup", "first"):
+        values = [result[phase] for result in results]
+        print(f"{phase:<8} median {statistics.median(values):8.1f} ms   min {min(values):8.1f} ms   max {max(values):8.1f} ms")
+    total = [sum(result.values()) for result in results]
+    print(f"{'total':<8} median {statistics.median(total):8.1f} ms")
+
+    if args.importtime:
+        print("\nslowest imports (cumulative ms):")
+        for milliseconds, module in slowest_imports():
+            print(f"{milliseconds:8.1f}  {module}")
+
+
+if __name__ == "__main__":
+    main()
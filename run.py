@@ -1,6 +1,126 @@
 # run.py
+"""
+Server launcher.
+
+    python run.py            production: WEB_CONCURRENCY workers (default: one per core)
+    python run.py --reload   development: one auto-reloading process on 127.0.0.1
+
+In production, gunicorn with uvicorn workers is used when installed: the app is
+imported once in the master and forked, workers are recycled after
+MAX_REQUESTS (+ jitter) requests, and SIGTERM drains in-flight requests for up
+to GRACEFUL_TIMEOUT seconds. Without gunicorn, uvicorn's own process manager
+is used with the same limits, but every worker imports the app itself. uvloop
+and httptools are used when installed.
+
+Either way the schema is created once, in the launcher before any worker
+starts (unless INIT_DB_ON_STARTUP=false), and the workers start without it:
+concurrent ALTER TABLEs and backfills from every worker would race at boot.
+"""
+
+import argparse
+import importlib.util
+import os
+
+APP = "app.main:app"
+
+HOST = os.getenv("HOST", "0.0.0.0")
+PORT = int(os.getenv("PORT", 8000))
+WORKERS = int(os.getenv("WEB_CONCURRENCY", os.cpu_count() or 1))
+MAX_REQUESTS = int(os.getenv("MAX_REQUESTS", 10000))
+MAX_REQUESTS_JITTER = int(os.getenv("MAX_REQUESTS_JITTER", 1000))
+GRACEFUL_TIMEOUT = int(os.getenv("GRACEFUL_TIMEOUT", 30))
+KEEPALIVE = int(os.getenv("KEEPALIVE", 5))
+INIT_DB_ON_STARTUP = os.getenv("INIT_DB_ON_STARTUP", "true").lower() == "true"
+
+
+def installed(module: str) -> bool:
+    return importlib.util.find_spec(module) is not None
+
+
+def event_loop() -> str:
+    return "uvloop" if installed("uvloop") else "asyncio"
+
+
+def http_parser() -> str:
+    return "httptools" if installed("httptools") else "h11"
+
+
+def init_schema_once() -> None:
+    """Create the schema in this process, then have the workers skip it."""
+    if INIT_DB_ON_STARTUP:
+        from app.database import get_engine, init_db
+        init_db()
+        get_engine().dispose()
+    # Read by app.main on import, in the preloading master and in every spawned worker
+    os.environ["INIT_DB_ON_STARTUP"] = "false"
+
+
+def run_gunicorn(workers: int) -> None:
+    from gunicorn.app.base import BaseApplication
+
+    class Server(BaseApplication):
+        def load_config(self):
+            settings = {
+                "bind": f"{HOST}:{PORT}",
+                "workers": workers,
+                "worker_class": "uvicorn.workers.UvicornWorker",
+                "preload_app": True,
+                "max_requests": MAX_REQUESTS,
+                "max_requests_jitter": MAX_REQUESTS_JITTER,
+                "graceful_timeout": GRACEFUL_TIMEOUT,
+                "timeout": GRACEFUL_TIMEOUT * 2,
+                "keepalive": KEEPALIVE,
+                "post_fork": post_fork,
+            }
+            for key, value in settings.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            from app.main import app
+            return app
+
+    Server().run()
+
+
+def post_fork(server, worker) -> None:
+    # Connections opened by the preloading master must not be shared with the forked workers
+    from app.database import get_engine
+    if get_engine.cache_info().currsize:
+        get_engine().dispose(close=False)
+
+
+def run_uvicorn(workers: int) -> None:
+    import uvicorn
+
+    uvicorn.run(
+        APP,
+        host=HOST,
+        port=PORT,
+        workers=workers,
+        loop=event_loop(),
+        http=http_parser(),
+        limit_max_requests=MAX_REQUESTS or None,
+        timeout_graceful_shutdown=GRACEFUL_TIMEOUT,
+        timeout_keep_alive=KEEPALIVE,
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run the Syndrome API.")
+    parser.add_argument("--reload", action="store_true", help="single auto-reloading development server")
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    args = parser.parse_args()
+
+    if args.reload:
+        import uvicorn
+        uvicorn.run(APP, host="127.0.0.1", port=PORT, reload=True)
+    elif installed("gunicorn"):
+        init_schema_once()
+        run_gunicorn(args.workers)
+    else:
+        init_schema_once()
+        run_uvicorn(args.workers)
 
-import uvicorn
 
 if __name__ == "__main__":
-    uvicorn.run("app.main:app", host="127.0.0.1", port=8000, reload=True)
+    main()
@@ -0,0 +1,232 @@
+# tests/conftest.py
+"""
+Shared fixtures: an app on a throwaway database, factories for the rows the
+behaviour tests need, and for the query-plan suite a data set of
+representative volume and a recorder of the SQL a request issues.
+
+The database is a temporary SQLite file unless TEST_DATABASE_URL points
+elsewhere (e.g. a scratch Postgres database), so Postgres runs only when it
+is configured.
+"""
+
+import functools
+import io
+import os
+import tempfile
+import threading
+from datetime import datetime, timedelta
+
+_SCRATCH = tempfile.mkdtemp(prefix="syndrome-tests-")
+
+# The app reads its settings on import, so they are fixed before it is imported
+os.environ["DATABASE_URL"] = os.getenv("TEST_DATABASE_URL") or f"sqlite:///{_SCRATCH}/test.db"
+os.environ["MEDIA_ROOT"] = os.path.join(_SCRATCH, "media")
+os.environ["RATE_LIMIT_ENABLED"] = "false"
+os.environ["GROUP_COMMIT"] = "false"
+# No background thread may run queries while a request is being recorded
+os.environ["REVOCATION_SYNC_SECONDS"] = "86400"
+os.environ["PHASH_REBUILD_SECONDS"] = "86400"
+os.environ["DELETE_CHUNK_PAUSE"] = "0"
+# Archival is opt-in; the suite turns it on to cover it
+os.environ["ARCHIVE_AFTER_DAYS"] = "365"
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import event, text
+
+from app import archive, auth, changes, models, search
+from app.database import SessionLocal, get_engine
+from app.main import create_app
+
+DOCTORS = 20
+CASES_PER_DOCTOR = 50
+DETECTIONS_PER_CASE = 3
+NORMAL_USERS = 500
+DETECTIONS_PER_USER = 2
+ARTICLES = 30
+PASSWORD = "correct horse"
+
+
+@pytest.fixture(scope="session")
+def client():
+    with TestClient(create_app(run_jobs=False)) as client:
+        yield client
+
+
+@pytest.fixture
+def db(client):
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+_unique = iter(range(10**9))
+# bcrypt is slow on purpose; one hash per password serves every factory call
+_password_hash = functools.lru_cache(maxsize=None)(auth.get_password_hash)
+
+
+def add_doctor(db, password: str = PASSWORD) -> models.Doctor:
+    n = next(_unique)
+    doctor = models.Doctor(name=f"Doctor {n}", email=f"doctor-{n}@example.org", phone="0100",
+                           hashed_password=_password_hash(password), profile_image=f"/media/users/d{n}.jpg")
+    db.add(doctor)
+    db.commit()
+    return doctor
+
+
+def add_normal_user(db, password: str = PASSWORD) -> models.NormalUser:
+    n = next(_unique)
+    user = models.NormalUser(name=f"User {n}", email=f"user-{n}@example.org", phone="0110",
+                             hashed_password=_password_hash(password), profile_image=f"/media/users/u{n}.jpg")
+    db.add(user)
+    db.commit()
+    return user
+
+
+def add_case(db, doctor: models.Doctor) -> models.Case:
+    case = models.Case(doctor_id=doctor.id, name=f"Patient {next(_unique)}", age=5, gender="male", nationality="EG")
+    db.add(case)
+    db.commit()
+    return case
+
+
+@pytest.fixture(scope="session")
+def seed(client) -> dict:
+    """Insert the data set once and return the ids and credentials the tests use."""
+    db = SessionLocal()
+    try:
+        hashed = auth.get_password_hash(PASSWORD)
+        db.add(models.Admin(name="admin", email="admin@example.com", hashed_password=hashed))
+        doctors = [
+            models.Doctor(name=f"Doctor {i}", email=f"doctor{i}@example.com", phone=f"0100{i:04d}",
+                          hashed_password=hashed, profile_image=f"/media/doctors/{i}.jpg")
+            for i in range(DOCTORS)
+        ]
+        users = [
+            models.NormalUser(name=f"User {i}", email=f"user{i}@example.com", phone=f"0110{i:04d}",
+                              hashed_password=hashed, profile_image=f"/media/users/{i}.jpg")
+            for i in range(NORMAL_USERS)
+        ]
+        db.add_all(doctors + users)
+        db.flush()
+
+        cases = [
+            models.Case(doctor_id=doctor.id, name=f"Patient {doctor.id}-{i}", age=i % 18,
+                        gender="male" if i % 2 else "female", nationality=("EG", "SA", "AE")[i % 3],
+                        description="Referred for facial analysis")
+            for doctor in doctors for i in range(CASES_PER_DOCTOR)
+        ]
+        db.add_all(cases)
+        db.flush()
+
+        results = ("Down syndrome", "Williams syndrome", "Noonan syndrome", "Normal")
+        detections = [
+            models.SyndromeDetection(case_id=case.id, result=results[(case.id + i) % 4],
+                                     image_url=f"/media/detections/c{case.id}-{i}.jpg", date_of_detection="2024-05-01",
+                                     description="Frontal photo", phash=f"{(case.id * 7 + i) * 2654435761 % 2**64:016x}")
+            for case in cases for i in range(DETECTIONS_PER_CASE)
+        ] + [
+            models.SyndromeDetection(normal_user_id=user.id, result=results[(user.id + i) % 4],
+                                     image_url=f"/media/detections/u{user.id}-{i}.jpg", date_of_detection="2024-05-01",
+                                     name=user.name, age=30, gender="female", nationality="EG", description="Selfie",
+                                     phash=f"{(user.id * 13 + i) * 2654435761 % 2**64:016x}")
+            for user in users for i in range(DETECTIONS_PER_USER)
+        ]
+        db.add_all(detections)
+        db.flush()
+        for seq, detection in enumerate(detections, start=1):
+            detection.change_seq = seq
+            search.index_detection(db, detection)
+        db.query(models.ChangeCounter).filter(models.ChangeCounter.name == changes.COUNTER).update({"value": len(detections)})
+
+        articles = [
+            models.Article(title=f"Understanding syndrome {i}", author="Staff", photo_url=f"/media/articles/{i}.jpg",
+                           content="Genetic syndromes and facial features. " * 20)
+            for i in range(ARTICLES)
+        ]
+        db.add_all(articles)
+        db.flush()
+        for article in articles:
+            search.index_article(db, article)
+        db.commit()
+
+        # An archive: one old detection of every tenth case and user, moved into segments
+        archived_at = datetime.utcnow() - timedelta(days=archive.ARCHIVE_AFTER_DAYS + 30)
+        db.add_all(
+            models.SyndromeDetection(case_id=case.id, result="Normal", image_url=f"/media/detections/a{case.id}.jpg",
+                                     date_of_detection="2020-01-01", description="Archived", created_at=archived_at)
+            for case in cases[::10]
+        )
+        db.add_all(
+            models.SyndromeDetection(normal_user_id=user.id, result="Normal", image_url=f"/media/detections/a-u{user.id}.jpg",
+                                     date_of_detection="2020-01-01", name=user.name, age=30, gender="female",
+                                     nationality="EG", description="Archived", created_at=archived_at)
+            for user in users[::10]
+        )
+        db.commit()
+        archive.archive_batch(db)
+
+        # A job history: mostly finished work, as the queue of a running system holds
+        db.add_all(
+            models.Job(kind=("detection.process", "account.delete", archive.JOB_KIND)[i % 3], payload="{}",
+                       status="succeeded" if i % 50 else "failed", attempts=1)
+            for i in range(2000)
+        )
+        db.commit()
+        # Planner statistics, as a long-running database would have
+        db.execute(text("ANALYZE"))
+        db.commit()
+        return {
+            "doctor_id": doctors[3].id,
+            "doctor_email": doctors[3].email,
+            "user_id": users[7].id,
+            "user_email": users[7].email,
+            "case_id": cases[42].id,
+            "case_ids": [case.id for case in cases[:25]],
+            "detection_id": detections[10].id,
+            "detection_ids": [detection.id for detection in detections[:25]],
+            "article_id": articles[0].id,
+        }
+    finally:
+        db.close()
+
+
+class QueryRecorder:
+    """Collects (statement, parameters) of everything sent to the database while active."""
+
+    def __init__(self):
+        self.statements = []
+        self.active = False
+        self.lock = threading.Lock()
+
+    def __call__(self, conn, cursor, statement, parameters, context, executemany):
+        if self.active:
+            with self.lock:
+                self.statements.append((statement, parameters[0] if executemany and parameters else parameters))
+
+    def __enter__(self):
+        self.statements = []
+        self.active = True
+        return self
+
+    def __exit__(self, *exc):
+        self.active = False
+
+
+@pytest.fixture(scope="session")
+def recorder(client):
+    recorder = QueryRecorder()
+    event.listen(get_engine(), "before_cursor_execute", recorder)
+    yield recorder
+    event.remove(get_engine(), "before_cursor_execute", recorder)
+
+
+@pytest.fixture(scope="session")
+def jpeg() -> bytes:
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    Image.new("RGB", (64, 64), (180, 120, 90)).save(buffer, "JPEG")
+    return buffer.getvalue()
@@ -0,0 +1,101 @@
+# tests/test_archive.py
+
+import io
+from datetime import datetime, timedelta
+
+from app import archive, media_gc, models, storage
+from app.database import get_engine
+
+from .conftest import add_normal_user
+
+
+def _old_detection(db, user, name: str) -> models.SyndromeDetection:
+    media_storage = storage.get_storage()
+    media_storage.save(f"detections/{name}.jpg", io.BytesIO(b"image"), "image/jpeg")
+    media_storage.save(f"thumbnails/{name}.jpg", io.BytesIO(b"thumb"), "image/jpeg")
+    detection = models.SyndromeDetection(
+        normal_user_id=user.id, result="Normal", date_of_detection="2020-01-01",
+        image_url=f"/media/detections/{name}.jpg", thumbnail_url=f"/media/thumbnails/{name}.jpg",
+        name=user.name, age=30, gender="female", nationality="EG", description="Old",
+        created_at=datetime.utcnow() - timedelta(days=archive.ARCHIVE_AFTER_DAYS + 30),
+    )
+    db.add(detection)
+    db.commit()
+    return detection
+
+
+def _stored(key: str) -> bool:
+    return storage.get_storage().stat(key) is not None
+
+
+def test_media_gc_keeps_archived_media(db):
+    user = add_normal_user(db)
+    _old_detection(db, user, "archived-keep")
+    storage.get_storage().save("detections/archived-orphan.jpg", io.BytesIO(b"orphan"), "image/jpeg")
+
+    assert archive.archive_batch(db) == 1
+    assert db.query(models.SyndromeDetection).filter(models.SyndromeDetection.normal_user_id == user.id).count() == 0
+
+    media_gc.reconcile(db, ["detections", "thumbnails"], delete=True, pause=0, min_age=0)
+
+    assert _stored("detections/archived-keep.jpg")
+    assert _stored("thumbnails/archived-keep.jpg")
+    assert not _stored("detections/archived-orphan.jpg")
+    urls = [row["image_url"] for row in archive.archived_detections(db, normal_user_ids=[user.id])]
+    assert urls == ["/media/detections/archived-keep.jpg"]
+
+
+def test_deleting_archive_releases_its_media(db):
+    user = add_normal_user(db)
+    _old_detection(db, user, "archived-release")
+    archive.archive_batch(db)
+
+    removed = archive.delete_archived(db, "normal_user", [user.id])
+    db.commit()
+
+    assert removed["detections"] == 1
+    assert db.query(models.ArchivedMedia).filter(models.ArchivedMedia.url.like("%archived-release%")).count() == 0
+    media_gc.reconcile(db, ["detections"], delete=True, pause=0, min_age=0)
+    assert not _stored("detections/archived-release.jpg")
+
+
+def test_backfill_lists_media_of_older_segments(db):
+    user = add_normal_user(db)
+    _old_detection(db, user, "archived-backfill")
+    archive.archive_batch(db)
+    # A segment written before archived_media existed
+    db.query(models.ArchivedMedia).filter(models.ArchivedMedia.url.like("%archived-backfill%")).delete(synchronize_session=False)
+    db.commit()
+
+    archive.backfill_archived_media(get_engine())
+
+    urls = sorted(url for url, in db.query(models.ArchivedMedia.url).filter(models.ArchivedMedia.url.like("%archived-backfill%")))
+    assert urls == ["/media/detections/archived-backfill.jpg", "/media/thumbnails/archived-backfill.jpg"]
+
+
+def test_archival_is_off_by_default(db, client, monkeypatch):
+    user = add_normal_user(db)
+    _old_detection(db, user, "archived-off")
+    monkeypatch.setattr(archive, "ARCHIVE_AFTER_DAYS", 0)
+
+    assert archive.archive_batch(db) == 0
+    assert db.query(models.SyndromeDetection).filter(models.SyndromeDetection.normal_user_id == user.id).count() == 1
+    assert client.post("/admin/archive").status_code == 409
+
+
+def test_backfilled_detections_age_from_the_upgrade(db):
+    user = add_normal_user(db)
+    # A client-supplied date long past must not make a row stored today look old
+    detection = _old_detection(db, user, "backfilled")
+    db.query(models.SyndromeDetection).filter(models.SyndromeDetection.id == detection.id).update(
+        {"created_at": None}, synchronize_session=False
+    )
+    db.commit()
+    before = datetime.utcnow()
+
+    archive.backfill_created_at(get_engine())
+
+    db.expire_all()
+    assert db.get(models.SyndromeDetection, detection.id).created_at >= before - timedelta(seconds=1)
+    archive.archive_batch(db)
+    assert db.query(models.SyndromeDetection).filter(models.SyndromeDetection.id == detection.id).count() == 1
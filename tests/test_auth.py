@@ -0,0 +1,73 @@
+# tests/test_auth.py
+
+import pytest
+from fastapi import HTTPException
+
+from app import auth, uploads
+
+from .conftest import PASSWORD, add_normal_user
+
+
+def _login(client, db) -> dict:
+    user = add_normal_user(db)
+    response = client.post("/auth/login", json={"email": user.email, "password": PASSWORD})
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def _refresh(client, token: str):
+    return client.post("/auth/refresh", json={"refresh_token": token})
+
+
+def test_refresh_tokens_rotate(client, db):
+    first = _login(client, db)["refresh_token"]
+
+    response = _refresh(client, first)
+
+    assert response.status_code == 200, response.text
+    assert response.json()["refresh_token"] != first
+    assert _refresh(client, response.json()["refresh_token"]).status_code == 200
+
+
+def test_reusing_a_spent_refresh_token_revokes_its_family(client, db):
+    spent = _login(client, db)["refresh_token"]
+    successor = _refresh(client, spent).json()["refresh_token"]
+
+    assert _refresh(client, spent).status_code == 401
+    # The copy was presented, so the legitimate holder's successor is dead too
+    assert _refresh(client, successor).status_code == 401
+
+
+def test_reuse_leaves_other_sessions_alone(client, db):
+    user = add_normal_user(db)
+    sessions = [client.post("/auth/login", json={"email": user.email, "password": PASSWORD}).json() for _ in range(2)]
+    _refresh(client, sessions[0]["refresh_token"])
+
+    assert _refresh(client, sessions[0]["refresh_token"]).status_code == 401
+    assert _refresh(client, sessions[1]["refresh_token"]).status_code == 200
+
+
+def test_access_tokens_authenticate(client, db):
+    session = _login(client, db)
+
+    assert auth.get_current_user(db, session["access_token"]).id == session["user_id"]
+
+
+def test_upload_tokens_are_not_access_tokens(client, db):
+    token = uploads.issue_upload("detections", "photo.jpg")["upload_token"]
+
+    with pytest.raises(HTTPException) as rejected:
+        auth.get_current_user(db, token)
+    assert rejected.value.status_code == 401
+
+
+def test_grants_are_refused_even_with_account_claims(client, db):
+    user = add_normal_user(db)
+    # A grant that happens to name an account still does not log anyone in
+    token = auth.create_signed_token({"purpose": "upload", "key": "detections/x.jpg", "sub": user.email,
+                                      "user_type": "normal_user", "user_id": user.id}, 60)
+
+    with pytest.raises(HTTPException) as rejected:
+        auth.get_current_user(db, token)
+    assert rejected.value.status_code == 401
+    assert client.get("/events", params={"token": token}).status_code == 401
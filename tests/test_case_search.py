@@ -0,0 +1,59 @@
+# tests/test_case_search.py
+
+import pytest
+
+from app import utils
+
+from .conftest import add_case, add_doctor
+
+
+@pytest.fixture
+def doctor_with_cases(db):
+    doctor = add_doctor(db)
+    for _ in range(5):
+        add_case(db, doctor)
+    return doctor
+
+
+def _search(client, doctor, **params):
+    return client.get(f"/doctor/cases/{doctor.id}/search", params=params)
+
+
+@pytest.mark.parametrize("sort", ["id", "-id", "name", "-name", "age", "-age"])
+def test_cursor_pages_through_every_case(client, doctor_with_cases, sort):
+    seen, cursor = [], None
+    while True:
+        params = {"sort": sort, "limit": 2}
+        if cursor:
+            params["cursor"] = cursor
+        page = _search(client, doctor_with_cases, **params).json()
+        seen.extend(case["id"] for case in page["items"])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+    assert len(seen) == len(set(seen)) == 5
+
+
+@pytest.mark.parametrize("sort,values", [
+    ("id", [{"a": 1}]),
+    ("id", ["x"]),
+    ("id", [True]),
+    ("id", [1, 2]),
+    ("id", []),
+    ("name", [{"a": 1}, 2]),
+    ("name", ["Patient", "2"]),
+    ("name", [3, 4]),
+    ("name", ["Patient"]),
+    ("age", ["x", 1]),
+    ("age", [None, 1]),
+])
+def test_malformed_cursor_is_rejected(client, doctor_with_cases, sort, values):
+    response = _search(client, doctor_with_cases, sort=sort, cursor=utils.encode_cursor(values))
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Invalid cursor."
+
+
+@pytest.mark.parametrize("cursor", ["not base64!", "e30", "bnVsbA"])  # garbage, {}, null
+def test_undecodable_cursor_is_rejected(client, doctor_with_cases, cursor):
+    response = _search(client, doctor_with_cases, cursor=cursor)
+    assert response.status_code == 400
@@ -0,0 +1,134 @@
+# tests/test_compression.py
+
+import gzip
+from collections import OrderedDict
+
+import pytest
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from fastapi.testclient import TestClient
+
+from app import compression
+
+BIG = {"items": [{"id": i, "result": "Down syndrome"} for i in range(200)]}
+
+
+@pytest.fixture(scope="module")
+def app_client():
+    app = FastAPI()
+
+    @app.get("/big")
+    def big():
+        return BIG
+
+    @app.get("/small")
+    def small():
+        return {"ok": True}
+
+    @app.get("/private")
+    def private():
+        return JSONResponse(BIG, headers={"Cache-Control": "no-store"})
+
+    @app.get("/encoded")
+    def encoded():
+        return Response(gzip.compress(b"x" * 4096), media_type="text/plain", headers={"Content-Encoding": "gzip"})
+
+    @app.get("/image")
+    def image():
+        return Response(b"\x89PNG" + b"\0" * 4096, media_type="image/png")
+
+    @app.get("/stream")
+    def stream():
+        return StreamingResponse((f"line {i}\n" * 50 for i in range(5)), media_type="text/plain")
+
+    @app.get("/events")
+    def events():
+        return StreamingResponse((f"data: {i}\n\n" for i in range(3)), media_type="text/event-stream")
+
+    app.add_middleware(compression.CompressionMiddleware)
+    with TestClient(app) as client:
+        yield client
+
+
+def _get(client, path: str, accept: str = "gzip"):
+    return client.get(path, headers={"Accept-Encoding": accept})
+
+
+def test_negotiation_prefers_zstd_then_brotli_then_gzip(monkeypatch):
+    monkeypatch.setattr(compression, "ENCODERS", OrderedDict((name, None) for name in ("zstd", "br", "gzip")))
+
+    assert compression.negotiate("gzip, br, zstd") == "zstd"
+    assert compression.negotiate("gzip, br") == "br"
+    assert compression.negotiate("gzip;q=1.0, zstd;q=0.5") == "gzip"
+    assert compression.negotiate("zstd;q=0, *") == "br"
+    assert compression.negotiate("identity") is None
+    assert compression.negotiate("") is None
+
+
+def test_negotiation_only_offers_installed_encoders():
+    assert compression.negotiate("zstd, br, gzip") == next(iter(compression.ENCODERS))
+    assert compression.negotiate("deflate") is None
+
+
+def test_large_json_is_compressed_with_vary(app_client):
+    response = _get(app_client, "/big")
+
+    assert response.headers["content-encoding"] == "gzip"
+    assert "Accept-Encoding" in response.headers["vary"]
+    assert response.json() == BIG
+
+
+def test_bodies_below_the_minimum_are_sent_as_is(app_client):
+    response = _get(app_client, "/small")
+
+    assert "content-encoding" not in response.headers
+    assert len(response.content) < compression.COMPRESSION_MIN_SIZE
+
+
+def test_clients_without_a_shared_encoding_get_identity(app_client):
+    response = _get(app_client, "/big", accept="identity")
+
+    assert "content-encoding" not in response.headers
+    assert response.json() == BIG
+
+
+def test_already_encoded_bodies_are_not_encoded_again(app_client):
+    response = _get(app_client, "/encoded")
+
+    assert response.headers["content-encoding"] == "gzip"
+    # One decode gives the original, so the middleware did not wrap it a second time
+    assert response.content == b"x" * 4096
+
+
+@pytest.mark.parametrize("path", ["/image", "/events"])
+def test_images_and_event_streams_are_sent_as_is(app_client, path):
+    response = _get(app_client, path)
+
+    assert "content-encoding" not in response.headers
+
+
+def test_streamed_text_is_compressed_chunk_by_chunk(app_client):
+    response = _get(app_client, "/stream")
+
+    assert response.headers["content-encoding"] == "gzip"
+    assert "content-length" not in response.headers
+    assert response.text == "".join(f"line {i}\n" * 50 for i in range(5))
+
+
+def test_an_unchanged_body_is_compressed_once(app_client):
+    hits = compression.stats["cache"]["hits"]
+    first, second = _get(app_client, "/big"), _get(app_client, "/big")
+
+    assert first.content == second.content
+    assert compression.stats["cache"]["hits"] > hits
+
+
+def test_no_store_bodies_are_not_cached(app_client):
+    entries = len(compression.cache.entries)
+    hits = compression.stats["cache"]["hits"]
+
+    _get(app_client, "/private")
+    _get(app_client, "/private")
+
+    assert len(compression.cache.entries) == entries
+    assert compression.stats["cache"]["hits"] == hits
@@ -0,0 +1,61 @@
+# tests/test_detections.py
+
+import io
+
+from app import events, models, storage, tasks
+
+from .conftest import add_case, add_doctor
+
+MISSING_ID = 10**9
+
+
+def _post_doctor_detection(client, jpeg: bytes, case_id: int):
+    return client.post("/doctor/detections", files={"image_file": ("photo.jpg", jpeg, "image/jpeg")}, data={
+        "result": "Normal", "date_of_detection": "2024-06-01", "case_id": case_id, "description": "Follow-up",
+    })
+
+
+def test_detection_for_missing_case_is_rejected(client, db, jpeg):
+    before = db.query(models.SyndromeDetection).count()
+
+    response = _post_doctor_detection(client, jpeg, MISSING_ID)
+
+    assert response.status_code == 404
+    assert response.json()["detail"] == "Case not found."
+    assert db.query(models.SyndromeDetection).count() == before
+
+
+def test_detection_for_existing_case_is_accepted(client, db, jpeg):
+    case = add_case(db, add_doctor(db))
+
+    response = _post_doctor_detection(client, jpeg, case.id)
+
+    assert response.status_code == 202, response.text
+    assert response.json()["case_id"] == case.id
+
+
+def _orphan_detection(db, jpeg: bytes) -> models.SyndromeDetection:
+    """A detection whose case has gone, as left by a deletion racing its insert."""
+    storage.get_storage().save("detections/orphan-case.jpg", io.BytesIO(jpeg), "image/jpeg")
+    detection = models.SyndromeDetection(case_id=MISSING_ID, result="Normal", date_of_detection="2024-06-01",
+                                         image_url="/media/detections/orphan-case.jpg", description="Orphan")
+    db.add(detection)
+    db.commit()
+    return detection
+
+
+def test_publishing_detection_without_case_does_not_raise(db, jpeg):
+    detection = _orphan_detection(db, jpeg)
+    published = events.stats["published"]
+
+    events.publish_detection(detection, "detection.created")
+
+    assert events.stats["published"] == published + 1
+
+
+def test_processing_detection_without_case_succeeds(db, jpeg):
+    detection = _orphan_detection(db, jpeg)
+
+    result = tasks.process_detection({"detection_id": detection.id})
+
+    assert result["computed_result"] is not None
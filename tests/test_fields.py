@@ -0,0 +1,55 @@
+# tests/test_fields.py
+
+from app import crud
+
+from .conftest import add_doctor
+
+MISSING_ID = 10**9
+
+
+def test_unknown_fields_are_rejected(client):
+    response = client.get("/admin/doctors", params={"fields": "name,bogus"})
+
+    assert response.status_code == 400
+    assert response.json()["detail"].startswith("Unknown fields: bogus.")
+
+
+def test_columns_outside_the_response_cannot_be_selected(client):
+    response = client.get("/admin/doctors", params={"fields": "hashed_password"})
+
+    assert response.status_code == 400
+
+
+def test_only_the_selected_columns_are_loaded(client, db, recorder):
+    doctor = add_doctor(db)
+
+    with recorder:
+        response = client.get("/admin/doctors", params={"fields": "name"})
+
+    assert response.status_code == 200
+    assert {"id": doctor.id, "name": doctor.name} in response.json()
+    assert all(set(item) == {"id", "name"} for item in response.json())
+    selects = [statement for statement, _ in recorder.statements if "FROM doctors" in statement]
+    assert selects and all("doctors.email" not in select and "hashed_password" not in select for select in selects)
+
+
+def test_batches_keep_request_order_and_report_missing_ids(client, db):
+    first, second = add_doctor(db), add_doctor(db)
+    ids = f"{second.id},{MISSING_ID},{first.id},{second.id}"
+
+    response = client.get("/doctors/batch", params={"ids": ids, "fields": "id,name"})
+
+    assert response.status_code == 200
+    assert [item["id"] for item in response.json()["items"]] == [second.id, first.id]
+    assert response.json()["missing"] == [MISSING_ID]
+
+
+def test_batches_reject_bad_id_lists(client):
+    too_many = ",".join(str(i) for i in range(1, crud.BATCH_MAX_IDS + 2))
+
+    assert client.get("/doctors/batch", params={"ids": too_many}).status_code == 400
+    assert client.get("/doctors/batch", params={"ids": "1,two"}).status_code == 400
+    assert client.get("/doctors/batch", params={"ids": ","}).status_code == 400
+    # Repeats count once against the limit
+    repeated = ",".join(["1"] * (crud.BATCH_MAX_IDS + 1))
+    assert client.get("/doctors/batch", params={"ids": repeated}).status_code == 200
@@ -0,0 +1,144 @@
+# tests/test_groupcommit.py
+
+import threading
+import uuid
+
+import pytest
+from fastapi import HTTPException
+
+from app import groupcommit, models
+
+
+@pytest.fixture
+def writer(client, monkeypatch):
+    # A window wide enough that concurrent calls land in one batch
+    monkeypatch.setattr(groupcommit, "GROUP_COMMIT_WINDOW_MS", 200)
+    writer = groupcommit.GroupCommitWriter()
+    writer.start()
+    yield writer
+    writer.stop()
+
+
+def _insert(title: str):
+    def work(db):
+        article = models.Article(title=title, author="Group", photo_url="/media/articles/g.jpg", content="x")
+        db.add(article)
+        db.flush()
+        return article
+    return work
+
+
+def _fail(db):
+    db.add(models.Article(title="never stored", author="Group", photo_url="/media/articles/g.jpg", content="x"))
+    db.flush()
+    raise ValueError("bad input")
+
+
+def _submit_concurrently(writer, works) -> list:
+    """Submit every work from its own thread at once; each slot holds the result or the exception."""
+    outcomes = [None] * len(works)
+    start = threading.Barrier(len(works))
+
+    def call(i, work):
+        start.wait()
+        try:
+            outcomes[i] = writer.submit(work)
+        except Exception as e:
+            outcomes[i] = e
+
+    threads = [threading.Thread(target=call, args=(i, work)) for i, work in enumerate(works)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return outcomes
+
+
+def _titles(db, titles) -> set:
+    return {title for (title,) in db.query(models.Article.title).filter(models.Article.title.in_(titles))}
+
+
+def test_concurrent_calls_commit_in_one_batch(writer, db):
+    titles = [f"batch {uuid.uuid4()}" for _ in range(8)]
+
+    outcomes = _submit_concurrently(writer, [_insert(title) for title in titles])
+
+    assert [article.title for article in outcomes] == titles
+    assert all(article.id for article in outcomes)
+    assert _titles(db, titles) == set(titles)
+    assert writer.stats["batches"] < len(titles)
+
+
+def test_a_failing_call_leaves_the_rest_of_its_batch(writer, db):
+    titles = [f"isolated {uuid.uuid4()}" for _ in range(4)]
+
+    outcomes = _submit_concurrently(writer, [_insert(titles[0]), _insert(titles[1]), _fail,
+                                             _insert(titles[2]), _insert(titles[3])])
+
+    assert isinstance(outcomes[2], ValueError)
+    assert _titles(db, titles) == set(titles)
+    assert db.query(models.Article).filter(models.Article.title == "never stored").count() == 0
+    assert writer.stats["failed_calls"] == 1
+
+
+def test_a_failed_batch_commit_is_retried_call_by_call(writer, db, monkeypatch):
+    titles = [f"retried {uuid.uuid4()}" for _ in range(3)]
+    commit_batch = writer._commit_batch
+    failures = []
+
+    def fail_once(batch):
+        if not failures:
+            failures.append(len(batch))
+            raise RuntimeError("database is locked")
+        return commit_batch(batch)
+
+    monkeypatch.setattr(writer, "_commit_batch", fail_once)
+
+    outcomes = _submit_concurrently(writer, [_insert(title) for title in titles])
+
+    assert failures and writer.stats["commit_failures"] == 1
+    assert [article.title for article in outcomes] == titles
+    assert _titles(db, titles) == set(titles)
+
+
+def test_a_timed_out_call_is_cancelled_not_committed_later(client, db, monkeypatch):
+    monkeypatch.setattr(groupcommit, "GROUP_COMMIT_TIMEOUT_SECONDS", 0.05)
+    writer = groupcommit.GroupCommitWriter()
+    title = f"timed out {uuid.uuid4()}"
+
+    # No writer thread yet, so the call is still queued when its caller gives up
+    with pytest.raises(HTTPException) as timed_out:
+        writer.submit(_insert(title))
+    assert timed_out.value.status_code == 503
+
+    monkeypatch.setattr(groupcommit, "GROUP_COMMIT_TIMEOUT_SECONDS", 30)
+    writer.start()
+    try:
+        later = f"later {uuid.uuid4()}"
+        assert writer.submit(_insert(later)).title == later
+    finally:
+        writer.stop()
+    assert _titles(db, [title, later]) == {later}
+    assert writer.stats["timed_out"] == 1
+
+
+def test_run_commits_on_the_callers_session_without_the_writer(db, monkeypatch):
+    monkeypatch.setattr(groupcommit, "GROUP_COMMIT", False)
+    title = f"direct {uuid.uuid4()}"
+
+    article = groupcommit.run(db, _insert(title))
+
+    assert article in db
+    db.rollback()
+    assert _titles(db, [title]) == {title}
+
+
+def test_run_attaches_the_writers_objects_to_the_callers_session(writer, db, monkeypatch):
+    monkeypatch.setattr(groupcommit, "GROUP_COMMIT", True)
+    monkeypatch.setattr(groupcommit, "writer", writer)
+    title = f"merged {uuid.uuid4()}"
+
+    article = groupcommit.run(db, _insert(title))
+
+    assert article in db and article.title == title
+    assert _titles(db, [title]) == {title}
@@ -0,0 +1,90 @@
+# tests/test_idempotency.py
+
+import uuid
+
+from app import idempotency, models
+
+from .conftest import add_case, add_doctor
+
+
+def _post_detection(client, jpeg: bytes, case_id: int, key: str):
+    return client.post("/doctor/detections", headers={"Idempotency-Key": key},
+                       files={"image_file": ("photo.jpg", jpeg, "image/jpeg")},
+                       data={"result": "Normal", "date_of_detection": "2024-06-01", "case_id": case_id,
+                             "description": "Follow-up"})
+
+
+def _detections(db, case_id: int) -> int:
+    return db.query(models.SyndromeDetection).filter(models.SyndromeDetection.case_id == case_id).count()
+
+
+def test_retry_with_the_same_key_replays_the_first_response(client, db, jpeg):
+    case = add_case(db, add_doctor(db))
+    key = str(uuid.uuid4())
+
+    first = _post_detection(client, jpeg, case.id, key)
+    retry = _post_detection(client, jpeg, case.id, key)
+
+    assert first.status_code == 202, first.text
+    assert (retry.status_code, retry.json()) == (first.status_code, first.json())
+    assert _detections(db, case.id) == 1
+
+
+def test_a_new_key_runs_the_request_again(client, db, jpeg):
+    case = add_case(db, add_doctor(db))
+
+    first = _post_detection(client, jpeg, case.id, str(uuid.uuid4()))
+    second = _post_detection(client, jpeg, case.id, str(uuid.uuid4()))
+
+    assert first.json()["id"] != second.json()["id"]
+    assert _detections(db, case.id) == 2
+
+
+def test_replayed_registration_does_not_hit_the_duplicate_email_check(client, db, jpeg):
+    key = str(uuid.uuid4())
+    email = f"{key}@example.org"
+
+    def register():
+        return client.post("/user/register", headers={"Idempotency-Key": key},
+                           files={"profile_image": ("me.jpg", jpeg, "image/jpeg")},
+                           data={"name": "Retry", "phone": "0111", "email": email, "password": "correct horse"})
+
+    first, retry = register(), register()
+
+    assert first.status_code == 200, first.text
+    assert retry.status_code == 200 and retry.json() == first.json()
+    assert db.query(models.NormalUser).filter(models.NormalUser.email == email).count() == 1
+
+
+def test_a_key_reused_for_a_different_request_is_refused(client, db, jpeg):
+    first_case, other_case = add_case(db, add_doctor(db)), add_case(db, add_doctor(db))
+    key = str(uuid.uuid4())
+
+    first = _post_detection(client, jpeg, first_case.id, key)
+    reused = _post_detection(client, jpeg, other_case.id, key)
+
+    assert first.status_code == 202, first.text
+    assert reused.status_code == 422
+    assert str(first.json()["id"]) not in reused.text
+    assert _detections(db, other_case.id) == 0
+
+
+def test_a_reencoded_retry_still_replays():
+    # A client that rebuilds the form picks a new multipart boundary; the request is the same
+    body = b'--%s\r\nContent-Disposition: form-data; name="result"\r\n\r\nNormal\r\n--%s--\r\n'
+
+    assert idempotency.fingerprint(b"multipart/form-data; boundary=aaaa", body % (b"aaaa", b"aaaa")) == \
+        idempotency.fingerprint(b"multipart/form-data; boundary=bbbb", body % (b"bbbb", b"bbbb"))
+    assert idempotency.fingerprint(b"application/json", b'{"a": 1}') != \
+        idempotency.fingerprint(b"application/json", b'{"a": 2}')
+
+
+def test_the_store_refuses_a_different_fingerprint(client):
+    # What another worker, without this process's cache, sees for a reused key
+    key = uuid.uuid4().hex
+
+    assert idempotency.claim(key, "a" * 64) == ("claimed", None)
+    assert idempotency.claim(key, "b" * 64) == ("mismatch", None)
+    idempotency.complete(key, (201, [], b"{}"))
+    assert idempotency.claim(key, "a" * 64) == ("done", (201, [], b"{}"))
+    assert idempotency.claim(key, "b" * 64) == ("mismatch", None)
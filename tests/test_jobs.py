@@ -0,0 +1,130 @@
+# tests/test_jobs.py
+
+import json
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import jobs, models, tasks  # noqa: F401  (tasks registers the handlers)
+from app.database import SessionLocal
+
+from .conftest import add_normal_user
+
+# Ahead of any job other tests left queued: workers take the earliest run_after first
+FIRST = datetime(2000, 1, 1)
+
+
+@pytest.fixture
+def enqueue(db):
+    created = []
+
+    def enqueue(kind: str, payload: dict = None, max_attempts: int = 5) -> models.Job:
+        job = jobs.enqueue(db, kind, payload or {}, max_attempts=max_attempts)
+        job.run_after = FIRST
+        db.commit()
+        created.append(job.id)
+        return job
+
+    yield enqueue
+    db.rollback()
+    db.query(models.Job).filter(models.Job.id.in_(created)).delete(synchronize_session=False)
+    db.commit()
+
+
+def _claim(worker_id: str):
+    db = SessionLocal()
+    try:
+        job = jobs.claim_next(db, worker_id)
+        return (job.id, job.attempts, job.locked_by) if job else None
+    finally:
+        db.close()
+
+
+def _reload(db, job) -> models.Job:
+    db.expire_all()
+    return db.get(models.Job, job.id)
+
+
+def test_two_workers_racing_for_a_job_claim_it_once(enqueue, db):
+    job = enqueue("test.noop")
+    start = threading.Barrier(2)
+    claims = [None, None]
+
+    def worker(i):
+        start.wait()
+        claims[i] = _claim(f"worker-{i}")
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    winners = [claim for claim in claims if claim and claim[0] == job.id]
+    assert len(winners) == 1
+    row = _reload(db, job)
+    assert (row.status, row.attempts, row.locked_by) == ("running", 1, winners[0][2])
+
+
+def test_a_job_is_reclaimed_only_after_its_lease_expires(enqueue, db):
+    job = enqueue("test.noop")
+    assert _claim("dead-worker")[0] == job.id
+
+    assert (_claim("other-worker") or (None,))[0] != job.id
+
+    row = _reload(db, job)
+    row.locked_at = datetime.utcnow() - timedelta(seconds=jobs.JOB_LEASE_SECONDS + 1)
+    db.commit()
+    assert _claim("other-worker") == (job.id, 2, "other-worker")
+
+
+def test_a_failed_job_is_retried_after_a_backoff(enqueue, db, monkeypatch):
+    monkeypatch.setitem(jobs.HANDLERS, "test.flaky", lambda payload: 1 / 0)
+    job = enqueue("test.flaky")
+    jobs.run_job(db, jobs.claim_next(db, "worker"))
+
+    row = _reload(db, job)
+    delay = (row.run_after - datetime.utcnow()).total_seconds()
+    assert row.status == "queued" and row.locked_by is None
+    assert "ZeroDivisionError" in row.last_error
+    assert 0 < delay <= jobs.JOB_BACKOFF_BASE
+    assert jobs.backoff_seconds(50) <= jobs.JOB_BACKOFF_MAX
+
+
+def test_a_job_out_of_attempts_is_dead_lettered(enqueue, db, monkeypatch):
+    monkeypatch.setitem(jobs.HANDLERS, "test.flaky", lambda payload: 1 / 0)
+    job = enqueue("test.flaky", max_attempts=2)
+
+    for _ in range(2):
+        jobs.run_job(db, jobs.claim_next(db, "worker"))
+        row = _reload(db, job)
+        row.run_after = FIRST  # skip the backoff
+        db.commit()
+
+    row = _reload(db, job)
+    assert (row.status, row.attempts) == ("failed", 2)
+    # Failed jobs are never due again
+    assert (_claim("worker") or (None,))[0] != job.id
+
+
+def test_a_job_without_a_handler_fails_at_once(enqueue, db):
+    job = enqueue("test.unknown")
+
+    jobs.run_job(db, jobs.claim_next(db, "worker"))
+
+    row = _reload(db, job)
+    assert (row.status, row.attempts) == ("failed", 1)
+    assert "No handler" in row.last_error
+
+
+def test_account_deletion_runs_as_a_job(enqueue, db):
+    user_id = add_normal_user(db).id
+    job = enqueue("account.delete", {"user_type": "user", "target_id": user_id})
+
+    jobs.run_job(db, jobs.claim_next(db, "worker"))
+
+    row = _reload(db, job)
+    assert row.status == "succeeded", row.last_error
+    assert json.loads(row.result) is not None
+    assert db.query(models.NormalUser).filter(models.NormalUser.id == user_id).count() == 0
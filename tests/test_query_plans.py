@@ -0,0 +1,391 @@
+# tests/test_query_plans.py
+"""
+Query-plan regression tests.
+
+Every endpoint that touches the database, and every crud function no endpoint
+reaches, is called once to warm caches and once while its SQL is recorded.
+Each recorded SELECT, UPDATE, DELETE and INSERT ... SELECT is explained with
+`EXPLAIN QUERY PLAN` (SQLite) or `EXPLAIN (FORMAT JSON)` (PostgreSQL, with
+sequential scans discouraged so that only unindexed access falls back to one).
+A case fails when a plan contains:
+
+- a full scan of a table (`SCAN <table>`; a Seq Scan on PostgreSQL), or
+- a temporary B-tree for sorting or grouping (a Sort node on PostgreSQL),
+
+unless the case lists it in ALLOWED, or when it issues more statements than
+tests/query_baseline.json records for it. After an intended change, regenerate
+the counts with `UPDATE_QUERY_BASELINE=1 python -m pytest tests` and review
+the diff. Run against PostgreSQL with TEST_DATABASE_URL=postgresql://...
+"""
+
+import json
+import os
+import re
+from typing import Callable, NamedTuple, Tuple
+
+import pytest
+from sqlalchemy import text
+
+from app import archive, changes, crud, jobs, models
+from app.database import Base, SessionLocal, get_engine
+
+from .conftest import PASSWORD
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "query_baseline.json")
+UPDATE_BASELINE = os.getenv("UPDATE_QUERY_BASELINE", "false").lower() in ("1", "true")
+
+TABLES = set(Base.metadata.tables)
+EXPLAINED = ("SELECT", "WITH", "UPDATE", "DELETE")
+NOT_COUNTED = ("BEGIN", "COMMIT", "ROLLBACK", "SAVEPOINT", "RELEASE")
+
+RANKED = "TEMP B-TREE FOR ORDER BY"
+# Plan problems a case accepts, with the reason. Anything else fails the test.
+ALLOWED = {
+    # Unpaginated full listings: reading every row is what these endpoints do
+    "admin.users": {"SCAN normal_users"},
+    "admin.doctors": {"SCAN doctors"},
+    "admin.detections": {"SCAN syndrome_detections"},
+    "admin.detections.fields": {"SCAN syndrome_detections", "SCAN detection_archive_segments"},
+    "admin.articles": {"SCAN articles"},
+    "crud.get_all_admins": {"SCAN admins"},
+    # Orders at most `limit` x `latest` rows of one page by case
+    "doctor.cases.with_detections": {RANKED, "TEMP B-TREE FOR RIGHT PART OF ORDER BY"},
+    # bm25 relevance is computed per match; ranking sorts the matches
+    "search.all": {RANKED},
+    "search.detections.case": {RANKED},
+    "search.detections.user": {RANKED},
+}
+
+
+# --------------------------------------
+# Plans
+# --------------------------------------
+
+def _sqlite_problems(conn, statement, parameters):
+    problems = []
+    for row in conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters):
+        detail = row[-1]
+        scan = re.match(r"SCAN (\w+)", detail)
+        if scan and scan.group(1) in TABLES:
+            problems.append(f"SCAN {scan.group(1)}")
+        temp = re.search(r"USE TEMP B-TREE FOR (.+)", detail)
+        if temp:
+            problems.append(f"TEMP B-TREE FOR {temp.group(1)}")
+    return problems
+
+
+def _postgres_problems(conn, statement, parameters):
+    problems = []
+    plan = conn.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {statement}", parameters).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    nodes = [plan[0]["Plan"]]
+    while nodes:
+        node = nodes.pop()
+        if node["Node Type"] == "Seq Scan" and node.get("Relation Name") in TABLES:
+            problems.append(f"SCAN {node['Relation Name']}")
+        elif node["Node Type"] in ("Sort", "Incremental Sort"):
+            problems.append("TEMP B-TREE FOR ORDER BY")
+        nodes.extend(node.get("Plans", []))
+    return problems
+
+
+def _explained(statement: str) -> bool:
+    head = statement.lstrip().upper()
+    if head.startswith("INSERT"):
+        return " SELECT " in head
+    return head.startswith(EXPLAINED) and "SQLITE_MASTER" not in head
+
+
+def plan_problems(statements) -> list:
+    """(statement, problem) for every plan problem in the recorded statements."""
+    found = []
+    with get_engine().connect() as conn:
+        dialect = conn.dialect.name
+        if dialect == "postgresql":
+            conn.exec_driver_sql("SET enable_seqscan = off")
+        for statement, parameters in statements:
+            if not _explained(statement):
+                continue
+            if dialect == "sqlite":
+                problems = _sqlite_problems(conn, statement, parameters)
+            elif dialect == "postgresql":
+                problems = _postgres_problems(conn, statement, parameters)
+            else:
+                pytest.skip(f"No plan checks for {dialect}.")
+            found.extend((statement, problem) for problem in problems)
+        conn.rollback()
+    return found
+
+
+# --------------------------------------
+# Baseline
+# --------------------------------------
+
+def _load_baseline() -> dict:
+    if not os.path.exists(BASELINE_PATH):
+        return {}
+    with open(BASELINE_PATH) as f:
+        return json.load(f)
+
+
+@pytest.fixture(scope="session")
+def baseline():
+    counts = _load_baseline()
+    dialect = get_engine().dialect.name
+    yield counts.setdefault(dialect, {})
+    if UPDATE_BASELINE:
+        with open(BASELINE_PATH, "w") as f:
+            json.dump({name: dict(sorted(value.items())) for name, value in sorted(counts.items())}, f, indent=2)
+            f.write("\n")
+
+
+def check(name: str, statements, baseline: dict) -> None:
+    counted = [statement for statement, _ in statements if not statement.lstrip().upper().startswith(NOT_COUNTED)]
+    problems = [(statement, problem) for statement, problem in plan_problems(statements)
+                if problem not in ALLOWED.get(name, set())]
+    if UPDATE_BASELINE:
+        baseline[name] = len(counted)
+    assert not problems, f"{name}: unexpected plans:\n" + "\n".join(
+        f"  {problem}: {' '.join(statement.split())}" for statement, problem in problems
+    )
+    if UPDATE_BASELINE:
+        return
+    assert name in baseline, f"{name} has no query-count baseline; run with UPDATE_QUERY_BASELINE=1."
+    assert len(counted) <= baseline[name], (
+        f"{name} issued {len(counted)} statements, baseline is {baseline[name]}:\n"
+        + "\n".join(f"  {' '.join(statement.split())}" for statement in counted)
+    )
+
+
+# --------------------------------------
+# Endpoints
+# --------------------------------------
+
+class Endpoint(NamedTuple):
+    name: str
+    # (client, seed, jpeg) -> keyword arguments of client.request; may prepare data first
+    request: Callable[..., dict]
+    statuses: Tuple[int, ...] = (200,)
+
+
+def _login(client, email: str) -> dict:
+    response = client.post("/auth/login", json={"email": email, "password": PASSWORD})
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def _image(jpeg: bytes, name: str = "photo.jpg") -> dict:
+    return {name: ("photo.jpg", jpeg, "image/jpeg")}
+
+
+_counter = iter(range(10**6))
+
+
+def _fresh_email(kind: str) -> str:
+    return f"new-{kind}-{next(_counter)}@example.com"
+
+
+def _new_article(client, seed, jpeg) -> int:
+    data = {"title": "Temporary", "author": "Staff", "content": "To be deleted"}
+    response = client.post("/admin/articles", data=data, files=_image(jpeg, "photo"))
+    assert response.status_code == 200, response.text
+    db = SessionLocal()
+    try:
+        return db.query(models.Article.id).order_by(models.Article.id.desc()).first()[0]
+    finally:
+        db.close()
+
+
+def _new_job(client, seed, jpeg) -> int:
+    db = SessionLocal()
+    try:
+        job = jobs.enqueue(db, "account.delete", {"user_type": "user", "target_id": 0})
+        db.commit()
+        return job.id
+    finally:
+        db.close()
+
+
+def _clear_archive_jobs(client, seed, jpeg) -> None:
+    db = SessionLocal()
+    try:
+        db.query(models.Job).filter(models.Job.kind == archive.JOB_KIND).update({"status": "succeeded"})
+        db.commit()
+    finally:
+        db.close()
+
+
+def _user_to_delete(client, seed, jpeg) -> int:
+    seed["deletable_users"] = seed.get("deletable_users", seed["user_id"] + 100) + 1
+    return seed["deletable_users"]
+
+
+ENDPOINTS = [
+    # Authentication
+    Endpoint("auth.login.admin", lambda c, s, j: dict(method="POST", url="/auth/login",
+                                                      json={"email": "admin@example.com", "password": PASSWORD})),
+    Endpoint("auth.login.doctor", lambda c, s, j: dict(method="POST", url="/auth/login",
+                                                       json={"email": s["doctor_email"], "password": PASSWORD})),
+    Endpoint("auth.login.user", lambda c, s, j: dict(method="POST", url="/auth/login",
+                                                     json={"email": s["user_email"], "password": PASSWORD})),
+    Endpoint("auth.refresh", lambda c, s, j: dict(method="POST", url="/auth/refresh",
+                                                  json={"refresh_token": _login(c, s["user_email"])["refresh_token"]})),
+    Endpoint("auth.logout", lambda c, s, j: (lambda tokens: dict(
+        method="POST", url="/auth/logout", json={"refresh_token": tokens["refresh_token"]},
+        headers={"Authorization": f"Bearer {tokens['access_token']}"},
+    ))(_login(c, s["user_email"]))),
+
+    # Admin
+    Endpoint("admin.register", lambda c, s, j: dict(method="POST", url="/admin/register", json={
+        "name": "Admin", "email": _fresh_email("admin"), "password": PASSWORD})),
+    Endpoint("admin.articles", lambda c, s, j: dict(method="GET", url="/admin/articles")),
+    Endpoint("admin.articles.create", lambda c, s, j: dict(method="POST", url="/admin/articles", files=_image(j, "photo"),
+                                                           data={"title": "New", "author": "Staff", "content": "Body"})),
+    Endpoint("admin.articles.delete", lambda c, s, j: dict(method="DELETE", url=f"/admin/articles/{_new_article(c, s, j)}")),
+    Endpoint("admin.delete.user", lambda c, s, j: dict(method="DELETE", url=f"/admin/delete/{_user_to_delete(c, s, j)}/user"),
+             (202,)),
+    Endpoint("admin.delete.doctor", lambda c, s, j: dict(method="DELETE", url=f"/admin/delete/{s['doctor_id']}/doctor"),
+             (202,)),
+    Endpoint("admin.archive", lambda c, s, j: _clear_archive_jobs(c, s, j) or dict(method="POST", url="/admin/archive"),
+             (202,)),
+    Endpoint("admin.users", lambda c, s, j: dict(method="GET", url="/admin/users")),
+    Endpoint("admin.doctors", lambda c, s, j: dict(method="GET", url="/admin/doctors")),
+    Endpoint("admin.detections", lambda c, s, j: dict(method="GET", url="/admin/detections")),
+    Endpoint("admin.detections.fields", lambda c, s, j: dict(method="GET", url="/admin/detections",
+                                                             params={"fields": "id,result", "include_archived": True})),
+
+    # Doctors
+    Endpoint("doctor.register", lambda c, s, j: dict(method="POST", url="/doctor/register", files=_image(j, "profile_image"),
+                                                     data={"name": "Doctor", "phone": "0100", "email": _fresh_email("doctor"),
+                                                           "password": PASSWORD})),
+    Endpoint("doctor.cases.create", lambda c, s, j: dict(method="POST", url=f"/doctor/cases/{s['doctor_id']}", data={
+        "name": "Patient", "age": 4, "gender": "male", "nationality": "EG"})),
+    Endpoint("doctor.cases", lambda c, s, j: dict(method="GET", url=f"/doctor/cases/{s['doctor_id']}")),
+    Endpoint("doctor.cases.fields", lambda c, s, j: dict(method="GET", url=f"/doctor/cases/{s['doctor_id']}",
+                                                         params={"fields": "id,name"})),
+    Endpoint("doctor.cases.search", lambda c, s, j: dict(method="GET", url=f"/doctor/cases/{s['doctor_id']}/search")),
+    Endpoint("doctor.cases.search.name", lambda c, s, j: dict(method="GET", url=f"/doctor/cases/{s['doctor_id']}/search",
+                                                              params={"name_prefix": "Patient", "sort": "name", "limit": 10})),
+    Endpoint("doctor.cases.search.age", lambda c, s, j: dict(method="GET", url=f"/doctor/cases/{s['doctor_id']}/search",
+                                                             params={"min_age": 2, "max_age": 9, "sort": "-age"})),
+    Endpoint("doctor.cases.search.filters", lambda c, s, j: dict(
+        method="GET", url=f"/doctor/cases/{s['doctor_id']}/search",
+        params={"gender": "male", "nationality": "EG", "result": "Down syndrome"})),
+    Endpoint("doctor.cases.with_detections", lambda c, s, j: dict(
+        method="GET", url=f"/doctor/cases/{s['doctor_id']}/with-detections", params={"limit": 20})),
+    Endpoint("doctor.detections.create", lambda c, s, j: dict(
+        method="POST", url="/doctor/detections", files=_image(j, "image_file"),
+        data={"result": "Normal", "date_of_detection": "2024-06-01", "case_id": s["case_id"], "description": "Follow-up"}),
+        (202,)),
+    Endpoint("doctor.detections", lambda c, s, j: dict(method="GET", url=f"/doctor/detections/{s['case_id']}",
+                                                       params={"include_archived": True})),
+    Endpoint("doctor.detections.fields", lambda c, s, j: dict(method="GET", url=f"/doctor/detections/{s['case_id']}",
+                                                              params={"fields": "id,result,image_url"})),
+    Endpoint("doctor.detection_history", lambda c, s, j: dict(
+        method="GET", url=f"/doctor/detection-history/{s['doctor_id']}", params={"include_archived": True})),
+
+    # Normal users
+    Endpoint("user.register", lambda c, s, j: dict(method="POST", url="/user/register", files=_image(j, "profile_image"),
+                                                   data={"name": "User", "phone": "0110", "email": _fresh_email("user"),
+                                                         "password": PASSWORD})),
+    Endpoint("user.detections.create", lambda c, s, j: dict(
+        method="POST", url="/user/detections", files=_image(j, "image_file"),
+        data={"result": "Normal", "date_of_detection": "2024-06-01", "normal_user_id": s["user_id"], "name": "User",
+              "age": 30, "gender": "female", "nationality": "EG", "description": "Selfie"}),
+        (202,)),
+    Endpoint("user.detections", lambda c, s, j: dict(method="GET", url=f"/user/detections/{s['user_id']}",
+                                                     params={"include_archived": True})),
+
+    # Batches
+    Endpoint("batch.users", lambda c, s, j: dict(method="GET", url="/users/batch",
+                                                 params={"ids": ",".join(str(s["user_id"] + i) for i in range(25))})),
+    Endpoint("batch.doctors", lambda c, s, j: dict(method="GET", url="/doctors/batch",
+                                                   params={"ids": f"{s['doctor_id']},{s['doctor_id'] + 1}", "fields": "id,name"})),
+    Endpoint("batch.cases", lambda c, s, j: dict(method="GET", url="/cases/batch",
+                                                 params={"ids": ",".join(map(str, s["case_ids"]))})),
+    Endpoint("batch.detections", lambda c, s, j: dict(method="GET", url="/detections/batch",
+                                                      params={"ids": ",".join(map(str, s["detection_ids"]))})),
+
+    # Sync
+    Endpoint("sync.user", lambda c, s, j: dict(method="GET", url="/sync/detections", params={"normal_user_id": s["user_id"]})),
+    Endpoint("sync.case.since", lambda c, s, j: dict(method="GET", url="/sync/detections", params={
+        "case_id": s["case_id"],
+        "since": c.get("/sync/detections", params={"case_id": s["case_id"]}).json()["sync_token"],
+    }), (304,)),
+
+    # Search and near-duplicates
+    Endpoint("search.all", lambda c, s, j: dict(method="GET", url="/search", params={"q": "syndrome"})),
+    Endpoint("search.detections.case", lambda c, s, j: dict(method="GET", url="/search", params={
+        "q": "down", "scope": "detections", "case_id": s["case_id"]})),
+    Endpoint("search.detections.user", lambda c, s, j: dict(method="GET", url="/search", params={
+        "q": "selfie", "scope": "detections", "normal_user_id": s["user_id"]})),
+    Endpoint("similar.detection", lambda c, s, j: dict(method="GET", url=f"/detections/{s['detection_id']}/similar",
+                                                       params={"max_distance": 32})),
+    Endpoint("similar.upload.doctor", lambda c, s, j: dict(method="POST", url="/detections/similar",
+                                                           files=_image(j, "image_file"),
+                                                           data={"doctor_id": s["doctor_id"], "max_distance": 32})),
+    Endpoint("similar.upload.user", lambda c, s, j: dict(method="POST", url="/detections/similar",
+                                                         files=_image(j, "image_file"),
+                                                         data={"normal_user_id": s["user_id"], "max_distance": 32})),
+
+    # Jobs
+    Endpoint("jobs.get", lambda c, s, j: dict(method="GET", url=f"/jobs/{_new_job(c, s, j)}")),
+]
+
+
+@pytest.mark.parametrize("endpoint", ENDPOINTS, ids=[endpoint.name for endpoint in ENDPOINTS])
+def test_endpoint_queries(endpoint, client, seed, recorder, baseline, jpeg):
+    # The first call fills per-process caches (e.g. the perceptual-hash index); only the second is measured
+    for attempt in range(2):
+        request = endpoint.request(client, seed, jpeg)
+        with recorder:
+            response = client.request(**request)
+        assert response.status_code in endpoint.statuses, response.text
+    check(endpoint.name, recorder.statements, baseline)
+
+
+# --------------------------------------
+# Crud functions no endpoint calls
+# --------------------------------------
+
+CRUD_CALLS = [
+    ("crud.get_admin_by_email", lambda db, s: crud.get_admin_by_email(db, "admin@example.com")),
+    ("crud.get_all_admins", lambda db, s: crud.get_all_admins(db)),
+    ("crud.get_doctor_by_email", lambda db, s: crud.get_doctor_by_email(db, s["doctor_email"])),
+    ("crud.get_normal_user_by_email", lambda db, s: crud.get_normal_user_by_email(db, s["user_email"])),
+    ("crud.get_cases_by_doctor", lambda db, s: crud.get_cases_by_doctor(db, s["doctor_id"])),
+    ("crud.get_case_by_id", lambda db, s: crud.get_case_by_id(db, s["case_id"])),
+    ("crud.get_detections_by_case", lambda db, s: crud.get_detections_by_case(db, s["case_id"])),
+    ("crud.get_detections_by_user", lambda db, s: crud.get_detections_by_user(db, s["user_id"])),
+    ("crud.get_detection_history_for_case", lambda db, s: crud.get_detection_history_for_case(db, s["case_id"])),
+    # Runs at most hourly inside a deletion; forced here so the deletions below skip it
+    ("changes.purge_tombstones", lambda db, s: changes.purge_tombstones(db, force=True)),
+    # The deletions run last: they remove seeded rows other cases read
+    ("crud.delete_normal_user", lambda db, s: crud.delete_normal_user(db, s["user_id"] + 1)),
+    ("crud.delete_doctor", lambda db, s: crud.delete_doctor(db, s["doctor_id"] + 1)),
+    ("crud.delete_user", lambda db, s: crud.delete_user(db, s["user_id"] + 2)),
+]
+
+
+@pytest.mark.parametrize("name,call", CRUD_CALLS, ids=[name for name, _ in CRUD_CALLS])
+def test_crud_queries(name, call, seed, recorder, baseline):
+    db = SessionLocal()
+    try:
+        with recorder:
+            call(db, seed)
+        db.commit()
+    finally:
+        db.close()
+    check(name, recorder.statements, baseline)
+
+
+def test_statistics_present(seed):
+    """The plans above assume planner statistics exist, as they do on a long-running database."""
+    if get_engine().dialect.name != "sqlite":
+        pytest.skip("ANALYZE output is SQLite-specific.")
+    db = SessionLocal()
+    try:
+        assert db.execute(text("SELECT COUNT(*) FROM sqlite_stat1")).scalar() > 0
+    finally:
+        db.close()
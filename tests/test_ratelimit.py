@@ -0,0 +1,102 @@
+# tests/test_ratelimit.py
+"""Admission caps and bucket stores of the rate limiting middleware."""
+
+import asyncio
+import threading
+
+import anyio.to_thread
+
+from app import ratelimit
+
+
+async def _ok(scope, receive, send):
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b""})
+
+
+def _call(middleware, path="/cases"):
+    statuses = []
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            statuses.append(message["status"])
+
+    scope = {"type": "http", "method": "GET", "path": path, "headers": [], "client": ("10.0.0.1", 1)}
+    asyncio.run(middleware(scope, None, send))
+    return statuses[0]
+
+
+def test_default_caps_leave_threadpool_threads_free():
+    async def threadpool_size():
+        return anyio.to_thread.current_default_thread_limiter().total_tokens
+
+    assert sum(ratelimit.CONCURRENCY_LIMITS.values()) < asyncio.run(threadpool_size())
+
+
+def test_sqlite_store_takes_off_the_event_loop(tmp_path, monkeypatch):
+    monkeypatch.setattr(ratelimit, "RATE_LIMIT_ENABLED", True)
+    store = ratelimit.SQLiteStore(str(tmp_path / "buckets.db"))
+    threads = []
+    take = store.take
+
+    def recording_take(*args):
+        threads.append(threading.current_thread())
+        return take(*args)
+
+    store.take = recording_take
+    middleware = ratelimit.RateLimitMiddleware(_ok, store=store)
+    assert _call(middleware) == 200
+    assert threads and threads[0] is not threading.main_thread()
+
+
+def test_sqlite_store_limits_across_instances(tmp_path, monkeypatch):
+    monkeypatch.setattr(ratelimit, "RATE_LIMIT_ENABLED", True)
+    monkeypatch.setitem(ratelimit.RATE_LIMITS, "default", (2.0, 2.0 / 60))
+    path = str(tmp_path / "buckets.db")
+    # Two workers on one host share the file, so the second sees the first one's spending
+    first = ratelimit.RateLimitMiddleware(_ok, store=ratelimit.SQLiteStore(path))
+    second = ratelimit.RateLimitMiddleware(_ok, store=ratelimit.SQLiteStore(path))
+    assert [_call(first), _call(second), _call(first)] == [200, 200, 429]
+
+
+def test_shed_and_cancelled_requests_give_their_slots_back(monkeypatch):
+    monkeypatch.setattr(ratelimit, "RATE_LIMIT_ENABLED", True)
+    monkeypatch.setattr(ratelimit, "ADMISSION_QUEUE_TIMEOUT", 0.01)
+    monkeypatch.setitem(ratelimit.CONCURRENCY_LIMITS, "default", 2)
+
+    async def main():
+        gate = asyncio.Event()
+
+        async def held(scope, receive, send):
+            await gate.wait()
+            await _ok(scope, receive, send)
+
+        middleware = ratelimit.RateLimitMiddleware(held)
+        statuses = []
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                statuses.append(message["status"])
+
+        def request():
+            scope = {"type": "http", "method": "GET", "path": "/cases", "headers": [], "client": ("10.0.0.1", 1)}
+            return asyncio.create_task(middleware(scope, None, send))
+
+        holders = [request() for _ in range(2)]
+        await asyncio.sleep(0)
+        shed = [request() for _ in range(5)]
+        cancelled = request()
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        await asyncio.gather(*shed)
+        # Free the slots just as more queued requests time out
+        late = [request() for _ in range(5)]
+        loop = asyncio.get_running_loop()
+        loop.call_later(0.01, gate.set)
+        await asyncio.gather(*holders, *late, return_exceptions=True)
+        slots = middleware.slots["default"]
+        return statuses, slots._value
+
+    statuses, free = asyncio.run(main())
+    assert statuses.count(503) >= 5
+    assert free == 2
@@ -0,0 +1,82 @@
+# tests/test_revocation.py
+
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import func
+
+from app import auth, models, revocation
+
+from .conftest import add_normal_user
+
+
+def _claims(user, issued_at: datetime, jti: str = None) -> dict:
+    return {"user_type": "normal_user", "user_id": user.id, "jti": jti or uuid.uuid4().hex,
+            "iat": issued_at.timestamp(), "exp": (issued_at + timedelta(minutes=30)).timestamp()}
+
+
+def test_bloom_filter_holds_its_keys_within_the_error_rate():
+    bloom = revocation.BloomFilter(10_000, 0.01)
+    keys = [f"jti:{i}" for i in range(10_000)]
+    for key in keys:
+        bloom.add(key)
+
+    assert all(key in bloom for key in keys)
+    false_positives = sum(f"other:{i}" in bloom for i in range(10_000))
+    assert false_positives < 10_000 * 0.02
+
+
+def test_a_late_committed_revocation_is_picked_up_by_the_next_sync(db):
+    revocations = revocation.RevocationList()
+    revocations.rebuild(db)
+    newest = db.query(func.max(models.RevokedToken.id)).scalar() or 0
+    now = datetime.utcnow()
+    db.add(models.RevokedToken(id=newest + 1000, kind="jti", value="synced", revoked_at=now,
+                               expires_at=now + timedelta(hours=1)))
+    db.commit()
+    revocations.sync(db)
+
+    # Numbered and stamped before the row already synced, committed after it
+    db.add(models.RevokedToken(id=newest + 500, kind="jti", value="late", revoked_at=now - timedelta(seconds=5),
+                               expires_at=now + timedelta(hours=1)))
+    db.commit()
+    revocations.sync(db)
+
+    assert "jti:synced" in revocations.filter
+    assert "jti:late" in revocations.filter
+
+
+def test_is_revoked_checks_tokens_and_principals(db):
+    user = add_normal_user(db)
+    revocations = revocation.RevocationList()
+    revocations.rebuild(db)
+    issued = datetime.utcnow() - timedelta(minutes=1)
+    claims = _claims(user, issued)
+    assert not revocations.is_revoked(db, claims)
+
+    revocations.revoke_token(db, claims)
+    db.commit()
+    assert revocations.is_revoked(db, claims)
+    assert not revocations.is_revoked(db, _claims(user, issued))
+
+    revocations.revoke_principal(db, "normal_user", user.id, timedelta(minutes=30))
+    db.commit()
+    assert revocations.is_revoked(db, _claims(user, issued))
+    # Tokens issued after the account was revoked are fine
+    assert not revocations.is_revoked(db, _claims(user, datetime.utcnow() + timedelta(seconds=5)))
+
+
+def test_revoking_sessions_ends_an_issued_access_token(client, db):
+    user = add_normal_user(db)
+    access_token = auth.create_access_token({"sub": user.email, "user_type": "normal_user", "user_id": user.id},
+                                            expires_delta=timedelta(minutes=30))
+    assert auth.get_current_user(db, access_token).id == user.id
+
+    auth.revoke_user_sessions(db, "normal_user", user.id)
+    db.commit()
+
+    with pytest.raises(HTTPException) as rejected:
+        auth.get_current_user(db, access_token)
+    assert rejected.value.status_code == 401
@@ -0,0 +1,28 @@
+# tests/test_run.py
+
+import run
+from app import database
+
+
+def test_launcher_creates_the_schema_once_for_its_workers(monkeypatch):
+    calls = []
+    monkeypatch.setattr(run, "INIT_DB_ON_STARTUP", True)
+    monkeypatch.setattr(database, "init_db", lambda: calls.append(1))
+    monkeypatch.setenv("INIT_DB_ON_STARTUP", "true")
+
+    run.init_schema_once()
+
+    assert calls == [1]
+    assert run.os.environ["INIT_DB_ON_STARTUP"] == "false"
+
+
+def test_launcher_leaves_the_schema_alone_when_turned_off(monkeypatch):
+    calls = []
+    monkeypatch.setattr(run, "INIT_DB_ON_STARTUP", False)
+    monkeypatch.setattr(database, "init_db", lambda: calls.append(1))
+    monkeypatch.setenv("INIT_DB_ON_STARTUP", "true")
+
+    run.init_schema_once()
+
+    assert calls == []
+    assert run.os.environ["INIT_DB_ON_STARTUP"] == "false"
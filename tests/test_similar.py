@@ -0,0 +1,93 @@
+# tests/test_similar.py
+
+import threading
+import time
+
+from app import crud, models, phash
+
+from .conftest import add_case, add_doctor, add_normal_user
+
+HASH = "00ff00ff00ff00ff"
+NEAR = "00ff00ff00ff00fe"
+
+
+def _detection(db, phash_value: str, **owner) -> models.SyndromeDetection:
+    detection = models.SyndromeDetection(result="Normal", date_of_detection="2024-06-01", phash=phash_value,
+                                         image_url="/media/detections/similar.jpg", **owner)
+    db.add(detection)
+    db.commit()
+    return detection
+
+
+def test_similar_detections_are_searched_per_owner(db):
+    user, other = add_normal_user(db), add_normal_user(db)
+    doctor = add_doctor(db)
+    own = _detection(db, NEAR, normal_user_id=user.id)
+    _detection(db, HASH, normal_user_id=other.id)
+    case_detection = _detection(db, HASH, case_id=add_case(db, doctor).id)
+    phash.index.rebuild(db)
+
+    assert [d.id for d in crud.find_similar_detections(db, HASH, 2, normal_user_id=user.id)] == [own.id]
+    assert [d.id for d in crud.find_similar_detections(db, HASH, 2, doctor_id=doctor.id)] == [case_detection.id]
+    assert phash.index.search(db, phash.owner_key(normal_user_id=user.id), HASH, 64) == {own.id: 1}
+
+
+def test_new_hashes_join_their_owners_tree(db):
+    user = add_normal_user(db)
+    phash.index.rebuild(db)
+    detection = _detection(db, HASH, normal_user_id=user.id)
+
+    phash.index.add(phash.owner_key(normal_user_id=user.id), detection.id, HASH)
+
+    assert phash.index.search(db, phash.owner_key(normal_user_id=user.id), HASH, 0) == {detection.id: 0}
+    assert phash.index.search(db, phash.owner_key(normal_user_id=user.id + 1), HASH, 0) == {}
+
+
+def _counting_rebuilds(index, monkeypatch, pause: float = 0) -> list:
+    rebuilds = []
+    rebuild = index._rebuild
+
+    def counted(db):
+        rebuilds.append(threading.current_thread().name)
+        time.sleep(pause)
+        rebuild(db)
+
+    monkeypatch.setattr(index, "_rebuild", counted)
+    return rebuilds
+
+
+def test_concurrent_first_lookups_build_the_trees_once(db, monkeypatch):
+    index = phash.PerceptualIndex()
+    rebuilds = _counting_rebuilds(index, monkeypatch, pause=0.1)
+    start = threading.Barrier(6)
+
+    def lookup():
+        start.wait()
+        index.search(db, phash.owner_key(normal_user_id=1), HASH, 4)
+
+    threads = [threading.Thread(target=lookup) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(rebuilds) == 1
+
+
+def test_stale_trees_are_served_while_the_background_thread_rebuilds(db, monkeypatch):
+    index = phash.PerceptualIndex()
+    index.rebuild(db)
+    monkeypatch.setattr(phash, "PHASH_REBUILD_SECONDS", 0.05)
+    rebuilds = _counting_rebuilds(index, monkeypatch)
+
+    index.search(db, phash.owner_key(normal_user_id=1), HASH, 4)
+    assert rebuilds == []
+
+    index.start()
+    try:
+        deadline = time.monotonic() + 5
+        while not rebuilds and time.monotonic() < deadline:
+            time.sleep(0.01)
+    finally:
+        index.stop()
+    assert rebuilds and rebuilds[0] == "phash-rebuild"
@@ -0,0 +1,68 @@
+# tests/test_sync.py
+
+from datetime import datetime, timedelta
+
+from app import changes, crud, models
+
+from .conftest import add_case, add_doctor
+
+
+def _case_with_detections(db, count: int = 2):
+    """(doctor id, case id, detection ids) of a new case."""
+    doctor = add_doctor(db)
+    case = add_case(db, doctor)
+    detections = []
+    for i in range(count):
+        detection = models.SyndromeDetection(case_id=case.id, result="Normal", date_of_detection="2024-06-01",
+                                             image_url=f"/media/detections/sync-{case.id}-{i}.jpg", description="Sync")
+        db.add(detection)
+        changes.touch(db, detection)
+        db.commit()
+        detections.append(detection.id)
+    return doctor.id, case.id, detections
+
+
+def _sync(client, case_id: int, since: str = None):
+    return client.get("/sync/detections", params={"case_id": case_id, **({"since": since} if since else {})})
+
+
+def test_an_unchanged_sync_token_gets_304(client, db):
+    _, case_id, detections = _case_with_detections(db)
+    full = _sync(client, case_id)
+    assert full.status_code == 200
+    assert [item["id"] for item in full.json()["items"]] == detections
+
+    assert _sync(client, case_id, full.json()["sync_token"]).status_code == 304
+
+
+def test_deleted_detections_come_back_as_tombstones(client, db):
+    doctor_id, case_id, detections = _case_with_detections(db)
+    token = _sync(client, case_id).json()["sync_token"]
+
+    crud.delete_doctor(db, doctor_id)
+
+    response = _sync(client, case_id, token)
+    assert response.status_code == 200
+    assert response.json()["items"] == []
+    assert response.json()["deleted"] == detections
+    assert _sync(client, case_id, response.json()["sync_token"]).status_code == 304
+
+
+def test_a_token_older_than_purged_tombstones_gets_410(client, db):
+    doctor_id, case_id, detections = _case_with_detections(db)
+    token = _sync(client, case_id).json()["sync_token"]
+    crud.delete_doctor(db, doctor_id)
+    expired = datetime.utcnow() - timedelta(days=changes.TOMBSTONE_RETENTION_DAYS + 1)
+    db.query(models.DetectionTombstone).filter(models.DetectionTombstone.detection_id.in_(detections)).update(
+        {"deleted_at": expired}, synchronize_session=False
+    )
+
+    changes.purge_tombstones(db, force=True)
+    db.commit()
+
+    response = _sync(client, case_id, token)
+    assert response.status_code == 410
+    # A full download still works, and its token is good again
+    fresh = _sync(client, case_id)
+    assert fresh.status_code == 200
+    assert _sync(client, case_id, fresh.json()["sync_token"]).status_code == 304
@@ -0,0 +1,86 @@
+# tests/test_uploads.py
+
+import io
+import struct
+import zlib
+from contextlib import closing
+
+import pytest
+from PIL import Image
+
+from app import storage, utils
+
+from .conftest import add_case, add_doctor
+
+CAMERA_MAKE = 0x010F
+
+
+@pytest.fixture
+def case(db):
+    return add_case(db, add_doctor(db))
+
+
+def _exif_jpeg() -> bytes:
+    exif = Image.Exif()
+    exif[CAMERA_MAKE] = "Phone with GPS"
+    buffer = io.BytesIO()
+    Image.new("RGB", (64, 64), (90, 120, 180)).save(buffer, "JPEG", exif=exif.tobytes())
+    return buffer.getvalue()
+
+
+def _png_header(width: int, height: int) -> bytes:
+    ihdr = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    chunk = struct.pack(">I", len(ihdr)) + b"IHDR" + ihdr + struct.pack(">I", zlib.crc32(b"IHDR" + ihdr))
+    return b"\x89PNG\r\n\x1a\n" + chunk
+
+
+def _post(client, case_id: int, **image):
+    return client.post("/doctor/detections", files=image.get("files"), data={
+        "result": "Normal", "date_of_detection": "2024-06-01", "case_id": case_id, "description": "Upload",
+        **image.get("data", {}),
+    })
+
+
+def _exif(data: bytes) -> dict:
+    with Image.open(io.BytesIO(data)) as image:
+        return dict(image.getexif())
+
+
+def _stored_exif(url: str) -> dict:
+    with closing(storage.get_storage().open(utils.media_url_to_key(url))) as f:
+        return _exif(f.read())
+
+
+def test_jpeg_extension_on_other_bytes_is_rejected(client, case):
+    response = _post(client, case.id, files={"image_file": ("photo.jpg", b"GIF89a" + b"\0" * 64, "image/jpeg")})
+
+    assert response.status_code == 400
+    assert "not a JPEG or PNG" in response.json()["detail"]
+
+
+def test_oversized_dimensions_are_rejected_from_the_header(client, case):
+    # Only the header is sent: the pixel count is refused before anything is decoded
+    response = _post(client, case.id, files={"image_file": ("huge.png", _png_header(50_000, 50_000), "image/png")})
+
+    assert response.status_code == 400
+    assert "exceed the allowed size" in response.json()["detail"]
+
+
+def test_detection_images_are_stored_without_metadata(client, case):
+    jpeg = _exif_jpeg()
+    assert _exif(jpeg)
+
+    response = _post(client, case.id, files={"image_file": ("photo.jpg", jpeg, "image/jpeg")})
+
+    assert response.status_code == 202, response.text
+    assert _stored_exif(response.json()["image_url"]) == {}
+
+
+def test_direct_uploads_are_stripped_when_claimed(client, case):
+    ticket = client.post("/uploads/detections", data={"filename": "photo.jpg"}).json()
+    assert client.put(ticket["url"], content=_exif_jpeg(), headers={"content-type": "image/jpeg"}).status_code == 204
+
+    response = _post(client, case.id, data={"upload_token": ticket["upload_token"]})
+
+    assert response.status_code == 202, response.text
+    assert _stored_exif(response.json()["image_url"]) == {}